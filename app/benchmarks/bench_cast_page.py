@@ -0,0 +1,107 @@
+"""
+Counts the database queries of, and times, a full cast page: the
+search page for a query, with the filmographies and images of its cast.
+Also compares the read model (see 'data/read_model.py') with loading
+the same data through the ORM.
+
+Usage (from the app directory, with a database):
+
+    python benchmarks/bench_cast_page.py 'the martian' [other queries ...]
+
+The first request for each query is a warm-up, which may fetch and
+ingest missing data. The page cache is off, so that every request
+reaches the database.
+"""
+
+import time
+from sqlalchemy import event
+from data.db_conn import engine, db_session
+from data.data_model import Production, Role
+from data import ingest
+from data import read_model
+from data import filmographies
+from webapp import webapp
+
+
+class QueryCounter(object):
+    """ Counts the statements sent to the database.
+    """
+
+    def __init__(self):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args):
+        self.count += 1
+
+
+def measure(func, counter, repeat):
+    """ Returns the number of queries of a call of 'func', and its best
+    time, in seconds, out of 'repeat' calls.
+    """
+    times = []
+    for _ in xrange(repeat):
+        start_count = counter.count
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+        queries = counter.count - start_count
+        db_session.remove()
+    return queries, min(times)
+
+
+def get_page(client, query):
+    response = client.get('/', query_string={'q': query})
+    assert response.status_code == 200
+    return response.data
+
+
+def load_with_orm(production, num_cast_members=4):
+    """ Loads the cast and their filmographies the straightforward ORM
+    way: with lazy loaded relationships, which join 'image_linkable'.
+    """
+    production = Production.query.filter_by(
+                     type=ingest.production_types[production['media_type']],
+                     tmdb_id=production['id']).one()
+    roles = Role.query.filter_by(production_id=production.id,
+                                 department='cast')\
+                      .order_by(Role.billing_order)\
+                      .limit(num_cast_members).all()
+    for role in roles:
+        credits = [credit for credit in role.person.credits
+                   if credit.department == 'cast']
+        sorted(credits, key=lambda credit: credit.production.popularity,
+               reverse=True)
+
+
+def load_with_read_model(production, num_cast_members=4):
+    """ Loads the same data with the read model.
+    """
+    record = read_model.get_production(
+                 ingest.production_types[production['media_type']],
+                 production['id'])
+    cast = read_model.get_cast(record.id, num_cast_members)
+    read_model.get_known_for([member.person_id for member in cast])
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('queries', nargs='+')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    webapp.page_cache_enabled = False
+    webapp.stream_pages = False
+    client = webapp.app.test_client()
+    counter = QueryCounter()
+    for query in args.queries:
+        get_page(client, query)
+        production, _ = filmographies.get_cast_filmographies(query)
+        db_session.remove()
+        for name, func in (
+                ('page', lambda: get_page(client, query)),
+                ('ORM', lambda: load_with_orm(production)),
+                ('read model', lambda: load_with_read_model(production))):
+            queries, best = measure(func, counter, args.repeat)
+            print(u'{}: {}: {} queries, {:.1f} ms.'.format(
+                query, name, queries, 1000*best))
@@ -0,0 +1,47 @@
+"""
+Compares the speed of the two ways of extracting the search results
+metadata from a Google Images search results page: the 'rg_meta'
+scanner and the full HTML parser.
+
+Usage (from the app directory), with pages saved by
+'util/save_html.py':
+
+    python benchmarks/bench_google_images.py r.html [other.html ...]
+"""
+
+import timeit
+from miner.google_images import scan_rg_meta, parse_rg_meta
+
+
+def bench(html, repeat=5, number=10):
+    """ Returns the best time per call, in seconds, of the scanner and
+    of the parser on the given page.
+    """
+    def best(func):
+        return min(timeit.repeat(lambda: func(html), repeat=repeat,
+                                 number=number)) / number
+    return best(scan_rg_meta), best(parse_rg_meta)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('pages', nargs='+',
+                        help='Google Images search results pages, as '
+                             'saved by util/save_html.py')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=10)
+    args = parser.parse_args()
+    for path in args.pages:
+        with open(path, 'rb') as f:
+            html = f.read()
+        scanned, parsed = scan_rg_meta(html), parse_rg_meta(html)
+        if scanned != parsed:
+            print('{}: the scanner and the parser disagree ({} vs. {} '
+                  'results).'.format(path, len(scanned), len(parsed)))
+        scan_time, parse_time = bench(html, args.repeat, args.number)
+        print('{}: {} results. Scanner: {:.2f} ms, parser: {:.2f} ms '
+              '({:.0f}x faster).'.format(path, len(parsed),
+                                         1000*scan_time,
+                                         1000*parse_time,
+                                         parse_time / scan_time))
@@ -0,0 +1,276 @@
+"""
+Times each stage of building the search page in isolation, on recorded
+fixtures (see 'record_fixtures.py'), without network or database:
+
+    decode      JSON decoding of the themoviedb.org responses, as in
+                `themoviedb.get_api_response`
+    rank        reading and ranking the filmographies of the cast, as
+                in `filmographies.get_filmographies`, for credits
+                without a stored popularity (see `fill_popularities`)
+    parse       parsing the Google Images pages, as in
+                `google_images.get_search_results_metadata`
+    render      rendering 'production.html' with all of the above
+
+Usage (from the app directory):
+
+    # Time all fixtures and compare with the baseline:
+    python benchmarks/bench_stages.py
+    # Make the current timings the new baseline:
+    python benchmarks/bench_stages.py --save-baseline
+
+The baseline is stored in 'benchmarks/baseline.json'. A stage that
+takes more than 'tolerance' longer than its baseline is reported as a
+regression, and makes the exit status 1. Timings depend on the
+machine, so compare runs on the same machine, and save a new baseline
+after moving to another one.
+
+Neither the fixtures nor the baseline are committed: they hold
+third-party pages, and timings of one machine. Without fixtures, the
+benchmark is skipped; without a baseline, the timings are printed but
+not compared. Both come with instructions to create them.
+"""
+
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+from collections import OrderedDict
+from miner import themoviedb
+from miner import google_images
+from miner import popularity_table
+from miner.response_cache import make_key
+from data import filmographies
+from data import ingest
+from data import read_model
+from webapp import webapp
+
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+fixtures_dir = os.path.join(benchmarks_dir, 'fixtures')
+baseline_path = os.path.join(benchmarks_dir, 'baseline.json')
+
+# A stage regresses when it is this much slower than its baseline.
+tolerance = 0.25
+
+# As on the search page.
+num_productions = 4
+num_images = 4
+
+
+def load_fixtures():
+    """ Returns the recorded fixtures, by slug.
+    """
+    fixtures = OrderedDict()
+    for name in sorted(os.listdir(fixtures_dir)):
+        if name.endswith('.json'):
+            with io.open(os.path.join(fixtures_dir, name),
+                         encoding='utf-8') as f:
+                fixture = json.load(f)
+            for search in fixture['google_searches']:
+                with open(os.path.join(fixtures_dir, search['file']),
+                          'rb') as f:
+                    search['html'] = f.read()
+            fixtures[name[:-len('.json')]] = fixture
+    return fixtures
+
+
+def recorded_popularities(responses):
+    """ Returns the popularities in the recorded 'popular' lists, as
+    (id, media type, popularity) tuples (see `write_table`).
+    """
+    productions = []
+    for key, text in responses.items():
+        for media_type in ('movie', 'tv'):
+            if key.startswith('/{}/popular'.format(media_type)):
+                productions.extend(
+                    (entry['id'], media_type, entry['popularity'])
+                    for entry in themoviedb.decode(text)['results'])
+    return productions
+
+
+def use_recorded_popularities(responses):
+    """ Makes the popularities in the recorded 'popular' lists the
+    current popularity table, so that rankings don't depend on the
+    table of this machine.
+    """
+    fd, path = tempfile.mkstemp(suffix='.bin')
+    os.close(fd)
+    popularity_table.write_table(path, recorded_popularities(responses))
+    popularity_table.reload_table(path)
+    # The table stays mapped.
+    os.remove(path)
+
+
+def use_recorded_filmographies(cast_filmographies):
+    """ Makes `filmographies.get_filmographies` read the given combined
+    credits cast lists, of the people with ids 1, 2, ..., instead of
+    the KnownFor table. Their movies and TV shows get no popularity,
+    so that they are ranked with the popularity table. Returns the
+    person ids.
+    """
+    records = [read_model.Credit(person_id, rank, credit.get('character'),
+                                 credit['credit_id'], credit['id'],
+                                 ingest.production_types[
+                                     credit['media_type']],
+                                 title(credit), credit.get('poster_path'),
+                                 None, None, None)
+               for person_id, filmography
+               in enumerate(cast_filmographies, 1)
+               for rank, credit in enumerate(filmography, 1)
+               if credit['media_type'] in ingest.production_types]
+    read_model.get_known_for = lambda person_ids: \
+        [record for record in records if record.person_id in person_ids]
+    return range(1, len(cast_filmographies) + 1)
+
+
+def ranked_filmographies(person_ids, production):
+    """ Returns the filmographies of the given people, as on the
+    page: without the given production.
+    """
+    ranked = filmographies.get_filmographies(person_ids)
+    return [[credit for credit in ranked.get(person_id, [])
+             if (credit['id'], credit['media_type']) !=
+                (production['id'], production['media_type'])]
+            for person_id in person_ids]
+
+
+def stages(fixture):
+    """ Returns the stages for the given fixture, as an ordered
+    dictionary of functions without arguments. The page that 'render'
+    renders is prepared up front, from the results of the other stages.
+    """
+    responses = fixture['responses']
+    use_recorded_popularities(responses)
+    production = themoviedb.decode(
+        responses[make_key('/search/multi',
+                           {'query': fixture['query']})])['results'][0]
+    cast = themoviedb.decode(
+        responses[make_key('/{media_type}/{id}/credits'
+                           .format(**production))])['cast']
+    cast = cast[:fixture['num_cast_members']]
+    combined_credits = [themoviedb.decode(
+                            responses[make_key(
+                                '/person/{id}/combined_credits'
+                                .format(**role))])['cast']
+                        for role in cast]
+    person_ids = use_recorded_filmographies(combined_credits)
+    searches = fixture['google_searches']
+
+    def decode():
+        return [themoviedb.decode(text) for text in responses.values()]
+
+    def rank():
+        return ranked_filmographies(person_ids, production)
+
+    def parse():
+        return [google_images.parse_search_results(search['html'])
+                for search in searches]
+
+    images = {(search['title'], search['person'], search['character']):
+              results[:num_images]
+              for search, results in zip(searches, parse())}
+    cast_filmographies = []
+    for role, filmography in zip(cast, rank()):
+        role = dict(role, images_metadata=images.get(
+                   (title(production), role['name'], role['character'])))
+        filmography = [dict(credit, images_metadata=images.get(
+                           (title(credit), role['name'],
+                            credit['character'])))
+                       for credit in filmography[:num_productions]]
+        cast_filmographies.append({'role': role,
+                                   'filmography': filmography})
+
+    def render():
+        with webapp.app.test_request_context():
+            return webapp.render_template(
+                       'production.html',
+                       production_title=title(production),
+                       cast_filmographies=cast_filmographies,
+                       num_images=num_images)
+
+    return OrderedDict([('decode', decode), ('rank', rank),
+                        ('parse', parse), ('render', render)])
+
+
+def title(production):
+    if production['media_type'] == 'movie':
+        return production['title']
+    return production['name']
+
+
+def measure(func, repeat=5, min_time=0.2):
+    """ Returns the best time per call of 'func', in seconds, out of
+    'repeat' rounds of as many calls as take at least 'min_time'
+    seconds.
+    """
+    func()
+    number = 1
+    while timeit.timeit(func, number=number) < min_time:
+        number *= 2
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def run(repeat=5):
+    """ Returns the best time of each stage of each fixture, in
+    seconds, by '<slug>/<stage>'.
+    """
+    timings = OrderedDict()
+    for slug, fixture in load_fixtures().items():
+        for stage, func in stages(fixture).items():
+            timings['{}/{}'.format(slug, stage)] = measure(func, repeat)
+    return timings
+
+
+def compare(timings, baseline):
+    """ Prints the given timings next to the baseline timings. Returns
+    the names of the stages that regressed.
+    """
+    regressions = []
+    for name, seconds in timings.items():
+        line = '{:<40} {:9.3f} ms'.format(name, 1000*seconds)
+        if name in baseline:
+            change = seconds / baseline[name] - 1
+            line += '  {:+6.1%} vs. baseline'.format(change)
+            if change > tolerance:
+                line += '  REGRESSION'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+    if not os.path.isdir(fixtures_dir) or \
+            not any(name.endswith('.json')
+                    for name in os.listdir(fixtures_dir)):
+        print('Skipped: there are no fixtures in {}. To record them, '
+              'set THEMOVIEDB_API_KEY and run:\n\n'
+              "    python benchmarks/record_fixtures.py 'the martian'"
+              .format(fixtures_dir))
+        sys.exit()
+    timings = run(args.repeat)
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)['timings']
+    elif not args.save_baseline:
+        print('There is no baseline in {}, so the timings are not '
+              'compared. Save these as the baseline with:\n\n'
+              '    python benchmarks/bench_stages.py --save-baseline\n'
+              .format(baseline_path))
+    regressions = compare(timings, baseline)
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump({'machine': platform.node(),
+                       'python': platform.python_version(),
+                       'timings': timings}, f, indent=2)
+        print('Saved the baseline to {}.'.format(baseline_path))
+    elif regressions:
+        sys.exit('{} stage(s) regressed.'.format(len(regressions)))
@@ -0,0 +1,322 @@
+"""
+Load-tests the search page ('/') of the webapp, run by gunicorn, with
+local stand-ins for themoviedb.org and Google Images that replay the
+recorded fixtures (see 'record_fixtures.py') with a configurable
+latency. Reports the throughput and the latency percentiles for each
+number of gunicorn workers, so that 'workers' in
+'webapp/gunicorn_conf.py' can be sized from measurements.
+
+Usage (from the app directory, with a database):
+
+    python benchmarks/load_test.py --workers 3 5 9 --concurrency 20 \\
+        --duration 30 --tmdb-latency 0.15 --google-latency 0.4
+
+The webapp is pointed to the stand-ins with THEMOVIEDB_API_URL and
+GOOGLE_SEARCH_URL, and gets its own response cache and rate limit
+files, in a temporary directory, so that neither the real APIs nor
+the caches of a running app are touched. Its popularity table, in the
+same directory, holds the popularities of the recorded 'popular'
+lists, so that no process crawls them (from the stand-in) during the
+test. The page cache is off (see
+'--page-cache'), so that every request reaches the app and the
+database. The queries are those of the fixtures; each is requested
+once before measuring, to warm up the database.
+
+Image searches happen in job workers (see 'miner/jobs.py'), not in
+the webapp. Pass '--job-workers' to also run those against the
+stand-in for Google Images. (They still download thumbnails from the
+urls in the recorded pages.)
+"""
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qs
+import requests
+from miner.response_cache import make_key
+from miner.popularity_table import write_table
+from benchmarks.bench_stages import (load_fixtures, fixtures_dir,
+                                     recorded_popularities)
+
+
+app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, latency):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.latency = latency
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_port)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Be a HTTP/1.1 server, so that clients can keep connections open.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        params = dict((key, values[0]) for key, values
+                      in parse_qs(url.query).items())
+        body, content_type = self.respond(url.path, params)
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_tmdb_handler(responses):
+    """ Returns a handler that serves the given recorded responses (by
+    cache key, see `make_key`) under '/3'.
+    """
+    class TMDBHandler(StubHandler):
+        def respond(self, path, params):
+            if not path.startswith('/3/'):
+                return None, None
+            key = make_key(path[len('/3'):], params)
+            return responses.get(key), 'application/json'
+    return TMDBHandler
+
+
+def make_google_handler(searches):
+    """ Returns a handler that serves the given recorded Google Images
+    searches. Searches that weren't recorded get one of the recorded
+    pages.
+    """
+    pages = dict((normalize(u'{} {}'.format(search['title'],
+                                            search['person'])),
+                  search['html'])
+                 for search in searches)
+    fallback = [search['html'] for search in searches]
+
+    class GoogleHandler(StubHandler):
+        def respond(self, path, params):
+            query = normalize(params.get('q', '').decode('utf-8'))
+            html = pages.get(query)
+            if html is None and fallback:
+                html = fallback[hash(query) % len(fallback)]
+            return html, 'text/html; charset=UTF-8'
+    return GoogleHandler
+
+
+def normalize(query):
+    return u' '.join(query.replace('+', ' ').lower().split())
+
+
+def recorded_responses(fixtures):
+    """ Returns the recorded themoviedb.org responses of all given
+    fixtures, by cache key.
+    """
+    responses = {}
+    for fixture in fixtures.values():
+        responses.update(fixture['responses'])
+    return responses
+
+
+def start_stubs(fixtures, tmdb_latency, google_latency):
+    """ Starts the stand-in servers for the given fixtures. Returns the
+    themoviedb.org and Google Images servers.
+    """
+    responses = recorded_responses(fixtures)
+    searches = []
+    for fixture in fixtures.values():
+        searches.extend(fixture['google_searches'])
+    tmdb = StubServer(make_tmdb_handler(responses), tmdb_latency)
+    google = StubServer(make_google_handler(searches), google_latency)
+    tmdb.start()
+    google.start()
+    return tmdb, google
+
+
+def app_environment(tmdb, google, tmp_dir, page_cache, responses):
+    """ Returns the environment of the app processes, with their
+    files in 'tmp_dir', and a popularity table there with the
+    popularities in the given recorded responses.
+    """
+    popularity_table_path = os.path.join(tmp_dir, 'popularities.bin')
+    write_table(popularity_table_path, recorded_popularities(responses))
+    env = dict(os.environ,
+               THEMOVIEDB_API_URL=tmdb.url + '/3',
+               GOOGLE_SEARCH_URL=google.url + '/search',
+               THEMOVIEDB_CACHE_FILE=os.path.join(tmp_dir, 'cache.sqlite'),
+               THEMOVIEDB_RATE_LIMIT_FILE=os.path.join(tmp_dir,
+                                                       'rate_limit.json'),
+               POPULARITY_TABLE_FILE=popularity_table_path,
+               PAGE_CACHE_FILE=os.path.join(tmp_dir, 'pages.sqlite'),
+               PAGE_CACHE='on' if page_cache else 'off',
+               PYTHONPATH=app_dir)
+    env.setdefault('THEMOVIEDB_API_KEY', 'stub')
+    env.setdefault('LOGGING_LEVEL', 'WARNING')
+    return env
+
+
+def start_gunicorn(workers, port, env):
+    process = subprocess.Popen(
+        ['gunicorn', 'webapp.webapp:app',
+         '-c', 'webapp/gunicorn_conf.py',
+         '--workers', str(workers),
+         '--bind', '127.0.0.1:{}'.format(port)],
+        cwd=app_dir, env=env)
+    url = 'http://127.0.0.1:{}/'.format(port)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('gunicorn did not start.')
+
+
+def stop(process):
+    process.send_signal(signal.SIGTERM)
+    process.wait()
+
+
+def drive(url, queries, concurrency, duration):
+    """ Requests the search page for the given queries, in turn, from
+    'concurrency' threads, for 'duration' seconds. Returns the
+    latencies of the successful requests, in seconds, and the number
+    of failed requests.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def run(offset):
+        session = requests.Session()
+        n = offset
+        while time.time() < deadline:
+            query = queries[n % len(queries)]
+            n += 1
+            start = time.time()
+            try:
+                r = session.get(url, params={'q': query}, timeout=60)
+                # Read the whole (streamed) page.
+                r.content
+                ok = r.status_code == 200
+            except requests.RequestException:
+                ok = False
+            latency = time.time() - start
+            with lock:
+                if ok:
+                    latencies.append(latency)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in xrange(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def percentile(sorted_values, p):
+    """ Returns the 'p'th percentile (nearest rank) of the given sorted
+    values.
+    """
+    if not sorted_values:
+        return float('nan')
+    rank = max(int(round(p / 100.0 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+def report(workers, latencies, errors, duration):
+    latencies = sorted(latencies)
+    print('{:>7} {:>10.1f} {:>9.0f} {:>9.0f} {:>9.0f} {:>7}'.format(
+        workers, len(latencies) / float(duration),
+        1000*percentile(latencies, 50),
+        1000*percentile(latencies, 95),
+        1000*percentile(latencies, 99),
+        errors))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[4],
+                        help='numbers of gunicorn workers to compare')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='number of simultaneous clients')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds of load per number of workers')
+    parser.add_argument('--tmdb-latency', type=float, default=0.1,
+                        help='seconds per themoviedb.org response')
+    parser.add_argument('--google-latency', type=float, default=0.3,
+                        help='seconds per Google Images response')
+    parser.add_argument('--job-workers', type=int, default=0)
+    parser.add_argument('--page-cache', action='store_true')
+    parser.add_argument('--port', type=int, default=8100)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures() if os.path.isdir(fixtures_dir) else {}
+    if not fixtures:
+        print('Skipped: there are no fixtures in {}. To record them, '
+              'set THEMOVIEDB_API_KEY and run:\n\n'
+              "    python benchmarks/record_fixtures.py 'the martian'"
+              .format(fixtures_dir))
+        sys.exit()
+    queries = [fixture['query'] for fixture in fixtures.values()]
+    tmdb, google = start_stubs(fixtures, args.tmdb_latency,
+                               args.google_latency)
+    tmp_dir = tempfile.mkdtemp(prefix='filmograph_load_test')
+    env = app_environment(tmdb, google, tmp_dir, args.page_cache,
+                          recorded_responses(fixtures))
+    job_workers = None
+    if args.job_workers:
+        job_workers = subprocess.Popen(
+            [sys.executable, 'miner/jobs.py',
+             '--workers', str(args.job_workers)],
+            cwd=app_dir, env=env)
+    try:
+        print('{:>7} {:>10} {:>9} {:>9} {:>9} {:>7}'.format(
+            'workers', 'requests/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+            'errors'))
+        for workers in args.workers:
+            process, url = start_gunicorn(workers, args.port, env)
+            try:
+                for query in queries:
+                    requests.get(url, params={'q': query}).content
+                latencies, errors = drive(url, queries, args.concurrency,
+                                          args.duration)
+            finally:
+                stop(process)
+            report(workers, latencies, errors, args.duration)
+    finally:
+        if job_workers is not None:
+            stop(job_workers)
+        tmdb.shutdown()
+        google.shutdown()
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,101 @@
+"""
+Records the fixtures of the stage benchmarks (see 'bench_stages.py'):
+the raw themoviedb.org responses and Google Images pages behind the
+search page for a query.
+
+Usage (from the app directory, with THEMOVIEDB_API_KEY set):
+
+    python benchmarks/record_fixtures.py 'the martian' [other queries ...]
+
+For each query, this writes 'benchmarks/fixtures/<slug>.json', with
+the responses of '/search/multi', the credits of the first result, the
+combined credits of its cast and the first pages of the 'popular'
+lists, by cache key (see `response_cache.make_key`), and a list of the
+Google Images searches of the page, whose results are saved next to
+it as '<slug>-<n>.html'. Existing fixtures of a query are overwritten.
+"""
+
+import io
+import json
+import os
+import re
+from miner import themoviedb
+from miner import google_images
+from miner.response_cache import make_key
+from miner.sessions import get
+from benchmarks.bench_stages import (fixtures_dir, num_productions,
+                                     use_recorded_popularities,
+                                     use_recorded_filmographies,
+                                     ranked_filmographies, title)
+
+
+def slugify(query):
+    return re.sub(r'[^a-z0-9]+', '-', query.lower()).strip('-')
+
+
+def record(query, num_cast_members=4, movie_pages=5, tv_show_pages=2):
+    """ Records the fixtures for the given query. Returns the path of
+    its fixture file.
+    """
+    responses = {}
+
+    def fetch(path, params=None):
+        params = dict(params or {})
+        themoviedb.rate_limiter.acquire()
+        r = get(themoviedb.api_url + path,
+                params=dict(params,
+                            api_key=os.getenv('THEMOVIEDB_API_KEY')))
+        r.raise_for_status()
+        responses[make_key(path, params)] = r.text
+        return themoviedb.decode(r.text)
+
+    for resource, end_page in (('/movie/popular', movie_pages),
+                               ('/tv/popular', tv_show_pages)):
+        for page in xrange(1, end_page + 1):
+            fetch(resource, {'page': page})
+    # Rank like the benchmarks do.
+    use_recorded_popularities(responses)
+    production = fetch('/search/multi', {'query': query})['results'][0]
+    cast = fetch('/{media_type}/{id}/credits'.format(**production))\
+           ['cast'][:num_cast_members]
+    filmographies = [fetch('/person/{id}/combined_credits'
+                           .format(**role))['cast']
+                     for role in cast]
+    # The same searches as the page: for each cast member, for the
+    # searched production and for their first productions.
+    searches = []
+    person_ids = use_recorded_filmographies(filmographies)
+    for role, filmography in zip(cast, ranked_filmographies(person_ids,
+                                                            production)):
+        for credit in [production] + filmography[:num_productions]:
+            searches.append({'title': title(credit),
+                             'person': role['name'],
+                             'character': role['character']
+                                          if credit is production
+                                          else credit['character']})
+    slug = slugify(query)
+    for n, search in enumerate(searches):
+        search['file'] = '{}-{}.html'.format(slug, n)
+        html = google_images.get_search_results_page(
+                   search['title'], search['person'], search['character'])
+        with open(os.path.join(fixtures_dir, search['file']), 'wb') as f:
+            f.write(html)
+    path = os.path.join(fixtures_dir, slug + '.json')
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'query': query,
+                            'num_cast_members': num_cast_members,
+                            'responses': responses,
+                            'google_searches': searches},
+                           ensure_ascii=False, indent=2, sort_keys=True))
+    return path
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('queries', nargs='+')
+    args = parser.parse_args()
+    if not os.path.isdir(fixtures_dir):
+        os.makedirs(fixtures_dir)
+    for query in args.queries:
+        print('Recorded {}.'.format(record(query)))
@@ -1,9 +1,12 @@
 from db_conn import Base
 from sqlalchemy import (Column, Integer, String, Enum, ForeignKey,
-                        Boolean, BigInteger, Date, Float, DateTime)
+                        Boolean, BigInteger, Date, Float, DateTime,
+                        UniqueConstraint, Index, Text, cast, DDL,
+                        event)
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from data import ddl
 
 
 class TimestampMixin(object):
@@ -150,11 +153,30 @@ class Production(ImageLinkable,
     similar              = Column(JSONB)
     translations         = Column(JSONB)
     videos               = Column(JSONB)
+    #
+    # Movies and TV shows have separate 'themoviedb.org' ids, which
+    # may coincide. We upsert on this constraint (see 'ingest').
+    # Trigram indexes for name search (see 'search').
+    __table_args__       = (
+        UniqueConstraint('type', 'tmdb_id'),
+        Index('production_name_trgm', name,
+              postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('production_original_name_trgm', original_name,
+              postgresql_using='gin',
+              postgresql_ops={'original_name': 'gin_trgm_ops'}),
+    )
 
     def __repr__(self):
         return u"<Production '{}'>".format(self.name)
 
 
+# The trigram indexes (of Production and Person) need this extension.
+# (Existing databases got it with the 'trigram_name_search' migration.)
+event.listen(Base.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+
 class Role(ImageLinkable,
            TimestampMixin,
            LastAPIRequestMixin):
@@ -193,14 +215,24 @@ class Role(ImageLinkable,
                                          back_populates='credits',
                                          foreign_keys=[person_id])
 
-    # Only for TV
-    tmdb_id              = Column(String)
+    # The 'credit_id' of 'themoviedb.org'. We upsert on this column
+    # (see 'ingest').
+    tmdb_id              = Column(String, unique=True)
+    # Position in the billing of the cast (0-based 'order' of
+    # 'themoviedb.org'). Only for cast roles.
+    billing_order        = Column(Integer)
+    # When we last searched Google Images for this role (see
+    # 'image_store'). Also set when the search found nothing, so that an
+    # empty result is as fresh as stored images.
+    last_image_search    = Column(DateTime(timezone=True))
 
     def __repr__(self):
-        return u"<Role '{}' for '{}' in '{}'>".format(
+        # Without touching 'person' and 'production', which would load
+        # them.
+        return u"<Role '{}' for person {} in production {}>".format(
                  self.name,
-                 self.person.name,
-                 self.production.name)
+                 self.person_id,
+                 self.production_id)
 
 
 class Person(ImageLinkable,
@@ -231,13 +263,25 @@ class Person(ImageLinkable,
     birthday             = Column(Date)
     deathday             = Column(Date)
     homepage             = Column(String)
-    tmdb_id              = Column(Integer)
+    # We upsert on this column (see 'ingest').
+    tmdb_id              = Column(Integer, unique=True)
     imdb_id              = Column(String)
     place_of_birth       = Column(String)
     popularity           = Column(Float)
     profile_path         = Column(String)
     #
     external_ids         = Column(JSONB)
+    #
+    # Trigram indexes for name search (see 'search').
+    __table_args__       = (
+        Index('person_name_trgm', name,
+              postgresql_using='gin',
+              postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('person_also_known_as_trgm',
+              cast(also_known_as, Text).label('also_known_as_text'),
+              postgresql_using='gin',
+              postgresql_ops={'also_known_as_text': 'gin_trgm_ops'}),
+    )
 
     def __repr__(self):
         return u"<Person '{}'>".format(self.name)
@@ -267,6 +311,9 @@ class Image(Base,
     thumb_url            = Column(String)
     thumb_width          = Column(Integer)
     thumb_height         = Column(Integer)
+    # Path of our copy of the thumbnail, relative to the web root (see
+    # 'miner/thumbnails.py'). Null until it is mirrored.
+    thumb_path           = Column(String)
     source_page_url      = Column(String)
     source_domain        = Column(String)
     Google_title         = Column(String)
@@ -292,9 +339,9 @@ class ImageLink(Base,
     image                = relationship('Image',
                                   back_populates='links')
     #
+    # Indexed by 'image_link_top' below.
     linkable_id          = Column(Integer,
-                                  ForeignKey('image_linkable.id'),
-                                  index=True)
+                                  ForeignKey('image_linkable.id'))
     linked               = relationship('ImageLinkable',
                                   back_populates='image_links')
     #
@@ -302,6 +349,18 @@ class ImageLink(Base,
     Google_position      = Column(Integer)
     upvotes              = Column(Integer)
     downvotes            = Column(Integer)
+    # How good an image this is for the linked object, from 0 to 1,
+    # from the votes and the Google position. Kept up to date by a
+    # trigger (see `ddl.image_link_score_function`).
+    score                = Column(Float, nullable=False,
+                                  server_default='0')
+    #
+    # The top images of a linkable are the start of its range in this
+    # index, which also holds all ImageLink columns that pages read.
+    __table_args__       = (
+        Index('image_link_top', 'linkable_id', score.desc(), 'id',
+              'image_id', 'time_created'),
+    )
 
     # Maybe also, for links with Roles:
     # whether we Google Image searched for:
@@ -312,3 +371,116 @@ class ImageLink(Base,
     def __repr__(self):
         return u"<ImageLink between '{}' and '{}'>".format(
                  self.linked.name, self.image.original_url)
+
+
+# The score function and the triggers that keep 'score' up to date (see
+# 'ddl'), created with the 'image_link' table.
+for statement in ddl.image_link_score:
+    event.listen(ImageLink.__table__, 'after_create', DDL(statement))
+
+
+class SyncCheckpoint(Base):
+    """ Up to when we have processed one of the change feeds of
+    'themoviedb.org' (see 'miner/sync.py').
+    """
+    __tablename__ = 'sync_checkpoint'
+
+    # Eg. 'movie', 'tv' or 'person'.
+    feed                 = Column(String, primary_key=True)
+    synced_until         = Column(DateTime(timezone=True))
+
+    def __repr__(self):
+        return u"<SyncCheckpoint '{}' at {}>".format(
+                 self.feed, self.synced_until)
+
+
+class Job(Base,
+          TimestampMixin):
+    """ A unit of mining work, to be done by a worker process (see
+    'miner/jobs.py').
+    """
+    __tablename__ = 'job'
+
+    id                   = Column(Integer, primary_key=True)
+    # Name of the function that does the work, and its keyword
+    # arguments.
+    kind                 = Column(String, nullable=False)
+    payload              = Column(JSONB)
+    # Jobs with the same kind and key do the same work. There is at
+    # most one pending job per kind and key.
+    key                  = Column(String, nullable=False)
+    # Higher priority jobs are done first.
+    priority             = Column(Float, nullable=False,
+                                  server_default='0')
+    status               = Column(Enum('pending',
+                                       'failed',
+                                       name='JobStatuses'),
+                                  nullable=False,
+                                  server_default='pending')
+    # Failed attempts so far, and when to try again.
+    attempts             = Column(Integer, nullable=False,
+                                  server_default='0')
+    run_after            = Column(DateTime(timezone=True),
+                                  nullable=False,
+                                  server_default=func.now())
+    last_error           = Column(String)
+    #
+    # Only pending jobs are indexed: finished jobs are deleted, and
+    # failed jobs are kept for inspection only.
+    __table_args__       = (
+        Index('job_pending_key', kind, key, unique=True,
+              postgresql_where=(status == 'pending')),
+        Index('job_pending_priority', priority.desc(), run_after,
+              postgresql_where=(status == 'pending')),
+    )
+
+    def __repr__(self):
+        return u"<Job {} '{}' ({})>".format(
+                 self.kind, self.key, self.status)
+
+
+class KnownFor(Base):
+    """ The top cast roles of a person, by popularity of the production
+    (see 'known_for'). Maintained by the database: triggers on the role
+    and production tables mark the people whose ranking may have
+    changed (see KnownForDirty), and `known_for.refresh` recomputes
+    their rankings.
+    """
+    __tablename__ = 'known_for'
+
+    # The primary key makes reading the ranking of a person a single
+    # index range scan.
+    person_id            = Column(Integer,
+                                  ForeignKey('person.id',
+                                             ondelete='CASCADE'),
+                                  primary_key=True)
+    # 1 for the most popular production.
+    rank                 = Column(Integer, primary_key=True)
+    role_id              = Column(Integer,
+                                  ForeignKey('role.id',
+                                             ondelete='CASCADE'),
+                                  nullable=False)
+    production_id        = Column(Integer,
+                                  ForeignKey('production.id',
+                                             ondelete='CASCADE'),
+                                  nullable=False)
+    popularity           = Column(Float)
+
+    def __repr__(self):
+        return u"<KnownFor #{} of person {}: role {}>".format(
+                 self.rank, self.person_id, self.role_id)
+
+
+class KnownForDirty(Base):
+    """ A person whose KnownFor ranking needs to be recomputed.
+    """
+    __tablename__ = 'known_for_dirty'
+
+    person_id            = Column(Integer, primary_key=True)
+
+
+# The functions and triggers that mark people as dirty (see 'ddl'),
+# created with the 'known_for' table. 'known_for' references 'role' and
+# 'production', so it is created after them.
+for statement in ddl.known_for:
+    event.listen(KnownFor.__table__, 'after_create', DDL(statement))
@@ -36,9 +36,10 @@ http://flask.pocoo.org/docs/0.10/patterns/sqlalchemy/#declarative
 """
 
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from loggers import spans
 
 # Connect to the database.
 # 
@@ -50,6 +51,32 @@ url = 'postgresql://postgres:'+pwd+'@db:5432/postgres'
 # database should be of the Python `unicode` type.
 engine = create_engine(url, convert_unicode=True)
 
+
+# Time every statement as part of the current trace (see
+# 'loggers/spans.py').
+@event.listens_for(engine, 'before_cursor_execute')
+def start_statement_span(conn, cursor, statement, parameters, context,
+                         executemany):
+    conn.info.setdefault('spans', []).append(spans.start('postgres'))
+
+
+@event.listens_for(engine, 'after_cursor_execute')
+def finish_statement_span(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info['spans'].pop().finish()
+
+
+@event.listens_for(engine, 'handle_error')
+def finish_failed_statement_span(context):
+    if context.connection is None:
+        return
+    statement_spans = context.connection.info.get('spans')
+    if statement_spans:
+        span = statement_spans.pop()
+        span.set(error=type(context.original_exception).__name__)
+        span.finish()
+
+
 # Create the actual handle to the database.
 # See http://docs.sqlalchemy.org/en/rel_1_0/orm/session_basics.html#session-faq-whentocreate
 # and http://docs.sqlalchemy.org/en/rel_1_0/orm/contextual.html
@@ -0,0 +1,163 @@
+"""
+The PostgreSQL functions and triggers of the data model, that SQLAlchemy
+can't express. They are the single source for both new databases (see
+'data_model', which creates them with their tables) and the migrations
+that added them to existing databases.
+
+Usage:
+
+    from data import ddl
+    for statement in ddl.known_for:
+        op.execute(statement)
+
+Changing a function or trigger here doesn't change existing databases:
+that needs a new migration (eg. with `CREATE OR REPLACE FUNCTION`).
+"""
+
+
+# Mark the people of inserted, deleted and moved cast roles as dirty
+# (see 'known_for').
+mark_known_for_dirty_role = """
+CREATE FUNCTION mark_known_for_dirty_role() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF OLD.department = 'cast' AND OLD.person_id IS NOT NULL THEN
+            INSERT INTO known_for_dirty (person_id)
+            VALUES (OLD.person_id)
+            ON CONFLICT DO NOTHING;
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NEW.department = 'cast' AND NEW.person_id IS NOT NULL THEN
+            INSERT INTO known_for_dirty (person_id)
+            VALUES (NEW.person_id)
+            ON CONFLICT DO NOTHING;
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# Mark the cast of productions whose popularity changed as dirty.
+mark_known_for_dirty_production = """
+CREATE FUNCTION mark_known_for_dirty_production() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO known_for_dirty (person_id)
+    SELECT DISTINCT person_id FROM role
+    WHERE production_id = NEW.id
+      AND department = 'cast'
+      AND person_id IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+known_for_triggers = [
+    """
+    CREATE TRIGGER role_known_for_insert_delete
+    AFTER INSERT OR DELETE ON role
+    FOR EACH ROW EXECUTE PROCEDURE mark_known_for_dirty_role()
+    """,
+    # Upserts (see 'ingest') set every column, so we only fire when the
+    # ranking may actually change.
+    """
+    CREATE TRIGGER role_known_for_update
+    AFTER UPDATE OF person_id, production_id, department ON role
+    FOR EACH ROW
+    WHEN (OLD.person_id IS DISTINCT FROM NEW.person_id
+          OR OLD.production_id IS DISTINCT FROM NEW.production_id
+          OR OLD.department IS DISTINCT FROM NEW.department)
+    EXECUTE PROCEDURE mark_known_for_dirty_role()
+    """,
+    """
+    CREATE TRIGGER production_known_for_update
+    AFTER UPDATE OF popularity, type ON production
+    FOR EACH ROW
+    WHEN (OLD.popularity IS DISTINCT FROM NEW.popularity
+          OR OLD.type IS DISTINCT FROM NEW.type)
+    EXECUTE PROCEDURE mark_known_for_dirty_production()
+    """,
+]
+
+# Everything that keeps the 'known_for_dirty' table up to date, in the
+# order to create it in.
+known_for = ([mark_known_for_dirty_role, mark_known_for_dirty_production]
+             + known_for_triggers)
+
+
+# The score of an image link is the lower bound of the Wilson score
+# interval (at 95% confidence) of the fraction of upvotes, where the
+# Google position counts as 'prior_votes' votes: the first result as
+# that many upvotes, and lower results as ever more downvotes. Without
+# votes, images are thus ranked by Google position; with more and more
+# votes, the votes take over. Links without a position count as the
+# 100th result.
+#
+# The constants and terms of the score, as (name, expression) pairs, in
+# the order they are computed in. The expressions are valid Python too
+# (given SQL's functions), so that the score can be tested without a
+# database (see 'tests/test_ddl.py').
+image_link_score_constants = [
+    ('z', '1.96'),
+    ('prior_votes', '5'),
+]
+image_link_score_terms = [
+    ('prior', '1 / (1 + ln(GREATEST(COALESCE(google_position, 100), 1)))'),
+    ('n', 'COALESCE(upvotes, 0) + COALESCE(downvotes, 0) + prior_votes'),
+    ('p', '(COALESCE(upvotes, 0) + prior_votes * prior) / n'),
+]
+image_link_score_expression = \
+    '(p + z*z / (2*n) - z * sqrt((p * (1 - p) + z*z / (4*n)) / n)) ' \
+    '/ (1 + z*z / n)'
+
+image_link_score_function = """
+CREATE FUNCTION image_link_score(upvotes integer, downvotes integer,
+                                 google_position integer)
+RETURNS double precision AS $$
+DECLARE
+{}
+BEGIN
+    RETURN {};
+END
+$$ LANGUAGE plpgsql IMMUTABLE
+""".format(
+    '\n'.join(['    {} CONSTANT double precision := {};'.format(name, value)
+               for name, value in image_link_score_constants] +
+              ['    {} double precision := {};'.format(name, expression)
+               for name, expression in image_link_score_terms]),
+    image_link_score_expression)
+
+set_image_link_score = """
+CREATE FUNCTION set_image_link_score() RETURNS trigger AS $$
+BEGIN
+    NEW.score := image_link_score(NEW.upvotes, NEW.downvotes,
+                                  NEW."Google_position");
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+image_link_score_triggers = [
+    """
+    CREATE TRIGGER image_link_score_insert
+    BEFORE INSERT ON image_link
+    FOR EACH ROW EXECUTE PROCEDURE set_image_link_score()
+    """,
+    # Only recompute the score when its inputs change.
+    """
+    CREATE TRIGGER image_link_score_update
+    BEFORE UPDATE OF upvotes, downvotes, "Google_position" ON image_link
+    FOR EACH ROW
+    WHEN (OLD.upvotes IS DISTINCT FROM NEW.upvotes
+          OR OLD.downvotes IS DISTINCT FROM NEW.downvotes
+          OR OLD."Google_position" IS DISTINCT FROM NEW."Google_position")
+    EXECUTE PROCEDURE set_image_link_score()
+    """,
+]
+
+# The score function and the triggers that keep 'image_link.score' up to
+# date, in the order to create them in.
+image_link_score = ([image_link_score_function, set_image_link_score]
+                    + image_link_score_triggers)
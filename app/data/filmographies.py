@@ -0,0 +1,246 @@
+"""
+Database-backed cast filmographies.
+
+Usage:
+
+    from data.filmographies import get_cast_filmographies
+    production, cast_filmographies = \
+        get_cast_filmographies('the martian')
+
+The result has the same structure as that of
+`themoviedb.get_cast_filmographies`, but it is assembled from the
+Production, Person, Role and KnownFor tables (see 'read_model'). Only
+the records that are missing, or that were last fetched longer ago
+than 'max_age', are (re)fetched from themoviedb.org and ingested (see
+'ingest'), which updates their `last_dedicated_fetch` timestamps. The
+query is resolved with a local name search (see 'search'), and only
+when that has no confident match with themoviedb.org's (cached)
+search. So most page views make no API calls at all.
+
+With 'enqueue_stale', stale records that we do have are served as they
+are, and jobs to refresh them are added to the queue (see 'jobs').
+Only missing records are then fetched during the call.
+
+Credits of productions that were stored without a popularity (when
+there was no popularity table yet) get one from the current table, and
+are ranked with it. Until the miner has built a table, such credits
+stay unranked: they get popularity 0, after the credits we do know
+the popularity of.
+"""
+
+from datetime import timedelta
+from loggers import logger
+from data import ingest
+from data import read_model
+from data import known_for
+from data import search
+from miner import themoviedb
+from miner import popularity_table
+from miner.concurrency import imap_concurrently
+from miner import jobs
+
+
+# Refetch the credits of productions and people that were fetched
+# longer ago than this.
+max_age = timedelta(days=7)
+
+# Production types to themoviedb.org media types.
+media_types = ingest.media_types
+
+
+def get_cast_filmographies(query, num_cast_members=7, max_age=max_age,
+                           enqueue_stale=False):
+    """ Searches for the most popular movie or TV show with 'query' in
+    its name, and returns its metadata and a list with, for each of
+    the top billed actors of this movie or TV show, the role that they
+    played in it, and their top roles in other movies and TV shows,
+    sorted by popularity of these movies and shows.
+    """
+    first_result, cast_filmographies = iter_cast_filmographies(
+        query, num_cast_members, max_age, enqueue_stale)
+    return first_result, list(cast_filmographies)
+
+
+def iter_cast_filmographies(query, num_cast_members=7, max_age=max_age,
+                            enqueue_stale=False):
+    """ Like `get_cast_filmographies`, but returns an iterator over the
+    cast filmographies instead of a list. It yields each cast member as
+    soon as their filmography is ready: the filmographies that we
+    need to fetch first are fetched concurrently, while the earlier
+    cast members are being used.
+    """
+    first_result = search.resolve(query)
+    if first_result is None:
+        first_result = themoviedb.get_api_response(
+                           '/search/multi', {'query': query})\
+                           ['results'][0]
+    # Refresh jobs get the popularity of the searched production as
+    # their priority.
+    priority = first_result.get('popularity')
+    production_id = get_fresh_production_id(first_result, max_age,
+                                            enqueue_stale)
+    cast = get_cast(production_id, num_cast_members, max_age)
+    if enqueue_stale:
+        jobs.enqueue_many([('refresh_person', role['id'],
+                            {'tmdb_id': role['id']}, priority)
+                           for role, state in cast if state == 'stale'])
+        to_refresh = [role for role, state in cast if state == 'missing']
+    else:
+        to_refresh = [role for role, state in cast if state != 'fresh']
+    # Start refreshing now: the caller may do other work (eg. render the
+    # start of the page) before it asks for the first cast member.
+    # Yields when the next person to refresh is done, in cast order.
+    refreshed = imap_concurrently(refresh_person, to_refresh)
+    return first_result, _iter_cast_filmographies(
+                             first_result, [role for role, _ in cast],
+                             to_refresh, refreshed)
+
+
+def _iter_cast_filmographies(production, cast, to_refresh, refreshed):
+    refreshing = set(role['person_id'] for role in to_refresh)
+    # Read the filmographies that are ready with a single query.
+    filmographies = get_filmographies([role['person_id']
+                                       for role in cast
+                                       if role['person_id']
+                                       not in refreshing])
+    for role in cast:
+        person_id = role.pop('person_id')
+        refreshed_ok = True
+        if person_id in refreshing:
+            refreshed_ok = next(refreshed)
+            filmography = get_filmographies([person_id])\
+                              .get(person_id, [])
+        else:
+            filmography = filmographies.get(person_id, [])
+        filmography = [credit for credit in filmography
+                       if (credit['id'], credit['media_type']) !=
+                          (production['id'], production['media_type'])]
+        # Pages with a filmography that could not be refreshed are
+        # served, but not cached for long (see 'webapp').
+        yield {'role': role, 'filmography': filmography,
+               'complete': refreshed_ok}
+
+
+def get_fresh_production_id(production, max_age=max_age,
+                            enqueue_stale=False):
+    """ Returns the id of the Production for the given search result,
+    after (re)fetching its credits if they are missing or stale. With
+    'enqueue_stale', stale credits are refreshed by a job instead.
+    """
+    media_type = production['media_type']
+    production_type = ingest.production_types[media_type]
+    record = read_model.get_production(production_type,
+                                       production['id'], max_age)
+    if record is not None:
+        production_id, state = record.id, record.state
+        if state == 'fresh':
+            return production_id
+        if state == 'stale' and enqueue_stale:
+            jobs.enqueue('refresh_production',
+                         u'{media_type}/{id}'.format(**production),
+                         {'media_type': media_type,
+                          'tmdb_id': production['id']},
+                         production.get('popularity'))
+            return production_id
+    credits = themoviedb.get_api_response(
+                  '/{media_type}/{id}/credits'.format(**production),
+                  use_cache=False)
+    ingest.ingest_credits(production, media_type, credits)
+    return read_model.get_production(production_type,
+                                     production['id']).id
+
+
+def get_cast(production_id, num_cast_members, max_age=max_age):
+    """ Returns the top billed cast of the given Production, as a list
+    of (role, state) tuples. Each role is a dictionary like an entry
+    of themoviedb.org's credits cast lists, plus the 'person_id' of the
+    Person. 'state' tells whether the combined credits of the Person
+    were fetched recently (see `read_model.freshness`).
+    """
+    return [({'id':           member.tmdb_id,
+              'name':         member.name,
+              'profile_path': member.profile_path,
+              'character':    member.character,
+              'credit_id':    member.credit_id,
+              'order':        member.billing_order,
+              'person_id':    member.person_id}, member.state)
+            for member in read_model.get_cast(production_id,
+                                              num_cast_members, max_age)]
+
+
+def refresh_person(role):
+    """ Fetches and ingests the combined credits of the person of the
+    given role. Returns False on failure: the failure is logged, and
+    their stored filmography (if any) is used instead.
+    """
+    try:
+        combined_credits = themoviedb.get_api_response(
+            '/person/{id}/combined_credits'.format(**role),
+            use_cache=False)
+        ingest.ingest_combined_credits(
+            {'id': role['id'], 'name': role['name']},
+            combined_credits)
+    except Exception:
+        logger.exception(u'Could not refresh the filmography of {}'
+                         .format(role['name']))
+        return False
+    return True
+
+
+def get_filmographies(person_ids):
+    """ Returns a dictionary from the given Person ids to their top cast
+    credits (see 'known_for'), as lists of dictionaries like the
+    entries of themoviedb.org's combined credits cast lists, sorted by
+    popularity. Doesn't refresh the rankings: that happens when credits
+    are ingested, and periodically (see 'known_for').
+    """
+    filmographies = {}
+    unknown = []
+    for record in read_model.get_known_for(person_ids):
+        media_type = media_types.get(record.type)
+        if media_type is None:
+            continue
+        credit = {'id':          record.tmdb_id,
+                  'media_type':  media_type,
+                  'character':   record.character,
+                  'credit_id':   record.credit_id,
+                  'poster_path': record.poster_path,
+                  'popularity':  record.popularity}
+        if media_type == 'movie':
+            credit['title'] = record.name
+            credit['release_date'] = _date(record.release_date)
+        else:
+            credit['name'] = record.name
+            credit['first_air_date'] = _date(record.first_air_date)
+        filmographies.setdefault(record.person_id, []).append(credit)
+        if credit['popularity'] is None:
+            unknown.append((record.person_id, credit))
+    if unknown:
+        fill_popularities([credit for _, credit in unknown])
+        # The rankings include 'top_n' credits without popularity,
+        # besides the top 'top_n' ones with.
+        for person_id in set(person_id for person_id, _ in unknown):
+            filmographies[person_id].sort(
+                key=lambda credit: credit['popularity'], reverse=True)
+            del filmographies[person_id][known_for.top_n:]
+    return filmographies
+
+
+def fill_popularities(credits):
+    """ Sets the popularity of the given credits from the popularity
+    table. Unknown productions, and all productions when there is no
+    table (yet), get 0.
+    """
+    table = popularity_table.current_table()
+    if table is not None:
+        scores = table.lookup([credit['id'] for credit in credits],
+                              [credit['media_type'] for credit in credits])
+    else:
+        scores = [0] * len(credits)
+    for credit, score in zip(credits, scores):
+        credit['popularity'] = float(score)
+
+
+def _date(date):
+    # themoviedb.org formats dates as strings.
+    return date.isoformat() if date is not None else None
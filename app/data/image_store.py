@@ -0,0 +1,223 @@
+"""
+A read-through store for the Google Images search results of roles.
+
+Usage:
+
+    from data.image_store import get_images_metadata
+    # 'production', 'person' and 'credit' are dictionaries as
+    # returned by themoviedb.org's API (eg. an entry of a
+    # 'combined_credits' cast list, which is also the credit, and an
+    # entry of a 'credits' cast list).
+    images_metadata = get_images_metadata(production, person, credit)
+    # Only look in the database (None if there are no fresh images):
+    images_metadata = get_images_metadata(production, person, credit,
+                                          search=False)
+    # The top 4 stored images of several roles, with one query:
+    get_many_images_metadata([(production, person, credit), ...],
+                             limit=4)
+    # The same, but also stale images, each with whether it's fresh:
+    get_many_images([(production, person, credit), ...], limit=4)
+
+The first lookup for a (production, person, character) tuple searches
+Google Images, and stores the results as Images, linked to the Role of
+that person in that production. Later lookups are served from the
+database, until the stored results are older than 'max_age'. A search
+that found nothing is remembered too (see `Role.last_image_search`),
+as an empty list of results, so that it isn't repeated on every page
+view. The returned metadata has the same format as that of
+`google_images.get_search_results_metadata`.
+
+Pages can show stale results while new ones are searched for in the
+background (see `get_many_images` and 'webapp'): images are better
+than placeholders, even when they are old. The lookups of pages only
+read: Roles that aren't stored yet are ingested by the search job.
+"""
+
+from datetime import timedelta
+from sqlalchemy.sql import func
+from data.db_conn import db_session, engine
+from data.data_model import Image, ImageLink, Role
+from data import ingest
+from data import read_model
+from miner import google_images
+
+
+# Search again for images that were stored longer ago than this.
+max_age = timedelta(days=30)
+
+
+def get_images_metadata(production, person, credit, search=True):
+    """ Returns the metadata of the images of the given person playing
+    the character of the given credit in the given production, from
+    the database if possible, or else from a new Google Images search.
+    Without 'search', returns None instead of searching.
+    """
+    images_metadata, = get_many_images_metadata(
+                           [(production, person, credit)])
+    if images_metadata is not None or not search:
+        return images_metadata
+    if production['media_type'] == 'movie':
+        title = production['title']
+    else:
+        title = production['name']
+    results = google_images.get_search_results_metadata(
+                title, person['name'], credit['character'])
+    replace_images(get_role_id(production, person, credit), results)
+    return results
+
+
+def get_many_images_metadata(lookups, limit=None):
+    """ Returns, for each of the given (production, person, credit)
+    tuples, the metadata of the top 'limit' (default: all) stored
+    images of that person playing that character in that production,
+    or None if there are no fresh images. Doesn't search. Uses a
+    single query for all images (see `read_model.load_top_images`).
+    """
+    return [images_metadata if fresh else None
+            for images_metadata, fresh in get_many_images(lookups, limit)]
+
+
+def get_many_images(lookups, limit=None):
+    """ Like `get_many_images_metadata`, but returns stale images too:
+    returns a (metadata, fresh) tuple for each lookup. The metadata is
+    None (and 'fresh' False) if there are no images at all, and an
+    empty list (and 'fresh' True) if a recent search found nothing.
+    """
+    role_ids = get_role_ids(lookups)
+    stored_ids = [role_id for role_id in role_ids if role_id is not None]
+    images = read_model.load_top_images(stored_ids, limit, max_age)
+    searched = read_model.get_searched_role_ids(
+                   [role_id for role_id in stored_ids
+                    if role_id not in images], max_age)
+    results = []
+    for role_id in role_ids:
+        if role_id in images:
+            # All images of a role are stored at once, so they are
+            # either all fresh or all stale.
+            results.append(([image_metadata(image)
+                             for image in images[role_id]],
+                            images[role_id][0].fresh))
+        elif role_id in searched:
+            results.append(([], True))
+        else:
+            results.append((None, False))
+    return results
+
+
+def get_image_ids(production, person, credit):
+    """ Returns the ids of the Images stored for the given person playing
+    the character of the given credit in the given production.
+    """
+    role_id = get_role_id(production, person, credit)
+    return [image_id for (image_id,) in
+            db_session.query(ImageLink.image_id)
+                      .filter_by(linkable_id=role_id)]
+
+
+def get_role_ids(lookups):
+    """ Returns the ids of the Roles for the given (production, person,
+    credit) tuples, or None for the Roles that aren't stored yet, with
+    one query. Doesn't ingest (unlike `get_role_id`).
+    """
+    role_ids = read_model.get_role_ids([credit['credit_id']
+                                        for _, _, credit in lookups])
+    return [role_ids.get(credit['credit_id'])
+            for _, _, credit in lookups]
+
+
+def get_role_id(production, person, credit):
+    """ Returns the id of the Role for the given credit of the given
+    person in the given production (themoviedb.org dictionaries),
+    ingesting the Role, and the Production and Person, if necessary.
+    """
+    role_id = read_model.get_role_id(credit['credit_id'])
+    if role_id is None:
+        with engine.begin() as connection:
+            production_id, = ingest.ingest_productions(
+                [production], connection=connection).values()
+            person_id, = ingest.ingest_people(
+                [person], connection=connection).values()
+            role_id, = ingest.ingest_roles(
+                [(credit, production_id, person_id)],
+                connection).values()
+    return role_id
+
+
+def replace_images(role_id, results):
+    """ Replaces the images linked to the given Role by the given
+    Google Images search results, with one bulk insert per table, and
+    records when the Role was searched for (even without results).
+    """
+    old_image_ids = [image_id for (image_id,) in
+                     db_session.query(ImageLink.image_id)
+                               .filter_by(linkable_id=role_id)]
+    if old_image_ids:
+        ImageLink.query.filter_by(linkable_id=role_id)\
+                       .delete(synchronize_session=False)
+        # Delete the old images that are no longer linked to anything.
+        still_linked = db_session.query(ImageLink.image_id)\
+                                 .filter(ImageLink.image_id.in_(
+                                     old_image_ids))
+        Image.query.filter(Image.id.in_(old_image_ids),
+                           ~Image.id.in_(still_linked))\
+                   .delete(synchronize_session=False)
+    if results:
+        image_table = Image.__table__
+        image_ids = db_session.execute(
+            image_table.insert()
+                       .values([image_row(result)
+                                for result in results])
+                       .returning(image_table.c.id)).fetchall()
+        db_session.execute(
+            ImageLink.__table__.insert().values([
+                {'image_id': image_id,
+                 'linkable_id': role_id,
+                 'Google_position': position,
+                 'upvotes': 0,
+                 'downvotes': 0}
+                for position, (image_id,) in enumerate(image_ids, 1)]))
+    role_table = Role.__table__
+    db_session.execute(role_table.update()
+                                 .where(role_table.c.id == role_id)
+                                 .values(last_image_search=func.now()))
+    db_session.commit()
+
+
+def image_row(result):
+    """ Converts a Google Images search result to the columns of an
+    Image.
+    """
+    return {'type':               'screencap',
+            'original_url':       result['image_url'],
+            'original_width':     result['image_width'],
+            'original_height':    result['image_height'],
+            'original_filetype':  result['image_type'],
+            'thumb_url':          result['thumb_url'],
+            'thumb_width':        result['thumb_width'],
+            'thumb_height':       result['thumb_height'],
+            'source_page_url':    result['source_page_url'],
+            'source_domain':      result['source_domain'],
+            'Google_title':       result['title'],
+            'Google_description': result['description']}
+
+
+def image_metadata(image):
+    """ Converts an Image (or an ImageRecord, see 'read_model') to the
+    format of a Google Images search result, plus the url of our copy
+    of the thumbnail, if we have one (see 'miner/thumbnails.py'), and
+    the id of the ImageLink to vote on, if known (see 'votes').
+    """
+    return {'link_id':         getattr(image, 'link_id', None),
+            'local_thumb_url': '/' + image.thumb_path
+                               if image.thumb_path else None,
+            'thumb_url':       image.thumb_url,
+            'thumb_width':     image.thumb_width,
+            'thumb_height':    image.thumb_height,
+            'image_url':       image.original_url,
+            'image_width':     image.original_width,
+            'image_height':    image.original_height,
+            'image_type':      image.original_filetype,
+            'source_page_url': image.source_page_url,
+            'source_domain':   image.source_domain,
+            'title':           image.Google_title,
+            'description':     image.Google_description}
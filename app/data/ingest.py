@@ -0,0 +1,319 @@
+"""
+Bulk ingestion of themoviedb.org API responses into the Production,
+Person and Role tables.
+
+Usage:
+
+    from data import ingest
+
+    # Details of a movie (eg. '/movie/286217'):
+    ingest.ingest_productions([details], media_type='movie',
+                              dedicated=True)
+    # Credits of a production (eg. '/movie/286217/credits'):
+    ingest.ingest_credits(production, 'movie', credits)
+    # Combined credits of a person (eg. '/person/1892/combined_credits'):
+    ingest.ingest_combined_credits(person, combined_credits)
+
+
+Rows are upserted on their 'themoviedb.org' ids (see the unique
+constraints in 'data_model'), with batched
+`INSERT ... ON CONFLICT DO UPDATE` statements through SQLAlchemy Core,
+instead of one ORM `session.add` per object. Columns that are missing
+from a payload keep their stored value.
+
+Production, Person and Role rows are joined-table subclasses of
+ImageLinkable, so every new row first needs an 'image_linkable' row
+with the same id. We allocate those ids for the rows that don't exist
+yet with one bulk insert. When another process inserts the same row
+concurrently, the allocated 'image_linkable' row is left unused, and we
+delete it again. Rows are written in order of their key, so that
+concurrent ingestions don't deadlock.
+
+'dedicated' marks payloads that we requested specifically for these
+objects (their `last_dedicated_fetch` is set); other payloads update
+`last_incidental_update`.
+
+Productions without a popularity in their payload get the one in the
+popularity table (see 'popularity_table'), if there is one. After
+ingesting credits, the "known for" rankings of the people involved are
+brought up to date (see 'known_for').
+"""
+
+import time
+from sqlalchemy import select, tuple_, null
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+from loggers import logger
+from data.db_conn import engine
+from data.data_model import ImageLinkable, Production, Person, Role
+from data import known_for
+from miner import popularity_table
+
+
+# Number of rows per INSERT statement.
+batch_size = 500
+
+# themoviedb.org media types to Production types.
+production_types = {'movie': 'movie', 'tv': 'tv_show'}
+# And back.
+media_types = dict((production_type, media_type) for media_type,
+                   production_type in production_types.items())
+
+# Payload keys to column names, where they differ.
+production_keys = {
+    'id':               'tmdb_id',
+    'title':            'name',
+    'original_title':   'original_name',
+    'episode_run_time': 'episode_runtimes',
+}
+person_keys = {
+    'id':               'tmdb_id',
+}
+date_columns = {'release_date', 'first_air_date', 'last_air_date',
+                'birthday', 'deathday'}
+
+production_table = Production.__table__
+person_table = Person.__table__
+role_table = Role.__table__
+linkable_table = ImageLinkable.__table__
+
+
+def production_row(payload, media_type=None):
+    """ Converts a movie or TV show payload to the columns of a
+    Production. The media type ('movie' or 'tv') is taken from the
+    payload if it has one.
+    """
+    media_type = payload.get('media_type', media_type)
+    row = _row(payload, production_table, production_keys,
+               exclude={'type'})
+    row['type'] = production_types[media_type]
+    if media_type == 'tv' and 'type' in payload:
+        # Eg. 'Scripted' or 'Reality'.
+        row['tmdb_tv_type'] = payload['type']
+    return row
+
+
+def person_row(payload):
+    """ Converts a person payload (or an entry of a cast list) to the
+    columns of a Person.
+    """
+    return _row(payload, person_table, person_keys)
+
+
+def _row(payload, table, keys, exclude=()):
+    row = {}
+    for key, value in payload.items():
+        column = keys.get(key, key)
+        if column in table.c and column not in exclude \
+                and column != 'id':
+            if column in date_columns and not value:
+                # themoviedb.org uses '' for unknown dates.
+                value = None
+            row[column] = value
+    return row
+
+
+# ---------------------- Upserts ---------------------------------------
+
+def upsert(table, rows, key_columns, linkable_type, dedicated=False,
+           connection=None):
+    """ Inserts the given rows (dictionaries of column values) into the
+    given joined-table subclass of ImageLinkable, or updates them if a
+    row with the same values for 'key_columns' already exists. Returns
+    a dictionary from key values (tuples) to ids.
+    """
+    if connection is None:
+        with engine.begin() as connection:
+            return upsert(table, rows, key_columns, linkable_type,
+                          dedicated, connection)
+    # Deduplicate on the key, keeping the last row. Then sort on the
+    # key: concurrent upserts then lock the rows they share in the same
+    # order, so they can't deadlock.
+    rows = dict((tuple(row[column] for column in key_columns), row)
+                for row in rows)
+    rows = [rows[key] for key in sorted(rows)]
+    if not rows:
+        return {}
+    timestamp = 'last_dedicated_fetch' if dedicated \
+                else 'last_incidental_update'
+    # All rows of a multi-row INSERT must have the same columns.
+    columns = set([timestamp])
+    for row in rows:
+        columns.update(row)
+    columns.discard('id')
+    ids = {}
+    start = time.time()
+    for i in xrange(0, len(rows), batch_size):
+        batch = rows[i:i+batch_size]
+        ids.update(_upsert_batch(connection, table, batch, columns,
+                                 key_columns, linkable_type, timestamp))
+    duration = time.time() - start
+    logger.info(u'Upserted {} {} rows in {:.2f}s ({:.0f} rows/s).'
+                .format(len(rows), table.name, duration,
+                        len(rows) / duration if duration else 0))
+    return ids
+
+
+def _upsert_batch(connection, table, batch, columns, key_columns,
+                  linkable_type, timestamp):
+    keys = [tuple(row[column] for column in key_columns)
+            for row in batch]
+    key_cols = [table.c[column] for column in key_columns]
+    # Find the ids of the existing rows.
+    existing = dict(
+        (tuple(result[1:]), result[0]) for result in connection.execute(
+            select([table.c.id] + key_cols)
+            .where(tuple_(*key_cols).in_(keys))))
+    # Allocate ids for the new rows.
+    missing = len([key for key in keys if key not in existing])
+    allocated = []
+    if missing:
+        allocated = [result[0] for result in connection.execute(
+            linkable_table.insert()
+                          .values([{'linkable_type': linkable_type}]
+                                  * missing)
+                          .returning(linkable_table.c.id))]
+    new_ids = iter(allocated)
+    values = []
+    for key, row in zip(keys, batch):
+        # Missing values are bound as SQL NULL, so that the coalesce
+        # below keeps the stored value. (A plain None would be bound as
+        # JSON 'null' for JSONB columns.)
+        value = dict((column, null() if row.get(column) is None
+                              else row[column])
+                     for column in columns)
+        value[timestamp] = func.now()
+        value['id'] = existing[key] if key in existing else next(new_ids)
+        values.append(value)
+    statement = insert(table).values(values)
+    # Keep the stored value of columns that are missing (None) in the
+    # payload.
+    updates = dict((column, func.coalesce(statement.excluded[column],
+                                          table.c[column]))
+                   for column in columns
+                   if column not in key_columns)
+    statement = statement.on_conflict_do_update(
+                    index_elements=key_cols,
+                    set_=updates)\
+                .returning(*([table.c.id] + key_cols))
+    ids = dict((tuple(result[1:]), result[0])
+               for result in connection.execute(statement))
+    # Delete the ids that were allocated for rows that another process
+    # inserted in the meantime.
+    unused = set(allocated) - set(ids.values())
+    if unused:
+        connection.execute(linkable_table.delete()
+                           .where(linkable_table.c.id.in_(unused)))
+    return ids
+
+
+def ingest_productions(payloads, media_type=None, dedicated=False,
+                       connection=None):
+    """ Upserts the given movie or TV show payloads. Returns a
+    dictionary from (Production type, tmdb id) tuples to Production
+    ids.
+    """
+    rows = [production_row(payload, media_type) for payload in payloads]
+    fill_popularities(rows)
+    return upsert(production_table, rows, ('type', 'tmdb_id'),
+                  'production', dedicated, connection)
+
+
+def fill_popularities(rows):
+    """ Sets the popularity of the given Production rows that have none,
+    from the popularity table.
+    """
+    missing = [row for row in rows if row.get('popularity') is None]
+    table = popularity_table.current_table()
+    if not missing or table is None:
+        return
+    popularities = table.lookup([row['tmdb_id'] for row in missing],
+                                [media_types[row['type']]
+                                 for row in missing])
+    for row, popularity in zip(missing, popularities):
+        if popularity:
+            row['popularity'] = float(popularity)
+
+
+def ingest_people(payloads, dedicated=False, connection=None):
+    """ Upserts the given person payloads. Returns a dictionary from
+    (tmdb id,) tuples to Person ids.
+    """
+    return upsert(person_table,
+                  [person_row(payload) for payload in payloads],
+                  ('tmdb_id',), 'person', dedicated, connection)
+
+
+def ingest_roles(credits, connection=None):
+    """ Upserts the given roles, a list of (credit, production id,
+    person id) tuples, where 'credit' is an entry of a cast or crew
+    list of themoviedb.org. Returns a dictionary from (credit id,)
+    tuples to Role ids.
+    """
+    rows = []
+    for credit, production_id, person_id in credits:
+        if 'character' in credit:
+            name, department = credit['character'], 'cast'
+        else:
+            name, department = credit['job'], credit['department']
+        rows.append({'tmdb_id':       credit['credit_id'],
+                     'name':          name,
+                     'department':    department,
+                     'billing_order': credit.get('order'),
+                     'production_id': production_id,
+                     'person_id':     person_id})
+    return upsert(role_table, rows, ('tmdb_id',), 'role',
+                  connection=connection)
+
+
+def ingest_credits(production, media_type, credits, connection=None):
+    """ Ingests the credits (eg. the response of '/movie/{id}/credits')
+    of the given production. The production is marked as fetched
+    specifically, the people in its cast and crew as updated
+    incidentally.
+    """
+    if connection is None:
+        with engine.begin() as connection:
+            return ingest_credits(production, media_type, credits,
+                                  connection)
+    entries = credits.get('cast', []) + credits.get('crew', [])
+    production_ids = ingest_productions([production], media_type,
+                                        dedicated=True,
+                                        connection=connection)
+    production_id = production_ids.values()[0]
+    person_ids = ingest_people(
+        [{'id': entry['id'], 'name': entry['name'],
+          'profile_path': entry.get('profile_path')}
+         for entry in entries],
+        connection=connection)
+    ingest_roles([(entry, production_id, person_ids[entry['id'],])
+                  for entry in entries], connection)
+    known_for.refresh(person_ids.values(), connection)
+
+
+def ingest_combined_credits(person, combined_credits, connection=None):
+    """ Ingests the combined credits (the response of
+    '/person/{id}/combined_credits') of the given person. The person is
+    marked as fetched specifically, the productions as updated
+    incidentally.
+    """
+    if connection is None:
+        with engine.begin() as connection:
+            return ingest_combined_credits(person, combined_credits,
+                                           connection)
+    entries = combined_credits.get('cast', []) + \
+              combined_credits.get('crew', [])
+    entries = [entry for entry in entries
+               if entry.get('media_type') in production_types]
+    person_id = ingest_people([person], dedicated=True,
+                              connection=connection).values()[0]
+    # The entries describe the production, apart from the role-specific
+    # keys.
+    production_ids = ingest_productions(entries, connection=connection)
+    ingest_roles(
+        [(entry,
+          production_ids[production_types[entry['media_type']],
+                         entry['id']],
+          person_id)
+         for entry in entries], connection)
+    known_for.refresh([person_id], connection)
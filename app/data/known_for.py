@@ -0,0 +1,115 @@
+"""
+Maintains the KnownFor table: the 'top_n' cast roles of each person,
+ranked by the popularity of their productions, plus up to 'top_n' roles
+in productions whose popularity isn't stored (see below).
+
+Usage:
+
+    from data import known_for
+    # Recompute the rankings of all people marked as dirty:
+    known_for.refresh()
+    # Or of some of them only, eg. right after ingesting them:
+    known_for.refresh(person_ids=[1, 2, 3])
+
+Triggers on the role and production tables (see 'ddl') mark a
+person as dirty (in the 'known_for_dirty' table) when one of their
+cast roles is inserted, deleted, or moved, or when the popularity of
+one of their productions changes. `refresh` then
+recomputes the rankings of the dirty people with one set-based
+`INSERT ... SELECT` per batch, instead of per person. People that are
+not dirty are never touched.
+
+Refreshing happens in two places: right after ingesting credits (see
+'ingest'), and periodically for everyone else, eg. people whose
+productions changed popularity (see 'miner/sync.py'). Reads don't
+refresh, so that serving a page never writes.
+
+Productions without a stored popularity can't be ranked in SQL. They
+are not cut off behind the ranked ones: the first 'top_n' of them are
+kept as well, at the end of the ranking, and 'filmographies' ranks
+them by the popularity table when reading.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.sql import func
+from data.db_conn import engine
+from data.data_model import KnownFor, KnownForDirty, Role, Production
+
+
+# Length of the ranking of each person.
+top_n = 20
+
+# Number of people per refresh statement.
+batch_size = 1000
+
+# Only movies and TV shows are ranked (not their episodes, etc.).
+ranked_types = ('movie', 'tv_show')
+
+known_for_table = KnownFor.__table__
+dirty_table = KnownForDirty.__table__
+role_table = Role.__table__
+production_table = Production.__table__
+
+
+def refresh(person_ids=None, connection=None):
+    """ Recomputes the rankings of the people that are marked as dirty
+    (only those among 'person_ids', if given), and unmarks them.
+    Returns the number of people refreshed. People that another
+    transaction is refreshing at the same time are skipped.
+    """
+    if connection is None:
+        with engine.begin() as connection:
+            return refresh(person_ids, connection)
+    if person_ids is not None and not person_ids:
+        return 0
+    refreshed = 0
+    while True:
+        claimed = select([dirty_table.c.person_id])\
+                  .limit(batch_size)\
+                  .with_for_update(skip_locked=True)
+        if person_ids is not None:
+            claimed = claimed.where(
+                          dirty_table.c.person_id.in_(person_ids))
+        ids = [person_id for (person_id,) in connection.execute(
+                   dirty_table.delete()
+                              .where(dirty_table.c.person_id.in_(claimed))
+                              .returning(dirty_table.c.person_id))]
+        if not ids:
+            return refreshed
+        _rank(connection, ids)
+        refreshed += len(ids)
+
+
+def _rank(connection, person_ids):
+    connection.execute(known_for_table.delete()
+                       .where(known_for_table.c.person_id.in_(person_ids)))
+    popularity = production_table.c.popularity
+    rank = func.row_number().over(
+               partition_by=role_table.c.person_id,
+               order_by=(popularity.desc().nullslast(), role_table.c.id))
+    # The rank among the roles with, or among those without popularity.
+    rank_in_group = func.row_number().over(
+               partition_by=(role_table.c.person_id,
+                             popularity.is_(None)),
+               order_by=(popularity.desc(), role_table.c.id))
+    ranked = select([role_table.c.person_id,
+                     rank.label('rank'),
+                     rank_in_group.label('rank_in_group'),
+                     role_table.c.id.label('role_id'),
+                     role_table.c.production_id,
+                     production_table.c.popularity])\
+             .select_from(role_table.join(
+                 production_table,
+                 production_table.c.id == role_table.c.production_id))\
+             .where(role_table.c.person_id.in_(person_ids))\
+             .where(role_table.c.department == 'cast')\
+             .where(production_table.c.type.in_(ranked_types))\
+             .alias('ranked')
+    connection.execute(
+        known_for_table.insert().from_select(
+            ['person_id', 'rank', 'role_id', 'production_id',
+             'popularity'],
+            select([ranked.c.person_id, ranked.c.rank,
+                    ranked.c.role_id, ranked.c.production_id,
+                    ranked.c.popularity])
+            .where(ranked.c.rank_in_group <= top_n)))
@@ -0,0 +1,33 @@
+"""upsert constraints on tmdb ids
+
+Revision ID: 3a1f9c2e7b4d
+Revises: ff6eb86386bc
+Create Date: 2026-10-18 14:30:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a1f9c2e7b4d'
+down_revision = 'ff6eb86386bc'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_unique_constraint('production_type_tmdb_id_key',
+                                'production', ['type', 'tmdb_id'])
+    op.create_unique_constraint('person_tmdb_id_key',
+                                'person', ['tmdb_id'])
+    op.create_unique_constraint('role_tmdb_id_key',
+                                'role', ['tmdb_id'])
+    op.add_column('role', sa.Column('billing_order', sa.Integer()))
+
+
+def downgrade():
+    op.drop_column('role', 'billing_order')
+    op.drop_constraint('role_tmdb_id_key', 'role')
+    op.drop_constraint('person_tmdb_id_key', 'person')
+    op.drop_constraint('production_type_tmdb_id_key', 'production')
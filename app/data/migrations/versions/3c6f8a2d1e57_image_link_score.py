@@ -0,0 +1,43 @@
+"""image link score
+
+Revision ID: 3c6f8a2d1e57
+Revises: 7f1d4b6e0a29
+Create Date: 2026-10-18 19:30:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c6f8a2d1e57'
+down_revision = '7f1d4b6e0a29'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from data import ddl
+
+
+def upgrade():
+    op.add_column('image_link',
+                  sa.Column('score', sa.Float(), nullable=False,
+                            server_default='0'))
+    for statement in ddl.image_link_score:
+        op.execute(statement)
+    op.execute('UPDATE image_link SET score = image_link_score('
+               'upvotes, downvotes, "Google_position")')
+    op.create_index('image_link_top', 'image_link',
+                    ['linkable_id', sa.text('score DESC'), 'id',
+                     'image_id', 'time_created'])
+    # A prefix of 'image_link_top'.
+    op.drop_index('ix_image_link_linkable_id', 'image_link')
+
+
+def downgrade():
+    op.create_index('ix_image_link_linkable_id', 'image_link',
+                    ['linkable_id'])
+    op.drop_index('image_link_top', 'image_link')
+    op.execute('DROP TRIGGER image_link_score_update ON image_link')
+    op.execute('DROP TRIGGER image_link_score_insert ON image_link')
+    op.execute('DROP FUNCTION set_image_link_score()')
+    op.execute('DROP FUNCTION image_link_score(integer, integer, integer)')
+    op.drop_column('image_link', 'score')
@@ -0,0 +1,49 @@
+"""job queue
+
+Revision ID: 5d7b0e9a1c82
+Revises: 8c4e21d0f6a3
+Create Date: 2026-10-18 15:30:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d7b0e9a1c82'
+down_revision = '8c4e21d0f6a3'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+def upgrade():
+    job = op.create_table('job',
+        sa.Column('time_created', sa.DateTime(timezone=True),
+                  server_default=sa.func.now()),
+        sa.Column('time_updated', sa.DateTime(timezone=True)),
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('payload', JSONB()),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('priority', sa.Float(), nullable=False,
+                  server_default='0'),
+        sa.Column('status', sa.Enum('pending', 'failed',
+                                    name='JobStatuses'),
+                  nullable=False, server_default='pending'),
+        sa.Column('attempts', sa.Integer(), nullable=False,
+                  server_default='0'),
+        sa.Column('run_after', sa.DateTime(timezone=True),
+                  nullable=False, server_default=sa.func.now()),
+        sa.Column('last_error', sa.String()))
+    op.create_index('job_pending_key', 'job', ['kind', 'key'],
+                    unique=True,
+                    postgresql_where=sa.text("status = 'pending'"))
+    op.create_index('job_pending_priority', 'job',
+                    [sa.text('priority DESC'), 'run_after'],
+                    postgresql_where=sa.text("status = 'pending'"))
+
+
+def downgrade():
+    op.drop_table('job')
+    sa.Enum(name='JobStatuses').drop(op.get_bind())
@@ -0,0 +1,24 @@
+"""image thumb path
+
+Revision ID: 7f1d4b6e0a29
+Revises: e2a8c5d93f17
+Create Date: 2026-10-18 18:20:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7f1d4b6e0a29'
+down_revision = 'e2a8c5d93f17'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('image', sa.Column('thumb_path', sa.String()))
+
+
+def downgrade():
+    op.drop_column('image', 'thumb_path')
@@ -0,0 +1,26 @@
+"""sync checkpoints
+
+Revision ID: 8c4e21d0f6a3
+Revises: 3a1f9c2e7b4d
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8c4e21d0f6a3'
+down_revision = '3a1f9c2e7b4d'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('sync_checkpoint',
+        sa.Column('feed', sa.String(), primary_key=True),
+        sa.Column('synced_until', sa.DateTime(timezone=True)))
+
+
+def downgrade():
+    op.drop_table('sync_checkpoint')
@@ -0,0 +1,31 @@
+"""role last image search
+
+Revision ID: a5e0c7d2f914
+Revises: 3c6f8a2d1e57
+Create Date: 2026-10-18 21:10:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a5e0c7d2f914'
+down_revision = '3c6f8a2d1e57'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('role', sa.Column('last_image_search',
+                                    sa.DateTime(timezone=True)))
+    # Roles with images were searched for when their images were
+    # linked.
+    op.execute('UPDATE role SET last_image_search = searched.time '
+               'FROM (SELECT linkable_id, max(time_created) AS time '
+               '      FROM image_link GROUP BY linkable_id) AS searched '
+               'WHERE role.id = searched.linkable_id')
+
+
+def downgrade():
+    op.drop_column('role', 'last_image_search')
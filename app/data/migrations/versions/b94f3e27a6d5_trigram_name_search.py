@@ -0,0 +1,37 @@
+"""trigram name search
+
+Revision ID: b94f3e27a6d5
+Revises: 5d7b0e9a1c82
+Create Date: 2026-10-18 16:10:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b94f3e27a6d5'
+down_revision = '5d7b0e9a1c82'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+
+
+# Index name, table, and indexed expression.
+indexes = [
+    ('production_name_trgm', 'production', 'name'),
+    ('production_original_name_trgm', 'production', 'original_name'),
+    ('person_name_trgm', 'person', 'name'),
+    ('person_also_known_as_trgm', 'person', 'CAST(also_known_as AS TEXT)'),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, expression in indexes:
+        op.execute('CREATE INDEX {} ON {} USING gin ({} gin_trgm_ops)'
+                   .format(name, table, expression))
+
+
+def downgrade():
+    for name, table, expression in indexes:
+        op.drop_index(name, table_name=table)
+    # The extension may be used elsewhere, so we leave it installed.
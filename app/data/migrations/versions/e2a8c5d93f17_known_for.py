@@ -0,0 +1,52 @@
+"""known for
+
+Revision ID: e2a8c5d93f17
+Revises: b94f3e27a6d5
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e2a8c5d93f17'
+down_revision = 'b94f3e27a6d5'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from data import ddl
+
+
+def upgrade():
+    op.create_table('known_for',
+        sa.Column('person_id', sa.Integer(),
+                  sa.ForeignKey('person.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('rank', sa.Integer(), primary_key=True),
+        sa.Column('role_id', sa.Integer(),
+                  sa.ForeignKey('role.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('production_id', sa.Integer(),
+                  sa.ForeignKey('production.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('popularity', sa.Float()))
+    op.create_table('known_for_dirty',
+        sa.Column('person_id', sa.Integer(), primary_key=True))
+    for statement in ddl.known_for:
+        op.execute(statement)
+    # Rank everyone on the next refresh.
+    op.execute("""
+        INSERT INTO known_for_dirty (person_id)
+        SELECT DISTINCT person_id FROM role
+        WHERE department = 'cast' AND person_id IS NOT NULL
+    """)
+
+
+def downgrade():
+    op.execute('DROP TRIGGER production_known_for_update ON production')
+    op.execute('DROP TRIGGER role_known_for_update ON role')
+    op.execute('DROP TRIGGER role_known_for_insert_delete ON role')
+    op.execute('DROP FUNCTION mark_known_for_dirty_production()')
+    op.execute('DROP FUNCTION mark_known_for_dirty_role()')
+    op.drop_table('known_for_dirty')
+    op.drop_table('known_for')
@@ -0,0 +1,243 @@
+"""
+The read path of the hot queries of the search page, on the production,
+person, role and known_for tables directly.
+
+Usage:
+
+    from data import read_model
+    production = read_model.get_production('movie', 286217)
+    cast = read_model.get_cast(production.id, num_cast_members=7)
+    credits = read_model.get_known_for([member.person_id
+                                        for member in cast])
+
+Production, Person and Role are joined-table subclasses of
+ImageLinkable, so every ORM query on them joins the 'image_linkable'
+table, even for columns that are all in the subclass table (and even
+twice, when joining Role to Person). ORM instances also come with an
+identity map and lazy loaded relationships: touching `role.person` or
+`role.production` (as `Role.__repr__` does) costs a query per role.
+
+The functions below are SQLAlchemy Core queries instead, that never
+join 'image_linkable', and load everything a page needs with one query
+per function. They return lightweight records (see `Record`), which
+hold only the selected values and no references to a session.
+"""
+
+from sqlalchemy import select, case, null, true, Integer
+from sqlalchemy.dialects.postgresql import array
+from sqlalchemy.sql import func
+from data.db_conn import db_session
+from data.data_model import (Production, Person, Role, KnownFor, Image,
+                             ImageLink)
+
+
+production_table = Production.__table__
+person_table = Person.__table__
+role_table = Role.__table__
+known_for_table = KnownFor.__table__
+image_table = Image.__table__
+image_link_table = ImageLink.__table__
+
+
+class Record(object):
+    """ A row of query results, with attribute access to its values.
+    Subclasses list the names of the values in '__slots__', in the
+    order of the selected columns.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return u'<{} {}>'.format(
+                 type(self).__name__,
+                 u', '.join(u'{}={!r}'.format(name, getattr(self, name))
+                            for name in self.__slots__))
+
+
+class ProductionRecord(Record):
+    __slots__ = ('id', 'state')
+
+
+class CastMember(Record):
+    __slots__ = ('person_id', 'tmdb_id', 'name', 'profile_path',
+                 'character', 'credit_id', 'billing_order', 'state')
+
+
+class Credit(Record):
+    __slots__ = ('person_id', 'rank', 'character', 'credit_id',
+                 'tmdb_id', 'type', 'name', 'poster_path',
+                 'release_date', 'first_air_date', 'popularity')
+
+
+class ImageRecord(Record):
+    # The names of the columns of Image, so that ImageRecords can be
+    # used in place of Images.
+    __slots__ = ('linkable_id', 'link_id', 'rank', 'fresh', 'id',
+                 'thumb_url',
+                 'thumb_width', 'thumb_height', 'thumb_path',
+                 'original_url', 'original_width', 'original_height',
+                 'original_filetype', 'source_page_url', 'source_domain',
+                 'Google_title', 'Google_description')
+
+
+def is_fresh(last_dedicated_fetch, max_age):
+    """ Returns a SQL expression that is true if the given timestamp
+    column is less than 'max_age' ago.
+    """
+    return func.coalesce(last_dedicated_fetch > func.now() - max_age,
+                         False)
+
+
+def freshness(last_dedicated_fetch, max_age):
+    """ Returns a SQL expression that is 'fresh' if the given timestamp
+    column is less than 'max_age' ago, 'missing' if it is null, and
+    'stale' otherwise.
+    """
+    return case([(last_dedicated_fetch.is_(None), 'missing'),
+                 (is_fresh(last_dedicated_fetch, max_age), 'fresh')],
+                else_='stale')
+
+
+def _records(record_class, query):
+    return [record_class(*row) for row in db_session.execute(query)]
+
+
+def get_production(production_type, tmdb_id, max_age=None):
+    """ Returns the id of the Production with the given type and tmdb id
+    and the freshness of its credits (or None, without 'max_age'), as a
+    ProductionRecord, or None if there is no such Production.
+    """
+    p = production_table.c
+    state = freshness(p.last_dedicated_fetch, max_age) \
+            if max_age is not None else null()
+    records = _records(ProductionRecord,
+                       select([p.id, state])
+                       .where(p.type == production_type)
+                       .where(p.tmdb_id == tmdb_id))
+    return records[0] if records else None
+
+
+def get_cast(production_id, num_cast_members, max_age=None):
+    """ Returns the top billed cast of the given Production, as a list
+    of CastMembers. Their 'state' is the freshness of the combined
+    credits of the person (or None, without 'max_age').
+    """
+    person, role = person_table.c, role_table.c
+    state = freshness(person.last_dedicated_fetch, max_age) \
+            if max_age is not None else null()
+    return _records(CastMember,
+                    select([person.id, person.tmdb_id, person.name,
+                            person.profile_path, role.name, role.tmdb_id,
+                            role.billing_order, state])
+                    .select_from(role_table.join(
+                        person_table, person.id == role.person_id))
+                    .where(role.production_id == production_id)
+                    .where(role.department == 'cast')
+                    .order_by(role.billing_order)
+                    .limit(num_cast_members))
+
+
+def get_known_for(person_ids):
+    """ Returns the top cast credits of the given people (see
+    'known_for'), as a list of Credits, ordered by person and rank.
+    """
+    if not person_ids:
+        return []
+    known_for, role, production = known_for_table.c, role_table.c, \
+                                  production_table.c
+    return _records(Credit,
+                    select([known_for.person_id, known_for.rank,
+                            role.name, role.tmdb_id,
+                            production.tmdb_id, production.type,
+                            production.name, production.poster_path,
+                            production.release_date,
+                            production.first_air_date,
+                            known_for.popularity])
+                    .select_from(
+                        known_for_table
+                        .join(role_table, role.id == known_for.role_id)
+                        .join(production_table,
+                              production.id == known_for.production_id))
+                    .where(known_for.person_id.in_(person_ids))
+                    .order_by(known_for.person_id, known_for.rank))
+
+
+def get_role_id(credit_id):
+    """ Returns the id of the Role with the given themoviedb.org credit
+    id, or None.
+    """
+    return db_session.execute(
+               select([role_table.c.id])
+               .where(role_table.c.tmdb_id == credit_id)).scalar()
+
+
+def get_role_ids(credit_ids):
+    """ Returns a dictionary from the given themoviedb.org credit ids to
+    the ids of their Roles, for the Roles that exist.
+    """
+    if not credit_ids:
+        return {}
+    return dict(db_session.execute(
+                    select([role_table.c.tmdb_id, role_table.c.id])
+                    .where(role_table.c.tmdb_id.in_(credit_ids)))
+                .fetchall())
+
+
+def get_searched_role_ids(role_ids, max_age):
+    """ Returns the set of the given Role ids that were searched for on
+    Google Images less than 'max_age' ago, whether or not the search
+    found images.
+    """
+    if not role_ids:
+        return set()
+    return set(role_id for (role_id,) in db_session.execute(
+                   select([role_table.c.id])
+                   .where(role_table.c.id.in_(role_ids))
+                   .where(is_fresh(role_table.c.last_image_search,
+                                   max_age))))
+
+
+def load_top_images(linkable_ids, per_linkable=None, max_age=None):
+    """ Returns a dictionary from the given ImageLinkable ids to their
+    top 'per_linkable' (default: all) images, as lists of ImageRecords,
+    best first, by their score (see `ImageLink.score`). Ids without
+    images are left out. The records of images that were linked
+    'max_age' ago or longer (if given) are not 'fresh'.
+
+    This is a single query. For each linkable, a lateral subquery reads
+    the first 'per_linkable' entries of its range in the
+    'image_link_top' index, without sorting, and without reading the
+    other links of the linkable.
+    """
+    if not linkable_ids:
+        return {}
+    link, image = image_link_table.c, image_table.c
+    linkables = select([func.unnest(array(linkable_ids, type_=Integer))
+                        .label('linkable_id')])\
+                .alias('linkables')
+    fresh = is_fresh(link.time_created, max_age) if max_age is not None \
+            else true()
+    top = select([link.id, link.image_id, link.score,
+                  fresh.label('fresh')])\
+          .where(link.linkable_id == linkables.c.linkable_id)\
+          .order_by(link.score.desc(), link.id)
+    if per_linkable is not None:
+        top = top.limit(per_linkable)
+    top = top.lateral('top')
+    rank = func.row_number().over(partition_by=linkables.c.linkable_id,
+                                  order_by=(top.c.score.desc(), top.c.id))
+    columns = [image[name] for name in ImageRecord.__slots__[4:]]
+    query = select([linkables.c.linkable_id, top.c.id, rank,
+                    top.c.fresh] + columns)\
+            .select_from(linkables.join(top, true())
+                                  .join(image_table,
+                                        image.id == top.c.image_id))\
+            .order_by(linkables.c.linkable_id, top.c.score.desc(),
+                      top.c.id)
+    images = {}
+    for record in _records(ImageRecord, query):
+        images.setdefault(record.linkable_id, []).append(record)
+    return images
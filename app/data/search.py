@@ -0,0 +1,202 @@
+"""
+Local name search over the movies, TV shows and people that we store,
+with the trigram indexes of PostgreSQL's 'pg_trgm' extension (see the
+indexes in 'data_model').
+
+Usage:
+
+    from data import search
+    search.search_productions('the martian')
+    # -> [{'media_type': 'movie', 'id': 286217, 'title': 'The Martian',
+    #      'popularity': 8.41, ...}, ...]
+    search.search_people('matt damon')
+    # Best matching production, or None if there is no confident match:
+    search.resolve('the martian')
+    # Names starting with the given text, for search-as-you-type:
+    search.autocomplete('the mar')
+
+Productions are matched on their name and original name, people on
+their name and the names they are also known as. A name matches when
+the query is similar to (a part of) it, by trigram word similarity.
+Matches are ranked by that similarity, weighted by popularity, much
+like themoviedb.org ranks its search results.
+
+Results have the format of the results of themoviedb.org's
+'/search/multi', so that they can be used in its place.
+"""
+
+from sqlalchemy import select, literal, or_, union_all, Text, cast
+from sqlalchemy.sql import func
+from data.db_conn import db_session
+from data.data_model import Production, Person
+from data.ingest import media_types
+
+
+# Weight of (the logarithm of) the popularity in the ranking.
+popularity_weight = 0.2
+
+# `resolve` only returns a production whose name (or original name) is
+# at least this similar to the whole query.
+min_confidence = 0.8
+
+# Autocomplete needs at least this many characters.
+min_prefix_length = 2
+
+production_table = Production.__table__
+person_table = Person.__table__
+
+
+def escape_like(text):
+    """ Escapes the wildcards in the given text, for use in a LIKE
+    pattern with '!' as escape character.
+    """
+    return text.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+
+
+def _matches(query, column):
+    # 'query <% column': the query is similar to a part of the column.
+    # This operator can use the trigram indexes.
+    return literal(query).op('<%')(column)
+
+
+def _rank(similarity, popularity):
+    return similarity * (1 + popularity_weight *
+                         func.ln(1 + func.coalesce(popularity, 0)))
+
+
+def search_productions(query, limit=10):
+    """ Returns the movies and TV shows with a name or original name
+    similar to the given query, best matches first.
+    """
+    p = production_table.c
+    similarity = func.greatest(func.word_similarity(query, p.name),
+                               func.word_similarity(query,
+                                                    p.original_name))
+    rows = db_session.execute(_select_productions(query)
+                              .order_by(_rank(similarity,
+                                              p.popularity).desc())
+                              .limit(limit))
+    return [production_result(row) for row in rows]
+
+
+def _select_productions(query):
+    p = production_table.c
+    return select([p.type, p.tmdb_id, p.name, p.original_name,
+                   p.popularity, p.poster_path, p.release_date,
+                   p.first_air_date])\
+           .where(or_(_matches(query, p.name),
+                      _matches(query, p.original_name)))\
+           .where(p.type.in_(media_types))
+
+
+def search_people(query, limit=10):
+    """ Returns the people with a name (or an also known as name)
+    similar to the given query, best matches first.
+    """
+    p = person_table.c
+    also_known_as = cast(p.also_known_as, Text)
+    similarity = func.greatest(func.word_similarity(query, p.name),
+                               func.word_similarity(query,
+                                                    also_known_as))
+    rows = db_session.execute(
+               select([p.tmdb_id, p.name, p.popularity,
+                       p.profile_path])
+               .where(or_(_matches(query, p.name),
+                          _matches(query, also_known_as)))
+               .order_by(_rank(similarity, p.popularity).desc())
+               .limit(limit))
+    return [{'media_type':   'person',
+             'id':           row.tmdb_id,
+             'name':         row.name,
+             'popularity':   row.popularity,
+             'profile_path': row.profile_path}
+            for row in rows]
+
+
+def resolve(query):
+    """ Returns the best matching production for the given query, if
+    its name (or original name) as a whole is similar enough to the
+    query. Returns None otherwise, eg. when the query only matches part
+    of the name of a production, or the best match may be a production
+    that we don't store (yet).
+    """
+    p = production_table.c
+    similarity = func.greatest(func.similarity(p.name, query),
+                               func.similarity(p.original_name, query))
+    row = db_session.execute(
+              _select_productions(query)
+              .where(similarity >= min_confidence)
+              .order_by(_rank(similarity, p.popularity).desc())
+              .limit(1)).first()
+    if row is None:
+        return None
+    return production_result(row)
+
+
+def autocomplete(prefix, limit=10):
+    """ Returns the (most popular) movies, TV shows and people with a
+    name in which a word starts with the given prefix, as a list of
+    dictionaries with a 'label', 'media_type', and 'id'.
+    """
+    prefix = prefix.strip()
+    if len(prefix) < min_prefix_length:
+        return []
+    patterns = [escape_like(prefix) + '%',
+                '% ' + escape_like(prefix) + '%']
+
+    def starts_with(column):
+        return or_(*[column.ilike(pattern, escape='!')
+                     for pattern in patterns])
+
+    productions = select([production_table.c.name.label('label'),
+                          # Text, like the 'person' type below.
+                          cast(production_table.c.type, Text)
+                              .label('type'),
+                          production_table.c.tmdb_id.label('id'),
+                          production_table.c.popularity])\
+                  .where(starts_with(production_table.c.name))\
+                  .where(production_table.c.type.in_(media_types))\
+                  .order_by(production_table.c.popularity.desc()
+                                                          .nullslast())\
+                  .limit(limit)
+    people = select([person_table.c.name.label('label'),
+                     literal('person').label('type'),
+                     person_table.c.tmdb_id.label('id'),
+                     person_table.c.popularity])\
+             .where(starts_with(person_table.c.name))\
+             .order_by(person_table.c.popularity.desc().nullslast())\
+             .limit(limit)
+    matches = union_all(productions, people).alias('matches')
+    rows = db_session.execute(
+               select([matches])
+               .order_by(matches.c.popularity.desc().nullslast())
+               .limit(limit))
+    return [{'label':      row.label,
+             'media_type': media_types.get(row.type, row.type),
+             'id':         row.id}
+            for row in rows]
+
+
+def production_result(row):
+    """ Converts a row of the production table to the format of a
+    themoviedb.org search result.
+    """
+    media_type = media_types[row.type]
+    result = {'media_type':  media_type,
+              'id':          row.tmdb_id,
+              'popularity':  row.popularity,
+              'poster_path': row.poster_path}
+    if media_type == 'movie':
+        result['title'] = row.name
+        result['original_title'] = row.original_name
+        result['release_date'] = _date(row.release_date)
+    else:
+        result['name'] = row.name
+        result['original_name'] = row.original_name
+        result['first_air_date'] = _date(row.first_air_date)
+    return result
+
+
+def _date(date):
+    # themoviedb.org formats dates as strings.
+    return date.isoformat() if date is not None else None
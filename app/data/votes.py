@@ -0,0 +1,200 @@
+"""
+Write-behind counting of the votes on images (the 'upvotes' and
+'downvotes' of ImageLinks).
+
+Usage:
+
+    from data import votes
+    votes.vote(link_id, up=True)
+    # Write all buffered votes now (also done at exit):
+    votes.buffer.flush()
+
+Votes are not written one by one: a row update per vote would make
+concurrent voters on a popular image queue for its row lock. Instead,
+each process adds votes up in memory, per ImageLink, and writes them
+with one `UPDATE ... SET upvotes = upvotes + n` statement for all
+buffered ImageLinks. That happens every 'flush_interval' seconds (on a
+background thread), when 'max_votes' votes are buffered (on the thread
+of the vote that fills the buffer), and when the process exits
+normally (see `atexit` and 'webapp/gunicorn_conf.py'). The increments
+are relative, so flushes from different processes never overwrite each
+other, and rows are updated in order of id, so they don't deadlock.
+
+
+Loss bound
+
+A process that crashes (eg. is killed or runs out of memory) loses the
+votes it has not written yet: at most those of the last
+'flush_interval' seconds, and never more than 'max_votes' votes (plus
+those of a flush that is in progress, which is at most another
+'max_votes'). A flush that fails (eg. because the database is down) is
+logged, and its votes are put back in the buffer, to be retried with
+the next flush. During a database outage, the bound thus no longer
+holds: all votes since the outage are at risk.
+
+When the database rejects the statement itself (eg. an id that is out
+of range), retrying it would fail forever. The votes are then written
+one ImageLink at a time, and only the votes that are rejected again
+are dropped.
+"""
+
+import atexit
+import os
+import threading
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError
+from loggers import logger
+from data.db_conn import engine
+
+
+# Write buffered votes at least this often (in seconds) ...
+flush_interval = 5.0
+# ... and as soon as this many votes are buffered.
+max_votes = 1000
+
+# ImageLink ids are PostgreSQL 'integer's.
+max_link_id = 2**31 - 1
+
+# Errors of votes that the database will never accept.
+rejected_errors = (DataError, IntegrityError)
+
+
+def write_votes(counts):
+    """ Adds the given vote counts, a sorted list of (ImageLink id,
+    upvotes, downvotes) tuples, to the ImageLinks, in one statement.
+    Votes for ImageLinks that no longer exist are dropped.
+    """
+    params = {}
+    rows = []
+    for i, (link_id, up, down) in enumerate(counts):
+        params.update({'id_{}'.format(i): link_id,
+                       'up_{}'.format(i): up,
+                       'down_{}'.format(i): down})
+        rows.append('(CAST(:id_{0} AS INTEGER), CAST(:up_{0} AS INTEGER),'
+                    ' CAST(:down_{0} AS INTEGER))'.format(i))
+    with engine.begin() as connection:
+        connection.execute(text(
+            'UPDATE image_link '
+            'SET upvotes = COALESCE(image_link.upvotes, 0) + votes.up, '
+            'downvotes = COALESCE(image_link.downvotes, 0) + votes.down '
+            'FROM (VALUES {}) AS votes (id, up, down) '
+            'WHERE image_link.id = votes.id'.format(', '.join(rows))),
+            params)
+
+
+class VoteBuffer(object):
+
+    def __init__(self, write=write_votes, flush_interval=flush_interval,
+                 max_votes=max_votes):
+        """ Buffers votes, and passes them to 'write' (see
+        `write_votes`) every 'flush_interval' seconds, or when
+        'max_votes' votes are buffered.
+        """
+        self.write = write
+        self.flush_interval = flush_interval
+        self.max_votes = max_votes
+        # ImageLink id -> [upvotes, downvotes]
+        self._counts = {}
+        self._num_votes = 0
+        self._lock = threading.Lock()
+        # The flushing thread, and the process that started it (threads
+        # don't survive a fork, eg. of a gunicorn worker).
+        self._thread = None
+        self._pid = None
+
+    def add(self, link_id, up=True):
+        """ Buffers a vote on the ImageLink with the given id. Flushes
+        the buffer if it is full.
+        """
+        self._start()
+        with self._lock:
+            counts = self._counts.setdefault(link_id, [0, 0])
+            counts[0 if up else 1] += 1
+            self._num_votes += 1
+            full = self._num_votes >= self.max_votes
+        if full:
+            self.flush()
+
+    def flush(self):
+        """ Writes all buffered votes. Returns the number of votes
+        written. On failure, the votes are put back in the buffer.
+        Votes that the database rejects are dropped.
+        """
+        with self._lock:
+            counts, num_votes = self._counts, self._num_votes
+            self._counts, self._num_votes = {}, 0
+        if not counts:
+            return 0
+        counts = sorted((link_id, up, down) for link_id, (up, down)
+                        in counts.iteritems())
+        try:
+            self.write(counts)
+        except rejected_errors:
+            logger.exception(u'The database rejected {} votes; writing '
+                             u'them one ImageLink at a time.'
+                             .format(num_votes))
+            return self._write_each(counts)
+        except Exception:
+            logger.exception(u'Could not write {} votes; will retry.'
+                             .format(num_votes))
+            self._put_back(counts)
+            return 0
+        return num_votes
+
+    def _write_each(self, counts):
+        written = 0
+        failed = []
+        for link_id, up, down in counts:
+            try:
+                self.write([(link_id, up, down)])
+                written += up + down
+            except rejected_errors:
+                logger.exception(u'Dropped {} votes on ImageLink {}.'
+                                 .format(up + down, link_id))
+            except Exception:
+                failed.append((link_id, up, down))
+        if failed:
+            logger.error(u'Could not write the votes on {} ImageLinks; '
+                         u'will retry.'.format(len(failed)))
+            self._put_back(failed)
+        return written
+
+    def _put_back(self, counts):
+        with self._lock:
+            for link_id, up, down in counts:
+                buffered = self._counts.setdefault(link_id, [0, 0])
+                buffered[0] += up
+                buffered[1] += down
+                self._num_votes += up + down
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+
+            def run():
+                while True:
+                    time.sleep(self.flush_interval)
+                    self.flush()
+
+            self._thread = threading.Thread(target=run,
+                                            name='vote-flusher')
+            self._thread.daemon = True
+            self._thread.start()
+
+
+# The buffer of this process.
+buffer = VoteBuffer()
+atexit.register(buffer.flush)
+
+
+def vote(link_id, up=True):
+    """ Counts an upvote (or, with 'up' False, a downvote) on the
+    ImageLink with the given id. The vote is written within
+    'flush_interval' seconds.
+    """
+    buffer.add(link_id, up)
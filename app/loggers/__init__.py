@@ -26,10 +26,16 @@ Usage:
 The environment variable 'LOGGING_LEVEL' is the minimum severity level
 of a log message for it to be output to the logging handlers.
 Must be one of: 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'.
+
+Per-request timings (see 'spans') go to a separate logger,
+'trace_logger'. Set 'LOGSTASH_ADDRESS' (eg. 'logstash:5000') to send
+them, as JSON, to logstash (see 'logstash'). With 'LOGGING_LEVEL'
+'DEBUG', they are also printed.
 """
 
 import logging
 import os
+from loggers.logstash import JsonLinesHandler
 
 logging_level = getattr(logging, os.getenv('LOGGING_LEVEL'))
 
@@ -48,3 +54,14 @@ console_output = logging.StreamHandler()
 console_output.setLevel(logging_level)
 console_output.setFormatter(simple_formatter)
 logger.addHandler(console_output)
+
+# Structured per-request timings (see 'spans').
+trace_logger = logging.getLogger('traces')
+trace_logger.setLevel(logging.INFO)
+trace_logger.propagate = False
+if logging_level <= logging.DEBUG:
+    trace_logger.addHandler(console_output)
+logstash_address = os.getenv('LOGSTASH_ADDRESS')
+if logstash_address:
+    host, port = logstash_address.rsplit(':', 1)
+    trace_logger.addHandler(JsonLinesHandler(host, int(port)))
@@ -0,0 +1,105 @@
+"""
+A logging handler that sends log records as JSON lines to a TCP
+input of logstash with the 'json_lines' codec (see
+'monitoring/logstash/logstash.conf').
+
+Usage:
+
+    handler = JsonLinesHandler('logstash', 5000)
+    logger.addHandler(handler)
+    logger.info('Message', extra={'trace': {...}})
+
+Each record becomes one JSON document, with the message, the level,
+the logger name and a timestamp, plus the 'extra' fields that can be
+converted to JSON. Records are sent by a background thread, so logging
+never waits for the network. When logstash can't keep up or is down,
+records are dropped (at most 'max_queued' are kept), and the
+connection is retried after 'retry_delay' seconds.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from Queue import Queue, Full
+
+
+# Attributes of every LogRecord, which are not 'extra' fields.
+_standard_attributes = set(vars(logging.LogRecord(
+                               '', 0, '', 0, '', (), None)).keys()) | \
+                       set(['message', 'asctime'])
+
+
+class JsonLinesHandler(logging.Handler):
+
+    def __init__(self, host, port, max_queued=10000, retry_delay=5.0,
+                 timeout=2.0):
+        logging.Handler.__init__(self)
+        self.address = (host, port)
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.queue = Queue(max_queued)
+        self.dropped = 0
+        self._socket = None
+        # The sending thread, and the process that started it (threads
+        # don't survive a fork, eg. of a gunicorn worker).
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        try:
+            line = self.format_json(record)
+        except Exception:
+            self.handleError(record)
+            return
+        self._start()
+        try:
+            self.queue.put_nowait(line)
+        except Full:
+            self.dropped += 1
+
+    def format_json(self, record):
+        document = {'@timestamp': datetime.utcfromtimestamp(
+                                      record.created).isoformat() + 'Z',
+                    'message': record.getMessage(),
+                    'level': record.levelname,
+                    'logger': record.name,
+                    'host': socket.gethostname(),
+                    'pid': record.process}
+        for key, value in vars(record).items():
+            if key not in _standard_attributes:
+                document[key] = value
+        return json.dumps(document, default=repr) + '\n'
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # The queue and socket of a parent process are the parent's.
+            self.queue = Queue(self.queue.maxsize)
+            self._socket = None
+            thread = threading.Thread(target=self._send_forever,
+                                      name='logstash-sender')
+            thread.daemon = True
+            thread.start()
+
+    def _send_forever(self):
+        while True:
+            line = self.queue.get()
+            try:
+                if self._socket is None:
+                    self._socket = socket.create_connection(
+                                       self.address, self.timeout)
+                self._socket.sendall(line)
+            except (socket.error, socket.timeout):
+                self.dropped += 1
+                if self._socket is not None:
+                    self._socket.close()
+                    self._socket = None
+                time.sleep(self.retry_delay)
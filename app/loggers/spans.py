@@ -0,0 +1,252 @@
+"""
+Per-request timing: a tree of spans (timed sections of code, eg. a
+themoviedb.org request or a database query) for each request, to see
+where the time of a slow page goes.
+
+Usage:
+
+    from loggers import spans
+
+    trace = spans.start_trace('GET /', query='the martian')
+    with spans.span('themoviedb', path='/search/multi') as span:
+        ...
+        span.set(cached=True)
+
+    @spans.timed('google_images')
+    def search(...):
+        ...
+
+    # Spans started in another thread (eg. of a thread pool) only
+    # belong to the trace when the function is propagated:
+    pool.map(spans.propagate(func), items)
+
+    # One span for all the time spent in a generator (eg. a streamed
+    # template), however its steps are spread out:
+    chunks = spans.iterate('render', template.stream(context))
+
+    spans.server_timing(trace)
+    # -> 'total;dur=812.4, postgres;dur=35.1;desc="14 calls", ...'
+    spans.end_trace(trace)  # Finishes and logs the trace.
+
+Outside a trace (eg. in the miner), spans are not recorded, and cost
+about a thread-local lookup. Finished traces are logged to the 'traces'
+logger as structured JSON (see `trace_logger`), with the tree of spans
+and, per span name, the total duration and number of spans, for
+charting in Kibana.
+"""
+
+import functools
+import threading
+import time
+from collections import OrderedDict
+from loggers import trace_logger
+
+
+_local = threading.local()
+
+
+class Span(object):
+
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.children = []
+        self.start = time.time()
+        self.duration = None
+        if parent is not None:
+            # (Appending is atomic, so children may be added from
+            # several threads.)
+            parent.children.append(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.time() - self.start
+        if getattr(_local, 'span', None) is self:
+            _local.span = self.parent
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.set(error=exc_type.__name__)
+        self.finish()
+
+    def to_dict(self):
+        span = OrderedDict([('name', self.name),
+                            ('duration_ms', _ms(self.duration))])
+        span.update(self.attrs)
+        if self.children:
+            span['children'] = [child.to_dict()
+                                for child in list(self.children)]
+        return span
+
+
+class _NoSpan(object):
+    """ Stands in for a span outside a trace.
+    """
+
+    def set(self, **attrs):
+        pass
+
+    def finish(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_no_span = _NoSpan()
+
+
+def _ms(seconds):
+    return round(1000 * seconds, 2) if seconds is not None else None
+
+
+def current_span():
+    return getattr(_local, 'span', None)
+
+
+def start(name, **attrs):
+    """ Starts a span as a child of the current span, and makes it the
+    current span (until it finishes). Does nothing outside a trace.
+    """
+    parent = current_span()
+    if parent is None:
+        return _no_span
+    span = Span(name, parent, **attrs)
+    _local.span = span
+    return span
+
+
+# `start`, as a context manager.
+span = start
+
+
+def timed(name):
+    """ Decorator that records a span for each call of a function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def propagate(func):
+    """ Returns a version of 'func' that records its spans in the
+    current span, from whatever thread it is called.
+    """
+    parent = current_span()
+    if parent is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = current_span()
+        _local.span = parent
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.span = previous
+    return wrapper
+
+
+def iterate(name, iterable, **attrs):
+    """ Yields the items of the given iterable, and records the time
+    spent getting them, summed over all steps, as a single span. Spans
+    started during the steps are its children.
+    """
+    parent = current_span()
+    if parent is None:
+        for item in iterable:
+            yield item
+        return
+    span = Span(name, parent, **attrs)
+    span.duration = 0.0
+    iterator = iter(iterable)
+    while True:
+        previous = current_span()
+        _local.span = span
+        start = time.time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            span.duration += time.time() - start
+            _local.span = previous
+        yield item
+
+
+def start_trace(name, **attrs):
+    """ Starts a new trace in this thread, with a root span of the given
+    name. Returns the root span.
+    """
+    _local.span = root = Span(name, **attrs)
+    return root
+
+
+def end_trace(root):
+    """ Finishes the trace with the given root span, and logs it.
+    """
+    root.finish()
+    if getattr(_local, 'span', None) is not None and \
+            _root_of(_local.span) is root:
+        _local.span = None
+    trace = root.to_dict()
+    trace['summary'] = summarize(root)
+    trace_logger.info(u'{} took {} ms.'.format(root.name,
+                                               trace['duration_ms']),
+                      extra={'trace': trace})
+    return trace
+
+
+def _root_of(span):
+    while span.parent is not None:
+        span = span.parent
+    return span
+
+
+def summarize(root):
+    """ Returns, per span name, the total duration (in milliseconds) and
+    the number of the spans in the tree of the given root span. Spans
+    in the tree of a span with the same name are counted once.
+    """
+    summary = OrderedDict()
+
+    def visit(span, counted):
+        if span.name not in counted and span.duration is not None:
+            entry = summary.setdefault(span.name, {'duration_ms': 0.0,
+                                                   'count': 0})
+            entry['duration_ms'] = round(entry['duration_ms'] +
+                                         1000 * span.duration, 2)
+            entry['count'] += 1
+        for child in list(span.children):
+            visit(child, counted | set([span.name]))
+
+    for child in list(root.children):
+        visit(child, frozenset())
+    return summary
+
+
+def server_timing(root):
+    """ Returns the value of a 'Server-Timing' header for the trace with
+    the given root span, with the time so far, and the total duration
+    and count of each finished span name.
+    """
+    metrics = ['total;dur={}'.format(_ms(time.time() - root.start))]
+    for name, entry in summarize(root).items():
+        metrics.append('{};dur={};desc="{} call{}"'.format(
+            name, entry['duration_ms'], entry['count'],
+            '' if entry['count'] == 1 else 's'))
+    return ', '.join(metrics)
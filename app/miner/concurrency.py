@@ -0,0 +1,66 @@
+"""
+Helpers to send independent (I/O bound) requests concurrently, from
+a bounded pool of threads.
+
+Usage:
+
+    from miner.concurrency import map_concurrently, imap_concurrently
+    responses = map_concurrently(get_api_response, paths,
+                                 max_workers=8)
+    # Or, to process each response as soon as it arrives:
+    for response in imap_concurrently(get_api_response, paths):
+        ...
+
+The results are returned in the order of the given items. Pools are
+created per call, so they are never inherited by forked processes.
+Calls are timed as part of the trace of the caller (see
+'loggers/spans.py').
+"""
+
+from multiprocessing.pool import ThreadPool
+from loggers import spans
+
+
+def map_concurrently(func, items, max_workers=8):
+    """ Returns [func(item) for item in items], with the calls made
+    concurrently by at most 'max_workers' threads. If a call raises an
+    exception, it is re-raised here.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    func = spans.propagate(func)
+    pool = ThreadPool(min(max_workers, len(items)))
+    try:
+        return pool.map(func, items, chunksize=1)
+    finally:
+        pool.close()
+
+
+def imap_concurrently(func, items, max_workers=8, ordered=True):
+    """ Iterator version of 'map_concurrently': yields the result of
+    each call as soon as it (and, if 'ordered', every call before it)
+    has finished. The calls start right away, not when the first
+    result is asked for, so they overlap with whatever the caller does
+    in the meantime.
+    """
+    items = list(items)
+    if not items:
+        return iter([])
+    func = spans.propagate(func)
+    pool = ThreadPool(min(max_workers, len(items)))
+    imap = pool.imap if ordered else pool.imap_unordered
+    results = imap(func, items)
+    # The workers exit when the calls are done, even if the results
+    # are never asked for.
+    pool.close()
+    return _iter_results(pool, results)
+
+
+def _iter_results(pool, results):
+    try:
+        for result in results:
+            yield result
+    finally:
+        # Also stops the remaining calls when the caller stops early.
+        pool.terminate()
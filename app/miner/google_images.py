@@ -1,42 +1,66 @@
 from loggers import logger
-from requests import get
+from loggers import spans
+from miner.sessions import get
 from bs4 import BeautifulSoup
 from urlparse import urlparse, parse_qs
+from HTMLParser import HTMLParser
 import json
+import os
+import re
 
 
+# Url of the search page. (Can be pointed to a stand-in server.)
+search_url = os.getenv('GOOGLE_SEARCH_URL',
+                       'https://www.google.com/search')
+
+
+@spans.timed('google_images')
 def get_search_results_metadata(production_name, person_name, character_name):
     """ Searches Google Images for the given terms and returns a list
     of dictionaries containing metadata about each search result,
     including urls to the original image and to a thumbnail version.
     """
+    return parse_search_results(get_search_results_page(
+               production_name, person_name, character_name))
+
+
+def get_search_results_page(production_name, person_name,
+                            character_name):
+    """ Searches Google Images for the given terms and returns the
+    search results page.
+    """
     # Clean up the search terms to compose the Google Images search url.
     production_name   =   production_name.strip().replace(' ', '+')
     person_name       =       person_name.strip().replace(' ', '+')
     character_name    =    character_name.strip().replace(' ', '+')
     query = u"{}+{}".format(production_name, person_name)
-    url = u'https://www.google.com/search?tbm=isch&q={}'.format(query)
+    url = u'{}?tbm=isch&q={}'.format(search_url, query)
     # Pose as a Firefox browser. (Otherwise we get an older version of
     # the Google Search app, intended for non-javascript browsers, with
     # less relevant search results.)
     headers = {'User-Agent': ('Mozilla/5.0 (Windows NT 6.1; WOW64; '
                               'rv:34.0) Gecko/20100101 Firefox/34.0'),
                'Accept-Language': 'en'}
-    # Download and parse the search results page.
+    # Download the search results page.
     logger.info(u'Requesting Google Images search for {}'.format(query))
     r = get(url, headers=headers)
-    soup = BeautifulSoup(r.content, 'html.parser')
-    # See the appendix below for the HTML structure of the interesting
-    # part of this page.
-    # We search for all the img-tags within the div with id 'res':
-    search_results_img_tags = soup.find('div', {'id': 'res'})\
-                                  .find_all('img')
+    return r.content
+
+
+def parse_search_results(html):
+    """ Returns the list of search results metadata (see above) found
+    in the given Google Images search results page.
+    """
+    # The scanner is much faster than building a full parse tree, but
+    # it relies on the exact markup of the 'rg_meta' divs. When it
+    # finds nothing, we fall back to the tree-based parser.
+    metadata_list = scan_rg_meta(html)
+    if not metadata_list:
+        logger.warning(u'Found no search results with the rg_meta '
+                       u'scanner. Falling back to the HTML parser.')
+        metadata_list = parse_rg_meta(html)
     search_results_metadata = []
-    for img in search_results_img_tags:
-        # We find interesting metadata in a json-dictionary located in
-        # the content of the div-tag immediately after the img's 
-        # parent (an a-tag). (This div has class 'rg_meta').
-        metadata = json.loads(img.parent.find_next_sibling('div').text)
+    for metadata in metadata_list:
         # Create a dictionary with interesting metadata and add it to
         # the results.
         search_results_metadata.append({
@@ -60,6 +84,75 @@ def get_search_results_metadata(production_name, person_name, character_name):
     return search_results_metadata
 
 
+# Matches a div with class 'rg_meta' (among possibly other classes and
+# attributes), and captures its content.
+rg_meta_pattern = re.compile(r'<div\b[^>]*\bclass="(?:[^"]*\s)?rg_meta'
+                             r'(?:\s[^"]*)?"[^>]*>(.*?)</div>',
+                             re.DOTALL)
+# The opening tag of the div with the search results, and the opening
+# and closing tags of divs.
+res_pattern = re.compile(r'<div\b[^>]*\bid="res"[^>]*>')
+div_tag_pattern = re.compile(r'<(/?)div\b')
+html_parser = HTMLParser()
+
+
+def results_slice(html):
+    """ Returns the part of the given page that is the div with id
+    'res' (see the appendix below), found by counting the opening and
+    closing div tags after its opening tag. Returns an empty string if
+    there is no such div.
+    """
+    start = res_pattern.search(html)
+    if start is None:
+        return html[:0]
+    depth = 1
+    for tag in div_tag_pattern.finditer(html, start.end()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return html[start.start():tag.end()]
+    return html[start.start():]
+
+
+def scan_rg_meta(html):
+    """ Returns the decoded json-dictionaries in the 'rg_meta' divs of
+    the search results of the given page (see the appendix below), by
+    scanning for these divs with a regular expression, without parsing
+    the rest of the page. Like `parse_rg_meta`, only looks in the div
+    with id 'res'. Returns an empty list if there are no such divs, or
+    if any of them can't be decoded.
+    """
+    metadata_list = []
+    for content in rg_meta_pattern.findall(results_slice(html)):
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        # The json is the text content of the div, so characters like
+        # '&' may be escaped as HTML entities.
+        if '&' in content:
+            content = html_parser.unescape(content)
+        try:
+            metadata_list.append(json.loads(content))
+        except ValueError:
+            return []
+    return metadata_list
+
+
+def parse_rg_meta(html):
+    """ Returns the decoded json-dictionaries in the 'rg_meta' divs of
+    the given page, using a full HTML parser.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    # See the appendix below for the HTML structure of the interesting
+    # part of this page.
+    # We search for all the img-tags within the div with id 'res':
+    search_results_img_tags = soup.find('div', {'id': 'res'})\
+                                  .find_all('img')
+    # We find interesting metadata in a json-dictionary located in
+    # the content of the div-tag immediately after the img's
+    # parent (an a-tag). (This div has class 'rg_meta').
+    return [json.loads(img.parent.find_next_sibling('div').text)
+            for img in search_results_img_tags]
+
+
 # Appendix: HTML Structure of the part of the Google Images search
 # results page in which we are interested (simplified):
 #    <div id="res">
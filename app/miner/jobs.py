@@ -0,0 +1,198 @@
+"""
+A priority job queue for mining work, backed by the 'job' table, and
+the worker processes that work through it.
+
+Usage (from the app directory):
+
+    python miner/jobs.py --workers 4    # Run 4 worker processes.
+
+    from miner import jobs
+    jobs.enqueue('refresh_person', 1892, {'tmdb_id': 1892},
+                 priority=8.4)
+    jobs.enqueue_many([(kind, key, payload, priority), ...])
+
+A job is the name ('kind') of a function that was registered with the
+`handler` decorator (see 'tasks'), and the keyword arguments
+('payload') to call it with. 'key' identifies the work: while a job
+with some kind and key is pending, enqueueing another one does nothing.
+Jobs with a higher priority (eg. the popularity of the production they
+are about) are done first.
+
+Workers claim jobs with `SELECT ... FOR UPDATE SKIP LOCKED`, so that
+any number of worker processes, on any number of hosts, can share the
+queue without handing out the same job twice. A worker keeps its job
+locked until it is done, and then deletes it. When a worker dies, its
+transaction is rolled back, and the job is up for grabs again. A job
+that raises is tried again after an exponential backoff, and marked as
+'failed' after 'max_attempts' attempts.
+"""
+
+import os
+import time
+import traceback
+from multiprocessing import Process
+from datetime import timedelta
+from sqlalchemy import select, and_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+from loggers import logger
+from data.db_conn import engine, db_session
+from data.data_model import Job
+from miner import popularity_table
+
+
+job_table = Job.__table__
+
+# Try failing jobs this many times in total.
+max_attempts = 5
+
+# Wait this long before the first retry of a failing job, and twice as
+# long before each next one.
+retry_delay = timedelta(seconds=30)
+
+# Seconds a worker sleeps when there are no jobs to do.
+poll_interval = 2
+
+# Functions that do the work, by kind.
+handlers = {}
+
+
+def handler(kind):
+    """ Decorator that registers the decorated function as the handler
+    for jobs of the given kind.
+    """
+    def register(func):
+        handlers[kind] = func
+        return func
+    return register
+
+
+# ---------------------- Enqueueing ------------------------------------
+
+def enqueue(kind, key, payload, priority=0):
+    """ Adds a job to the queue, unless a job with the same kind and key
+    is already pending.
+    """
+    enqueue_many([(kind, key, payload, priority)])
+
+
+def enqueue_many(jobs):
+    """ Adds the given jobs, a list of (kind, key, payload, priority)
+    tuples, to the queue, with a single INSERT statement.
+    """
+    values = dict(((kind, unicode(key)),
+                   {'kind': kind, 'key': unicode(key),
+                    'payload': payload, 'priority': priority or 0})
+                  for kind, key, payload, priority in jobs).values()
+    if not values:
+        return
+    # A pending duplicate is skipped, even if it is being worked on. We
+    # don't update its priority: that would wait for the worker's lock.
+    statement = insert(job_table).values(values)\
+                                 .on_conflict_do_nothing(
+                                     index_elements=['kind', 'key'],
+                                     index_where=(job_table.c.status ==
+                                                  'pending'))
+    with engine.begin() as connection:
+        connection.execute(statement)
+
+
+# ---------------------- Working ---------------------------------------
+
+def work_one():
+    """ Claims the pending job with the highest priority, and does it.
+    Returns False if there was no job to do.
+    """
+    with engine.begin() as connection:
+        job = connection.execute(
+                  select([job_table])
+                  .where(and_(job_table.c.status == 'pending',
+                              job_table.c.run_after <= func.now()))
+                  .order_by(job_table.c.priority.desc(),
+                            job_table.c.run_after)
+                  .limit(1)
+                  .with_for_update(skip_locked=True)).first()
+        if job is None:
+            return False
+        this_job = job_table.c.id == job.id
+        start = time.time()
+        try:
+            handlers[job.kind](**(job.payload or {}))
+        except Exception:
+            logger.exception(u"Job {} '{}' failed (attempt {})."
+                             .format(job.kind, job.key,
+                                     job.attempts + 1))
+            attempts = job.attempts + 1
+            delay = retry_delay * 2 ** job.attempts
+            connection.execute(
+                job_table.update()
+                         .where(this_job)
+                         .values(attempts=attempts,
+                                 status='failed'
+                                        if attempts >= max_attempts
+                                        else 'pending',
+                                 run_after=func.now() + delay,
+                                 last_error=traceback.format_exc(),
+                                 time_updated=func.now()))
+        else:
+            logger.info(u"Job {} '{}' done in {:.2f}s.".format(
+                job.kind, job.key, time.time() - start))
+            connection.execute(job_table.delete().where(this_job))
+        finally:
+            # Handlers use the (thread-local) ORM session.
+            db_session.remove()
+    return True
+
+
+def work(poll_interval=poll_interval):
+    """ Does jobs forever, sleeping 'poll_interval' seconds whenever the
+    queue is empty.
+    """
+    # Import the handlers.
+    from miner import tasks
+    # Ingested productions get their popularities from the table.
+    popularity_table.start_reloader()
+    while True:
+        try:
+            if not work_one():
+                time.sleep(poll_interval)
+        except Exception:
+            # Eg. the database is down.
+            logger.exception(u'Could not get a job from the queue.')
+            time.sleep(poll_interval)
+
+
+def run_workers(num_workers):
+    """ Runs 'num_workers' worker processes, and restarts those that
+    die.
+    """
+    def start():
+        # Connections must not be shared with the child processes.
+        engine.dispose()
+        process = Process(target=work)
+        process.daemon = True
+        process.start()
+        return process
+
+    processes = [start() for _ in xrange(num_workers)]
+    while True:
+        time.sleep(poll_interval)
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                logger.warning(u'Worker {} exited with code {}. '
+                               u'Restarting it.'.format(
+                                   process.pid, process.exitcode))
+                processes[i] = start()
+
+
+# Command line interface for this module.
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv('MINER_WORKERS', 4)),
+                        help='Number of worker processes.')
+    # Use the 'miner.jobs' module, where the handlers are registered,
+    # and not this '__main__' copy of it.
+    from miner import jobs
+    jobs.run_workers(parser.parse_args().workers)
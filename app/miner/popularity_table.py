@@ -0,0 +1,274 @@
+"""
+A table with the popularity scores of all movies and TV shows, stored
+in a single file that all worker processes memory-map read-only. The
+operating system keeps one copy of the file in memory, whatever the
+number of workers.
+
+Usage:
+
+    # Build (or rebuild) the table. This crawls every page of the
+    # 'popular' lists of themoviedb.org, so it takes a while.
+    python miner/popularity_table.py build
+
+    from miner.popularity_table import current_table
+    table = current_table()  # None if there is no table (yet).
+    table.lookup([286217, 1399], ['movie', 'tv'])
+    # -> array([ 8.41,  21.04], dtype=float32)
+
+Unknown productions get popularity 0.
+
+Within each process, a background thread (see `start_reloader`)
+swaps in a new snapshot of the table as soon as the file is replaced.
+The miner (see 'sync.py') also rebuilds the file when it is missing or
+gets too old (see `start_refresher`); web workers never crawl. The
+file is always replaced atomically, so readers never see a partially
+written table.
+
+
+File layout (all numbers little-endian):
+
+    8 bytes       magic string 'FGPOP001'
+    8 bytes       number of entries, n (unsigned integer)
+    8*n bytes     keys (signed integers), sorted
+    4*n bytes     popularities (floats)
+
+The key of a production is 2 * its themoviedb.org id, plus 1 for TV
+shows. (Movies and TV shows have separate ids, which may coincide).
+"""
+
+import fcntl
+import itertools
+import os
+import struct
+import tempfile
+import threading
+import time
+import numpy as np
+from loggers import logger
+
+
+path = os.getenv('POPULARITY_TABLE_FILE',
+                 os.path.join(tempfile.gettempdir(),
+                              'filmograph_popularities.bin'))
+
+# Rebuild the table when it is older than this many seconds.
+max_age = 24 * 3600
+
+magic = b'FGPOP001'
+header = struct.Struct('<8sQ')
+
+
+def make_keys(ids, media_types):
+    """ Returns the table keys for the productions with the given ids
+    and media types ('movie' or 'tv'), as an array.
+    """
+    is_tv = np.asarray(media_types, dtype=object) == 'tv'
+    return np.asarray(ids, dtype=np.int64) * 2 + is_tv
+
+
+class PopularityTable(object):
+
+    def __init__(self, path):
+        """ Memory-maps the table file at the given path.
+        """
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        file_magic, n = header.unpack(self.data[:header.size].tobytes())
+        if file_magic != magic:
+            raise ValueError('{} is not a popularity table.'.format(path))
+        keys_end = header.size + 8*n
+        self.keys = self.data[header.size:keys_end].view('<i8')
+        self.popularities = self.data[keys_end:keys_end+4*n].view('<f4')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, ids, media_types):
+        """ Returns an array with the popularities of the productions
+        with the given ids and media types ('movie' or 'tv').
+        """
+        keys = make_keys(ids, media_types)
+        if len(self.keys) == 0 or len(keys) == 0:
+            return np.zeros(len(keys), dtype=np.float32)
+        # Binary search for all keys at once.
+        indices = np.searchsorted(self.keys, keys)
+        indices = np.minimum(indices, len(self.keys) - 1)
+        found = self.keys[indices] == keys
+        return np.where(found, self.popularities[indices], 0)\
+                 .astype(np.float32)
+
+
+def write_table(path, productions):
+    """ Writes a table with the given productions, a list of (id,
+    media type, popularity) tuples, to the given path. The file at
+    'path' is replaced atomically.
+    """
+    if productions:
+        ids, media_types, pops = zip(*productions)
+    else:
+        ids, media_types, pops = (), (), ()
+    keys = make_keys(ids, media_types)
+    pops = np.asarray(pops, dtype='<f4')
+    order = np.argsort(keys, kind='mergesort')
+    keys, pops = keys[order].astype('<i8'), pops[order]
+    # Write to a temporary file in the same directory (and thus on the
+    # same file system), so that we can atomically rename it.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header.pack(magic, len(keys)))
+            f.write(keys.tobytes())
+            f.write(pops.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def build_table(path=path, movie_pages=None, tv_show_pages=None):
+    """ Crawls the 'popular' lists of movies and TV shows (by default:
+    all pages) and writes their popularities to a table at the given
+    path. A page that can't be fetched (after the retries of
+    `get_api_response`) is skipped: its productions are left out of
+    this version of the table, instead of the whole crawl failing.
+    """
+    from miner.themoviedb import get_api_response, BACKGROUND
+    from miner.concurrency import imap_concurrently
+    # Popularities change while we crawl, so a production may show up
+    # on several pages. We keep its last seen popularity.
+    productions = {}
+    skipped = 0
+    for media_type, resource, end_page in (
+            ('movie', '/movie/popular', movie_pages),
+            ('tv',    '/tv/popular',    tv_show_pages)):
+
+        def get_page(page):
+            try:
+                return get_api_response(resource, {'page': page},
+                                        BACKGROUND)
+            except Exception:
+                logger.exception(u'Could not get page {} of {}; '
+                                 u'skipping it.'.format(page, resource))
+                return None
+
+        # Without the first page, we don't know how many there are.
+        first_page = get_api_response(resource, {'page': 1}, BACKGROUND)
+        if end_page is None:
+            end_page = first_page.get('total_pages', 1)
+        pages = imap_concurrently(get_page, xrange(2, end_page + 1),
+                                  max_workers=4, ordered=False)
+        for response in itertools.chain([first_page], pages):
+            if response is None:
+                skipped += 1
+                continue
+            for entry in response['results']:
+                productions[entry['id'], media_type] = entry['popularity']
+    write_table(path, [(id, media_type, popularity)
+                       for (id, media_type), popularity
+                       in productions.items()])
+    logger.info(u'Built a popularity table with {} productions ({} '
+                u'pages skipped).'.format(len(productions), skipped))
+
+
+# ---------------------- Shared snapshot ------------------------------
+
+_table = None
+_table_stamp = None
+
+
+def _stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime, stat.st_size
+
+
+def reload_table(path=path):
+    """ Swaps in a new snapshot of the table if the file at 'path' was
+    replaced since the last (re)load.
+    """
+    global _table, _table_stamp
+    stamp = _stamp(path)
+    if stamp is None or stamp == _table_stamp:
+        return
+    table = PopularityTable(path)
+    # Assigning a global is atomic. Readers that still hold the old
+    # snapshot keep using it (and its mapping) until they are done.
+    _table, _table_stamp = table, stamp
+    logger.info(u'Loaded a popularity table with {} productions.'
+                .format(len(table)))
+
+
+def current_table():
+    """ Returns the current snapshot of the popularity table, or None
+    if no table has been built yet.
+    """
+    if _table is None:
+        reload_table()
+    return _table
+
+
+def refresh(path=path):
+    """ Rebuilds the table if it is missing or older than 'max_age',
+    unless another process is already doing so. Then reloads it.
+    """
+    stamp = _stamp(path)
+    if stamp is None or time.time() - stamp[1] > max_age:
+        with open(path + '.lock', 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                # Another process is rebuilding the table.
+                pass
+            else:
+                # Check again: the table may have been rebuilt while
+                # we waited for the lock.
+                stamp = _stamp(path)
+                if stamp is None or time.time() - stamp[1] > max_age:
+                    build_table(path)
+    reload_table(path)
+
+
+def start_refresher(interval=60):
+    """ Starts a daemon thread that calls `refresh` every 'interval'
+    seconds. For the miner, which builds the table.
+    """
+    return _start_thread(refresh, interval, 'popularity-refresher')
+
+
+def start_reloader(interval=60):
+    """ Starts a daemon thread that calls `reload_table` every
+    'interval' seconds. For processes that only read the table.
+    """
+    return _start_thread(reload_table, interval, 'popularity-reloader')
+
+
+def _start_thread(func, interval, name):
+    def run():
+        while True:
+            try:
+                func()
+            except Exception:
+                logger.exception(u'Could not update the popularity '
+                                 u'table.')
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+# Command line interface for this module.
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--movie-pages', type=int)
+    parser.add_argument('--tv-show-pages', type=int)
+    args = parser.parse_args()
+    build_table(path, args.movie_pages, args.tv_show_pages)
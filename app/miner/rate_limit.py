@@ -0,0 +1,203 @@
+"""
+A token bucket rate limiter whose state is shared by all processes on
+the same machine (eg. all gunicorn workers), through a small state
+file on local disk. No Redis or other server is needed.
+
+Usage:
+
+    from miner.rate_limit import TokenBucket, INTERACTIVE, BACKGROUND
+    bucket = TokenBucket('/tmp/some_api.json', rate=40, per=10)
+
+    # Blocks until a request may be sent. Raises RateLimitExceeded
+    # when the wait would exceed the maximum wait for this priority.
+    bucket.acquire(priority=BACKGROUND)
+    response = requests.get(...)
+    # Let the bucket adapt to what the server tells us.
+    bucket.update_from_response(response.headers,
+                                response.status_code)
+
+
+Priorities
+
+Interactive requests (eg. made while a user waits for a page) may use
+every token in the bucket. Background requests (eg. mining) may only
+use tokens above a reserve, so that there is always some capacity left
+for interactive requests. Waiting interactive requests are thus served
+before waiting background requests. Each priority also has a maximum
+wait: a request that would have to wait longer is shed by raising
+RateLimitExceeded, instead of pinning its worker.
+
+
+Monitoring
+
+`bucket.stats` counts, for the current process, the number of acquired
+and shed requests and the time spent waiting. Every wait is logged.
+
+
+Note that processes only share a bucket when they see the same state
+file. Containers that should share a bucket need a shared volume.
+"""
+
+import fcntl
+import json
+import time
+from loggers import logger
+
+
+INTERACTIVE = 0
+BACKGROUND  = 1
+
+
+class RateLimitExceeded(Exception):
+    """ Raised when a request is shed because it would have to wait
+    too long for a token.
+    """
+    pass
+
+
+class TokenBucket(object):
+
+    def __init__(self, path, rate=40, per=10.0, background_reserve=10,
+                 max_wait=None, name='api'):
+        """ Allows on average 'rate' requests every 'per' seconds,
+        with bursts of at most 'rate' requests. 'background_reserve'
+        tokens are kept for interactive requests. 'max_wait' maps
+        priorities to the maximum number of seconds a request of that
+        priority may wait for a token (None: wait indefinitely).
+        """
+        self.path = path
+        self.capacity = float(rate)
+        self.per = float(per)
+        self.background_reserve = background_reserve
+        if max_wait is None:
+            max_wait = {INTERACTIVE: 15.0, BACKGROUND: None}
+        self.max_wait = max_wait
+        self.name = name
+        self.stats = {'acquired': 0,
+                      'throttled': 0,
+                      'shed': 0,
+                      'total_wait': 0.0,
+                      'max_wait': 0.0}
+
+    # ------------------ Shared state ----------------------------------
+
+    def _locked(self, update):
+        """ Calls 'update' with the current shared state, while holding
+        an exclusive lock on the state file, and saves the state as
+        modified by 'update'. Returns the result of 'update'.
+        """
+        # We open the file anew on every call: 'flock' locks belong to
+        # open file descriptions, so this also serializes the threads
+        # of a single process.
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                state = self._parse(f.read())
+                result = update(state)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return result
+
+    def _parse(self, content):
+        now = time.time()
+        try:
+            state = json.loads(content)
+        except ValueError:
+            # New (or corrupted) state file: start with a full bucket.
+            state = {'tokens': self.capacity,
+                     'updated': now,
+                     'blocked_until': 0.0}
+        # Refill the bucket for the time passed since the last update.
+        refill = (now - state['updated']) * self.capacity / self.per
+        state['tokens'] = min(self.capacity, state['tokens'] + refill)
+        state['updated'] = now
+        return state
+
+    # ------------------ Public interface ------------------------------
+
+    def acquire(self, priority=INTERACTIVE):
+        """ Waits until a token is available for a request of the given
+        priority and takes it. Returns the number of seconds waited.
+        """
+        needed = 1.0
+        if priority != INTERACTIVE:
+            needed += self.background_reserve
+        max_wait = self.max_wait.get(priority)
+        waited = 0.0
+
+        def take(state):
+            now = state['updated']
+            if state['blocked_until'] > now:
+                return state['blocked_until'] - now
+            if state['tokens'] >= needed:
+                state['tokens'] -= 1
+                return 0.0
+            return (needed - state['tokens']) * self.per / self.capacity
+
+        while True:
+            wait = self._locked(take)
+            if wait <= 0:
+                break
+            if max_wait is not None and waited + wait > max_wait:
+                self.stats['shed'] += 1
+                logger.warning((u'Shed {} request: would have to wait '
+                                u'{:.2f}s for the rate limit.').format(
+                                    self.name, waited + wait))
+                raise RateLimitExceeded(self.name)
+            # Other processes may take tokens while we sleep, so we try
+            # again afterwards instead of assuming the token is ours.
+            time.sleep(wait)
+            waited += wait
+
+        self.stats['acquired'] += 1
+        if waited > 0:
+            self.stats['throttled'] += 1
+            self.stats['total_wait'] += waited
+            self.stats['max_wait'] = max(self.stats['max_wait'], waited)
+            logger.info(u'Waited {:.2f}s for the {} rate limit.'.format(
+                waited, self.name))
+        return waited
+
+    def update_from_response(self, headers, status_code=200):
+        """ Adapts the shared state to the rate limit headers of a
+        response: 'X-RateLimit-Remaining' and 'X-RateLimit-Reset' (a
+        UNIX timestamp), and 'Retry-After' (in seconds) on a '429 Too
+        Many Requests' response.
+        """
+        remaining = _header_float(headers, 'X-RateLimit-Remaining')
+        reset = _header_float(headers, 'X-RateLimit-Reset')
+        retry_after = _header_float(headers, 'Retry-After')
+        if remaining is None and status_code != 429:
+            return
+
+        def adapt(state):
+            now = state['updated']
+            if remaining is not None:
+                # The server knows best how many requests are left.
+                state['tokens'] = min(state['tokens'], remaining)
+                if remaining < 1 and reset is not None:
+                    state['blocked_until'] = max(state['blocked_until'],
+                                                 reset)
+            if status_code == 429:
+                state['tokens'] = 0.0
+                state['blocked_until'] = max(
+                    state['blocked_until'],
+                    now + (retry_after if retry_after is not None
+                           else self.per))
+
+        self._locked(adapt)
+        if status_code == 429:
+            logger.warning(u'{} responded with 429 Too Many Requests.'
+                           .format(self.name))
+
+
+def _header_float(headers, name):
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
@@ -0,0 +1,140 @@
+"""
+A persistent cache for API responses, stored in an SQLite database on
+local disk. All processes that open the same database file share the
+cache, and it survives restarts.
+
+Usage:
+
+    from miner.response_cache import ResponseCache, make_key
+    cache = ResponseCache('/tmp/responses.sqlite',
+                          ttls=[(r'^/search/', 3600)],
+                          default_ttl=600)
+    key = make_key('/search/multi', {'query': 'the martian'})
+    text = cache.get(key)
+    if text is None:
+        text = ...
+        cache.set(key, text, cache.ttl_for('/search/multi'))
+
+Entries expire after the time-to-live of the first pattern in 'ttls'
+that matches the resource path (or after 'default_ttl' seconds). When
+the cache holds more than 'max_entries' entries, the expired and then
+the oldest entries are evicted.
+
+`cache.stats` counts the hits and misses of the current process.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from urllib import urlencode
+
+
+def make_key(path, params=None):
+    """ Returns a cache key for the resource at the given path with the
+    given url params, independent of the order of the params. The API
+    key is left out.
+    """
+    params = sorted((k, v) for k, v in (params or {}).items()
+                    if k != 'api_key')
+    key = '/' + path.strip('/')
+    if params:
+        key += '?' + urlencode(params)
+    return key
+
+
+class ResponseCache(object):
+
+    # Check whether entries must be evicted every so many 'set' calls.
+    eviction_interval = 100
+
+    def __init__(self, path, ttls=(), default_ttl=600,
+                 max_entries=100000):
+        self.path = path
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0}
+        self._local = threading.local()
+        self._sets = 0
+
+    def _connection(self):
+        """ Returns this thread's connection to the database. (SQLite
+        connections may not be shared between threads or processes).
+        """
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10,
+                                         isolation_level=None)
+            # Write-ahead logging lets readers and a writer proceed
+            # concurrently.
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS response ('
+                               ' key TEXT PRIMARY KEY,'
+                               ' value TEXT NOT NULL,'
+                               ' stored REAL NOT NULL,'
+                               ' expires REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS '
+                               'response_stored ON response (stored)')
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def ttl_for(self, path):
+        """ Returns the time-to-live, in seconds, for responses for the
+        resource at the given path.
+        """
+        for pattern, ttl in self.ttls:
+            if pattern.search(path):
+                return ttl
+        return self.default_ttl
+
+    def get(self, key):
+        """ Returns the cached value for the given key, or None if
+        there is no such value or it has expired.
+        """
+        row = self._connection().execute(
+            'SELECT value FROM response WHERE key = ? AND expires > ?',
+            (key, time.time())).fetchone()
+        if row is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return row[0]
+
+    def set(self, key, value, ttl=None):
+        """ Stores the given (text) value under the given key, for 'ttl'
+        seconds (by default: 'default_ttl'). A 'ttl' of zero or less
+        means the value is not stored.
+        """
+        if ttl is None:
+            ttl = self.default_ttl
+        if ttl <= 0:
+            return
+        now = time.time()
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO response '
+                           'VALUES (?, ?, ?, ?)',
+                           (key, value, now, now + ttl))
+        self._sets += 1
+        if self._sets % self.eviction_interval == 0:
+            self.evict()
+
+    def evict(self):
+        """ Removes expired entries, and then the oldest entries until
+        at most 'max_entries' remain.
+        """
+        connection = self._connection()
+        connection.execute('DELETE FROM response WHERE expires <= ?',
+                           (time.time(),))
+        excess = connection.execute('SELECT COUNT(*) FROM response')\
+                           .fetchone()[0] - self.max_entries
+        if excess > 0:
+            connection.execute('DELETE FROM response WHERE key IN '
+                               '(SELECT key FROM response '
+                               ' ORDER BY stored LIMIT ?)', (excess,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM response')
@@ -0,0 +1,93 @@
+"""
+Provides pooled HTTP sessions for the miners, so that consecutive
+requests to the same host reuse kept-alive connections instead of
+doing a new TCP and TLS handshake each time.
+
+Usage:
+
+    from miner.sessions import get
+    r = get('https://api.themoviedb.org/3/configuration',
+            params={'api_key': key})
+
+`get` takes the same arguments as `requests.get`. Requests that don't
+specify a timeout get the default timeout below, so that a hung
+upstream can't pin a (synchronous) gunicorn worker forever. Failed
+connections and 5xx responses are retried with exponential backoff.
+Pass 'retry_statuses=()' to get 5xx responses back instead, eg. to
+retry them after waiting for a rate limiter (see 'themoviedb').
+
+There is one session per host (and set of retried statuses) and per
+process: connection pools must not be shared with processes forked
+after they were created (as gunicorn does with its workers).
+"""
+
+import os
+import threading
+from urlparse import urlparse
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+# (connect, read) timeouts, in seconds.
+timeout = (3.05, 10)
+
+# Maximum number of kept-alive connections per host. This should be at
+# least the number of threads that concurrently send requests to that
+# host.
+pool_sizes = {
+    'api.themoviedb.org': 16,
+    'www.google.com': 32,
+}
+default_pool_size = 4
+
+# Retry failed connections and these responses, waiting
+# 'backoff_factor' * (2 ** (retry number - 1)) seconds in between.
+# ('429 Too Many Requests' is handled by the rate limiter instead.)
+retries = 3
+backoff_factor = 0.5
+retry_statuses = (500, 502, 503, 504)
+
+
+_sessions = {}
+_sessions_pid = None
+_lock = threading.Lock()
+
+
+def get_session(host, retry_statuses=retry_statuses):
+    """ Returns the session for the given host, that retries the
+    given statuses, creating it if this process doesn't have one yet.
+    """
+    global _sessions, _sessions_pid
+    with _lock:
+        if _sessions_pid != os.getpid():
+            # We were forked: don't touch the parent's connections.
+            _sessions = {}
+            _sessions_pid = os.getpid()
+        key = (host, tuple(retry_statuses))
+        if key not in _sessions:
+            _sessions[key] = _make_session(
+                pool_sizes.get(host, default_pool_size), retry_statuses)
+        return _sessions[key]
+
+
+def _make_session(pool_size, retry_statuses):
+    retry = Retry(total=retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=retry_statuses,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1,
+                          pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get(url, retry_statuses=retry_statuses, **kwargs):
+    """ Sends a GET request over the pooled session for the url's host.
+    """
+    kwargs.setdefault('timeout', timeout)
+    return get_session(urlparse(url).netloc,
+                       retry_statuses).get(url, **kwargs)
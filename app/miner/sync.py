@@ -0,0 +1,226 @@
+"""
+Keeps the movies, TV shows and people that we store up to date, by
+polling the change feeds of themoviedb.org ('/movie/changes',
+'/tv/changes' and '/person/changes').
+
+Usage (from the app directory):
+
+    python miner/sync.py           # Poll the feeds forever.
+    python miner/sync.py --once    # Poll each feed once.
+
+Of the changed ids in a feed, only those that we store are refreshed,
+and of those, only the ones that were not fetched specifically in the
+last 'min_refresh_interval' (see `last_dedicated_fetch`). A refresh is
+a single request for the details and credits of a production (or the
+details and combined credits of a person), which are then ingested
+(see 'ingest').
+
+For each feed, a checkpoint in the database records up to when we have
+processed it. After a restart, we continue from the checkpoints. The
+checkpoint only moves forward when all refreshes of a poll succeeded;
+otherwise the next poll covers the same changes again (records that
+were refreshed after all are then skipped as recently fetched). Records
+that themoviedb.org no longer has count as refreshed.
+
+After each round of polls, the "known for" rankings of all people that
+are marked as dirty are recomputed (see 'known_for').
+
+The miner also builds the popularity table, and rebuilds it when it
+gets too old (see 'popularity_table'). Other processes only read it.
+"""
+
+import time
+from datetime import timedelta
+from sqlalchemy.sql import func
+from loggers import logger
+from data.db_conn import db_session
+from data.data_model import Production, Person, SyncCheckpoint
+from data import ingest
+from data import known_for
+from data.read_model import is_fresh
+from miner import themoviedb
+from miner import popularity_table
+from miner.rate_limit import BACKGROUND
+from miner.concurrency import map_concurrently
+
+
+feeds = ('movie', 'tv', 'person')
+
+# Seconds between polls of the feeds.
+poll_interval = 3600
+
+# Don't refresh records that were fetched this recently.
+min_refresh_interval = timedelta(hours=12)
+
+# How far back to start for a feed without checkpoint, and at most.
+# (themoviedb.org only serves the changes of the last 14 days).
+initial_window = timedelta(days=1)
+max_window = timedelta(days=14)
+
+# Number of ids per database query.
+chunk_size = 1000
+
+# The 'status_code' in themoviedb.org's error responses for resources
+# that don't exist (anymore).
+not_found = 34
+
+
+def get_changed_ids(feed, start, end):
+    """ Returns the set of ids in the given change feed ('movie', 'tv'
+    or 'person') between the given datetimes.
+    """
+    # The feeds are filtered by date. The days of 'start' and 'end'
+    # are included, so consecutive windows overlap a bit.
+    entries = themoviedb.get_all_entries(
+                '/{}/changes'.format(feed),
+                priority=BACKGROUND,
+                params={'start_date': start.strftime('%Y-%m-%d'),
+                        'end_date':   end.strftime('%Y-%m-%d')})
+    return set(entry['id'] for entry in entries)
+
+
+def get_stale_stored_ids(feed, ids):
+    """ Returns the ids, out of the given ids, of the records of the
+    given feed that we store and that were not fetched recently.
+    """
+    if feed == 'person':
+        cls = Person
+        query = db_session.query(Person.tmdb_id)
+    else:
+        cls = Production
+        query = db_session.query(Production.tmdb_id)\
+                          .filter(Production.type ==
+                                      ingest.production_types[feed])
+    fetched = cls.last_dedicated_fetch
+    ids = sorted(ids)
+    stale_ids = []
+    for i in xrange(0, len(ids), chunk_size):
+        stale_ids += [tmdb_id for (tmdb_id,) in
+                      query.filter(cls.tmdb_id.in_(ids[i:i+chunk_size]),
+                                   ~is_fresh(fetched,
+                                             min_refresh_interval))]
+    return stale_ids
+
+
+def refresh(feed, tmdb_id):
+    """ Fetches and ingests the details and credits of the record with
+    the given id in the given feed.
+    """
+    if feed == 'person':
+        details = themoviedb.get_api_response(
+                    '/person/{}'.format(tmdb_id),
+                    {'append_to_response': 'combined_credits'},
+                    BACKGROUND, use_cache=False)
+    else:
+        details = themoviedb.get_api_response(
+                    '/{}/{}'.format(feed, tmdb_id),
+                    {'append_to_response': 'credits'},
+                    BACKGROUND, use_cache=False)
+    if details.get('status_code') == not_found:
+        logger.info(u'{} {} no longer exists.'.format(feed, tmdb_id))
+    elif feed == 'person':
+        ingest.ingest_combined_credits(details,
+                                       details.pop('combined_credits'))
+    else:
+        ingest.ingest_credits(details, feed, details.pop('credits'))
+
+
+def get_window(feed, synced_until, now):
+    """ Returns the start of the window of changes to poll in the
+    given feed, that was processed up to 'synced_until', at 'now'.
+    """
+    if now - synced_until > max_window:
+        logger.warning(u'The {} feed was last synced at {}. Changes '
+                       u'before the last {} days are lost.'.format(
+                           feed, synced_until, max_window.days))
+        return now - max_window
+    return synced_until
+
+
+def next_checkpoint(feed, synced_until, now, refreshed):
+    """ Returns the new checkpoint of the given feed, after a poll at
+    'now' whose refreshes succeeded or not, as listed in 'refreshed'.
+    """
+    failed = refreshed.count(False)
+    if failed:
+        logger.warning(u'Could not refresh {} {} records. The {} feed '
+                       u'stays synced until {}, to retry them.'.format(
+                           failed, feed, feed, synced_until))
+        return synced_until
+    return now
+
+
+def sync_feed(feed):
+    """ Refreshes the stored records that changed in the given feed
+    since its checkpoint, and moves the checkpoint forward if all of
+    them were refreshed. Holds no database transaction during the
+    refreshes (which use their own, see 'ingest'): the checkpoint is
+    read at the start and written at the end, each in a short
+    transaction.
+    """
+    now = db_session.query(func.now()).scalar()
+    checkpoint = db_session.query(SyncCheckpoint).get(feed)
+    if checkpoint is not None:
+        synced_until = checkpoint.synced_until
+    else:
+        synced_until = now - initial_window
+    db_session.commit()
+    start = get_window(feed, synced_until, now)
+    changed_ids = get_changed_ids(feed, start, now)
+    stale_ids = get_stale_stored_ids(feed, changed_ids)
+    db_session.commit()
+    logger.info(u'{} {} records changed, of which we refresh {}.'
+                .format(len(changed_ids), feed, len(stale_ids)))
+
+    def refresh_safely(tmdb_id):
+        try:
+            refresh(feed, tmdb_id)
+            return True
+        except Exception:
+            # Eg. themoviedb.org is down.
+            logger.exception(u'Could not refresh {} {}'.format(
+                feed, tmdb_id))
+            return False
+
+    refreshed = map_concurrently(refresh_safely, stale_ids,
+                                 max_workers=4)
+    db_session.merge(SyncCheckpoint(
+        feed=feed,
+        synced_until=next_checkpoint(feed, synced_until, now,
+                                     refreshed)))
+    db_session.commit()
+    return sum(refreshed)
+
+
+def run(once=False):
+    """ Syncs every feed, every 'poll_interval' seconds. Also keeps
+    the popularity table, which all other processes read, up to date.
+    """
+    popularity_table.start_refresher()
+    while True:
+        for feed in feeds:
+            try:
+                sync_feed(feed)
+            except Exception:
+                logger.exception(u'Could not sync the {} feed.'
+                                 .format(feed))
+                db_session.rollback()
+            finally:
+                db_session.remove()
+        try:
+            logger.info(u'Refreshed the known for rankings of {} people.'
+                        .format(known_for.refresh()))
+        except Exception:
+            logger.exception(u'Could not refresh the known for rankings.')
+        if once:
+            break
+        time.sleep(poll_interval)
+
+
+# Command line interface for this module.
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--once', action='store_true',
+                        help='Poll each feed once, instead of forever.')
+    run(parser.parse_args().once)
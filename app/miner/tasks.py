@@ -0,0 +1,48 @@
+"""
+The kinds of jobs that the workers of the job queue do (see 'jobs').
+
+Usage:
+
+    from miner import jobs
+    jobs.enqueue('scrape_images', credit['credit_id'],
+                 {'production': production, 'person': person,
+                  'credit': credit},
+                 priority=production['popularity'])
+
+The payloads are the keyword arguments of the handlers below, so they
+must be JSON serializable.
+"""
+
+from miner.jobs import handler
+from miner import sync
+from miner import thumbnails
+from data import image_store
+
+
+@handler('refresh_production')
+def refresh_production(media_type, tmdb_id):
+    """ Fetches and ingests the details and credits of a movie or TV
+    show.
+    """
+    sync.refresh(media_type, tmdb_id)
+
+
+@handler('refresh_person')
+def refresh_person(tmdb_id):
+    """ Fetches and ingests the details and combined credits of a
+    person.
+    """
+    sync.refresh('person', tmdb_id)
+
+
+@handler('scrape_images')
+def scrape_images(production, person, credit):
+    """ Searches Google Images for the given person playing the
+    character of the given credit in the given production (themoviedb
+    .org dictionaries), and stores the results, and local copies of
+    their thumbnails. Doesn't search again if the image store already
+    has fresh results.
+    """
+    image_store.get_images_metadata(production, person, credit)
+    thumbnails.mirror_images(
+        image_store.get_image_ids(production, person, credit))
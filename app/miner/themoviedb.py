@@ -1,102 +1,223 @@
 import os
+import json
+import time
+import tempfile
 from loggers import logger
+from loggers import spans
 from urllib import urlencode
-from requests import get
+from miner import sessions
+from miner.sessions import get
 from collections import OrderedDict
+from miner.rate_limit import TokenBucket, INTERACTIVE, BACKGROUND
+from miner.concurrency import map_concurrently, imap_concurrently
+from miner.response_cache import ResponseCache, make_key
+from miner import popularity_table
 
 
-popularities = {}
+# The current rate limit is 40 requests every 10 seconds. All
+# processes on this machine share this bucket (see 'rate_limit').
+rate_limiter = TokenBucket(
+    os.getenv('THEMOVIEDB_RATE_LIMIT_FILE',
+              os.path.join(tempfile.gettempdir(),
+                           'filmograph_themoviedb_rate_limit.json')),
+    rate=40, per=10, name='themoviedb')
 
+# Base url of the API. (Can be pointed to a stand-in server.)
+api_url = os.getenv('THEMOVIEDB_API_URL', 'https://api.themoviedb.org/3')
 
-def get_api_response(path, params=None):
+# How many times to retry a request that got a '429 Too Many Requests'
+# response. Server errors (5xx) are retried as in 'sessions', but here,
+# so that each retry waits for the rate limiter too.
+max_rate_limit_retries = 3
+
+# Successful responses are cached on disk, shared by all processes on
+# this machine. Put the cache file on a volume to keep it across
+# container restarts. Set 'THEMOVIEDB_CACHE' to 'off' to bypass it.
+cache_enabled = os.getenv('THEMOVIEDB_CACHE', 'on') != 'off'
+response_cache = ResponseCache(
+    os.getenv('THEMOVIEDB_CACHE_FILE',
+              os.path.join(tempfile.gettempdir(),
+                           'filmograph_themoviedb_cache.sqlite')),
+    # Time-to-live (in seconds) per resource path pattern. The first
+    # matching pattern applies.
+    ttls=[(r'/changes$',            0),
+          (r'^/configuration$',     24*3600),
+          (r'^/search/',            3600),
+          (r'/popular$',            6*3600),
+          (r'/credits$',            24*3600),
+          (r'/combined_credits$',   24*3600)],
+    default_ttl=3600,
+    max_entries=200000)
+
+
+def get_api_response(path, params=None, priority=INTERACTIVE,
+                     use_cache=True):
     """ Queries v3 of themoviedb.org's API for the resource at the
     given path, with the optional url params, and returns the result
     as a dictionary. API reference: http://docs.themoviedb.apiary.io/
-    The current rate limit is 40 requests every 10 seconds.
+    Requests wait for the shared rate limiter. 'priority' is one of
+    INTERACTIVE (the default) and BACKGROUND, see 'rate_limit'.
+    Responses are served from the response cache when possible,
+    unless 'use_cache' is False. Raises an HTTPError for error
+    responses (eg. '429 Too Many Requests' or a 5xx after the
+    retries), except '404 Not Found', whose body is returned.
     """
     # We should not use '{}', a mutable object, as the default
     # argument value for 'params' here. See:
     # http://stackoverflow.com/a/1145781/2611913
     if params is None:
         params = {}
-    url = 'https://api.themoviedb.org/3'+path
-    logger.info(u'Requesting themoviedb resource {}{}'.format(
-        path, "?{}".format(urlencode(params)) if params else ""))
-    params.update({'api_key': os.getenv('THEMOVIEDB_API_KEY')})
-    # Convert the json to an ordered dictionary, preserving the
-    # insertion order of key-value pairs in the original json.
-    return get(url, params=params).json(object_pairs_hook=OrderedDict)
+    with spans.span('themoviedb', path=path) as span:
+        use_cache = use_cache and cache_enabled
+        key = make_key(path, params)
+        if use_cache:
+            text = response_cache.get(key)
+            if text is not None:
+                span.set(cached=True)
+                return decode(text)
+        url = api_url+path
+        logger.info(u'Requesting themoviedb resource {}{}'.format(
+            path, "?{}".format(urlencode(params)) if params else ""))
+        params.update({'api_key': os.getenv('THEMOVIEDB_API_KEY')})
+        rate_limited = server_errors = 0
+        while True:
+            rate_limiter.acquire(priority)
+            r = get(url, params=params, retry_statuses=())
+            rate_limiter.update_from_response(r.headers, r.status_code)
+            if r.status_code == 429 and \
+                    rate_limited < max_rate_limit_retries:
+                rate_limited += 1
+            elif r.status_code in sessions.retry_statuses and \
+                    server_errors < sessions.retries:
+                time.sleep(sessions.backoff_factor * 2**server_errors)
+                server_errors += 1
+            else:
+                break
+        span.set(status=r.status_code,
+                 attempts=1 + rate_limited + server_errors)
+        if not r.ok and r.status_code != 404:
+            # Out of retries, or an error that retrying won't fix: don't
+            # pass the error body off as a result. (The body of a 404 is
+            # returned: callers check it, eg. for deleted records.)
+            r.raise_for_status()
+        if use_cache and r.status_code == 200:
+            response_cache.set(key, r.text, response_cache.ttl_for(path))
+        return decode(r.text)
+
+
+def decode(text):
+    """ Converts the json of an API response to an ordered dictionary,
+    preserving the insertion order of key-value pairs in the json.
+    """
+    return json.loads(text, object_pairs_hook=OrderedDict)
 
 
 def get_all_entries(path, start_page=1, end_page=None,
-                    entries_key='results'):
+                    entries_key='results', priority=INTERACTIVE,
+                    max_workers=4, params=None):
     """ Most API resources contain a list of entries (under the key
     given by 'entries_key'). This method returns this list. If the API
     paginates the list, this method will, by default, query all pages
     and return the resulting concatenated list. Alternatively, you may
-    specify a particular starting and/or ending page.
+    specify a particular starting and/or ending page. The pages after
+    the first are requested concurrently by 'max_workers' threads.
+    'params' are extra url params for every page.
+    """
+    return list(iter_all_entries(path, start_page, end_page,
+                                 entries_key, priority, max_workers,
+                                 params=params))
+
+
+def iter_all_entries(path, start_page=1, end_page=None,
+                     entries_key='results', priority=INTERACTIVE,
+                     max_workers=4, ordered=True, params=None):
+    """ Generator version of 'get_all_entries': yields the entries of
+    each page as soon as that page arrives. If 'ordered' is False,
+    pages are yielded in the order in which they arrive instead of in
+    page order.
     """
     # (Specifying a 'page' parameter when requesting a resource that
     # is not paginated is harmless).
-    response = get_api_response(path, {'page': start_page})
-    results = response[entries_key]
+    response = get_api_response(path, dict(params or {},
+                                           page=start_page), priority)
+    for entry in response[entries_key]:
+        yield entry
     if end_page is None:
         end_page = response.get('total_pages', 1)
-    for page in xrange(start_page+1, end_page+1):
-        results += get_api_response(path, {'page': page})[entries_key]
-    return results
 
+    def get_page(page):
+        return get_api_response(path, dict(params or {}, page=page),
+                                priority)[entries_key]
 
-def cache_popularities(movie_pages=5, tv_show_pages=2):
-    """ Saves the popularity scores of the most popular movies and TV
-    shows in a dictionary in memory.
-    """
-    movies = get_all_entries('/movie/popular', end_page=movie_pages)
-    tv_shows = get_all_entries('/tv/popular', end_page=tv_show_pages)
-    for production in movies + tv_shows:
-        popularities[production['id']] = production['popularity']
-    logger.info(('Cached the {} most popular movies and {} most '
-                 'popular TV shows.').format(len(movies),
-                                             len(tv_shows)))
+    for entries in imap_concurrently(get_page,
+                                     xrange(start_page+1, end_page+1),
+                                     max_workers, ordered):
+        for entry in entries:
+            yield entry
 
 
-def get_cast_filmographies(query):
+def get_cast_filmographies(query, num_cast_members=7, concurrent=True):
     """ Searches for the most popular movie or TV show with 'query' in
     its name, and returns its metadata and a list with, for each of
     the top billed actors of this movie or TV show, the role that they
     played in it, and all other roles they played in other movies and
     TV shows, sorted by popularity of these movies and shows.
+    The filmographies of the actors are requested concurrently, unless
+    'concurrent' is False. An actor whose filmography could not be
+    retrieved gets an empty filmography.
     """
     first_result = get_api_response('/search/multi',
                                     {'query': query})['results'][0]
     cast = get_api_response('/{media_type}/{id}/credits'
                             .format(**first_result))['cast']
-    cast_filmographies = []
-    if popularities == {}:
-        cache_popularities(20, 10)
-    for role in cast[:7]:
-        filmography = get_api_response('/person/{id}/combined_credits'
-                                       .format(**role))['cast']
-        # Annotate each production with its popularity.
-        for production in filmography:
-            production['popularity'] = \
-                popularities.get(production["id"], 0)
-        # Sort on popularity, from high to low.
-        filmography = sorted(filmography,
-                             key=lambda production:
-                                production["popularity"],
-                             reverse=True)
-        # Don't include the queried movie in the filmography.
-        filmography = filter(lambda production: production["id"] != \
-                                                first_result["id"],
-                             filmography)
-        # Add the new cast entry.
-        cast_filmographies.append({'role': role,
-                                   'filmography': filmography})
+    cast = cast[:num_cast_members]
+
+    def get_filmography(role):
+        try:
+            filmography = get_api_response(
+                '/person/{id}/combined_credits'.format(**role))['cast']
+        except Exception:
+            logger.exception(u'Could not get the filmography of {}'
+                             .format(role['name']))
+            filmography = []
+        return rank_filmography(filmography,
+                                exclude_id=first_result['id'])
 
+    if concurrent:
+        filmographies = map_concurrently(get_filmography, cast)
+    else:
+        filmographies = map(get_filmography, cast)
+    cast_filmographies = [{'role': role, 'filmography': filmography}
+                          for role, filmography in zip(cast,
+                                                       filmographies)]
     return first_result, cast_filmographies
 
 
+def rank_filmography(filmography, exclude_id=None):
+    """ Annotates each production in the given filmography with its
+    popularity (see 'popularity_table'; 0 when there is no table yet),
+    and returns the productions sorted on popularity, from high to low.
+    The production with id 'exclude_id' is left out.
+    """
+    # Annotate each production with its popularity.
+    table = popularity_table.current_table()
+    if table is not None:
+        scores = table.lookup(
+            [production['id'] for production in filmography],
+            [production['media_type'] for production in filmography])
+    else:
+        scores = [0] * len(filmography)
+    for production, score in zip(filmography, scores):
+        production['popularity'] = float(score)
+    # Sort on popularity, from high to low.
+    filmography = sorted(filmography,
+                         key=lambda production:
+                            production["popularity"],
+                         reverse=True)
+    return filter(lambda production: production["id"] != exclude_id,
+                  filmography)
+
+
 def get_cast_filmographies_as_string(query):
     """ Returns a string representation of the result of
     get_cast_filmographies(query), where for each actor only the top 5
@@ -0,0 +1,166 @@
+"""
+Mirrors the thumbnails of stored Images to local disk, from where
+nginx serves them (see 'proxy/nginx.conf'), so that pages don't depend
+on third-party image hosts.
+
+Usage (from the app directory):
+
+    # Mirror the thumbnails of all linked Images that have no local
+    # copy yet.
+    python miner/thumbnails.py
+
+    from miner import thumbnails
+    thumbnails.mirror_images([image_id, ...])
+
+The files are content-addressed: a thumbnail is stored at
+'thumbs/<h[:2]>/<h>.<ext>' (under 'root'), where 'h' is the SHA-1 hash
+of its contents. Identical thumbnails are stored once, and a file never
+changes once written, so nginx can let browsers cache it forever. The
+path relative to 'root' is recorded in `Image.thumb_path`, and is also
+the url path of the copy.
+"""
+
+import hashlib
+import os
+import tempfile
+from sqlalchemy import select, bindparam
+from loggers import logger
+from data.db_conn import engine
+from data.data_model import Image, ImageLink
+from miner.sessions import get
+from miner.concurrency import map_concurrently
+
+
+# The web root of nginx, and the directory in it for thumbnails. The
+# directory must be shared with the proxy (see 'docker-compose.yml').
+root = os.getenv('WEB_ROOT', '/www/data')
+thumbs_dir = 'thumbs'
+
+# File extensions for the content types of thumbnails.
+extensions = {
+    'image/jpeg': 'jpg',
+    'image/png':  'png',
+    'image/gif':  'gif',
+    'image/webp': 'webp',
+}
+
+# Don't store anything larger than this (thumbnails are a few kB).
+max_size = 1024 * 1024
+
+# Number of images per batch in `mirror_pending`.
+batch_size = 200
+
+image_table = Image.__table__
+
+
+def store(content, content_type):
+    """ Stores the given file contents under its content address, unless
+    it is already stored. Returns its path relative to 'root'.
+    """
+    digest = hashlib.sha1(content).hexdigest()
+    extension = extensions.get(content_type.split(';')[0].strip(),
+                               'img')
+    path = '/'.join([thumbs_dir, digest[:2],
+                     '{}.{}'.format(digest, extension)])
+    full_path = os.path.join(root, path)
+    if not os.path.exists(full_path):
+        directory = os.path.dirname(full_path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another process in the meantime.
+                pass
+        # Write to a temporary file and rename it, so that nginx never
+        # serves a partially written file.
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, full_path)
+        except:
+            os.remove(tmp_path)
+            raise
+    return path
+
+
+def download(url):
+    """ Downloads the thumbnail at the given url and stores it. Returns
+    its path relative to 'root', or None if it can't be downloaded.
+    """
+    try:
+        r = get(url)
+        r.raise_for_status()
+        content_type = r.headers.get('Content-Type', '')
+        if not content_type.startswith('image/'):
+            raise ValueError(u'Not an image: {}'.format(content_type))
+        if len(r.content) > max_size:
+            raise ValueError(u'Too large: {} bytes'.format(len(r.content)))
+        return store(r.content, content_type)
+    except Exception as e:
+        logger.warning(u'Could not mirror thumbnail {}: {}'
+                       .format(url, e))
+        return None
+
+
+def mirror_images(image_ids, max_workers=8):
+    """ Mirrors the thumbnails of the Images with the given ids that
+    have no local copy yet, concurrently, and records their paths.
+    Returns the number of thumbnails mirrored.
+    """
+    if not image_ids:
+        return 0
+    with engine.connect() as connection:
+        images = connection.execute(
+                     select([image_table.c.id, image_table.c.thumb_url])
+                     .where(image_table.c.id.in_(image_ids))
+                     .where(image_table.c.thumb_path.is_(None))
+                     .where(image_table.c.thumb_url.isnot(None)))\
+                     .fetchall()
+    paths = map_concurrently(lambda image: download(image.thumb_url),
+                             images, max_workers)
+    mirrored = [{'image_id': image.id, 'path': path}
+                for image, path in zip(images, paths)
+                if path is not None]
+    if mirrored:
+        with engine.begin() as connection:
+            connection.execute(
+                image_table.update()
+                           .where(image_table.c.id ==
+                                  bindparam('image_id'))
+                           .values(thumb_path=bindparam('path')),
+                mirrored)
+    return len(mirrored)
+
+
+def mirror_pending():
+    """ Mirrors the thumbnails of all linked Images without a local
+    copy, newest first. Images whose thumbnail can't be downloaded are
+    tried again on the next run.
+    """
+    linked = select([ImageLink.__table__.c.image_id])
+    last_id = None
+    total = 0
+    while True:
+        query = select([image_table.c.id])\
+                .where(image_table.c.thumb_path.is_(None))\
+                .where(image_table.c.thumb_url.isnot(None))\
+                .where(image_table.c.id.in_(linked))\
+                .order_by(image_table.c.id.desc())\
+                .limit(batch_size)
+        if last_id is not None:
+            query = query.where(image_table.c.id < last_id)
+        with engine.connect() as connection:
+            ids = [image_id for (image_id,) in connection.execute(query)]
+        if not ids:
+            break
+        total += mirror_images(ids)
+        last_id = ids[-1]
+    logger.info(u'Mirrored {} thumbnails.'.format(total))
+    return total
+
+
+# Command line interface for this module.
+if __name__ == '__main__':
+    mirror_pending()
@@ -0,0 +1,30 @@
+import threading
+import time
+from miner.concurrency import map_concurrently, imap_concurrently
+
+def slow_square(x):
+    # Later items finish first.
+    time.sleep(0.01 * (5 - x))
+    return x * x
+
+def test_map_concurrently():
+    assert map_concurrently(slow_square, range(5)) == [0, 1, 4, 9, 16]
+    assert map_concurrently(slow_square, []) == []
+
+def test_imap_concurrently():
+    assert list(imap_concurrently(slow_square, range(5))) == \
+        [0, 1, 4, 9, 16]
+    unordered = list(imap_concurrently(slow_square, range(5),
+                                       ordered=False))
+    assert sorted(unordered) == [0, 1, 4, 9, 16]
+
+def test_imap_concurrently_starts_right_away():
+    started = threading.Event()
+    def call(x):
+        started.set()
+        return x
+    results = imap_concurrently(call, [1, 2])
+    # The calls run before the first result is asked for.
+    assert started.wait(1)
+    assert list(results) == [1, 2]
+    assert list(imap_concurrently(call, [])) == []
@@ -0,0 +1,71 @@
+"""
+Tests the DDL that `init_db` issues for a new database, without
+executing it.
+"""
+
+from sqlalchemy import create_engine
+from data.db_conn import Base
+from data import data_model, ddl
+
+
+def create_all_statements():
+    statements = []
+
+    def dump(statement, *multiparams, **params):
+        statements.append(u' '.join(
+            unicode(statement.compile(dialect=engine.dialect)).split()))
+
+    engine = create_engine('postgresql://', strategy='mock',
+                           executor=dump)
+    Base.metadata.create_all(engine, checkfirst=False)
+    return statements
+
+
+def index_of(statements, start):
+    return [i for i, statement in enumerate(statements)
+            if statement.startswith(start)][0]
+
+
+def test_trigram_extension_first():
+    statements = create_all_statements()
+    extension = index_of(statements,
+                         u'CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    assert extension < index_of(statements, u'CREATE TABLE')
+    assert extension < index_of(statements,
+                                u'CREATE INDEX production_name_trgm')
+
+
+def test_known_for_triggers_after_tables():
+    statements = create_all_statements()
+    for trigger in (u'CREATE TRIGGER role_known_for_insert_delete',
+                    u'CREATE TRIGGER production_known_for_update'):
+        assert index_of(statements, trigger) > \
+               index_of(statements, u'CREATE TABLE known_for ')
+    assert index_of(statements, u'CREATE FUNCTION '
+                                u'mark_known_for_dirty_role()') < \
+           index_of(statements, u'CREATE TRIGGER role_known_for_update')
+    assert index_of(statements, u'CREATE TABLE role ') < \
+           index_of(statements, u'CREATE TABLE known_for ')
+
+
+def test_image_link_score_triggers_after_table():
+    statements = create_all_statements()
+    table = index_of(statements, u'CREATE TABLE image_link ')
+    function = index_of(statements, u'CREATE FUNCTION image_link_score(')
+    trigger = index_of(statements, u'CREATE TRIGGER image_link_score_insert')
+    assert table < function < trigger
+    assert index_of(statements, u'CREATE INDEX image_link_top') > table
+
+
+def test_known_for_ddl_from_one_source():
+    # The 'known_for' migration executes the same statements.
+    statements = create_all_statements()
+    for statement in ddl.known_for:
+        assert u' '.join(statement.split()) in statements
+
+
+def test_image_link_score_ddl_from_one_source():
+    # The 'image_link_score' migration executes the same statements.
+    statements = create_all_statements()
+    for statement in ddl.image_link_score:
+        assert u' '.join(statement.split()) in statements
@@ -0,0 +1,83 @@
+"""
+Tests the image link score of 'ddl' against a Python reference of the
+Wilson score interval, by evaluating the expressions of the SQL function
+in Python.
+"""
+
+from __future__ import division
+import math
+import pytest
+from data import ddl
+
+
+# SQL's functions, for the score expressions.
+sql_functions = {
+    'COALESCE':    lambda *values: next(value for value in values
+                                        if value is not None),
+    'GREATEST':    max,
+    'ln':          math.log,
+    'sqrt':        math.sqrt,
+}
+
+
+def sql_score(upvotes, downvotes, google_position):
+    # All variables of the function are 'double precision'.
+    variables = dict(sql_functions, upvotes=upvotes, downvotes=downvotes,
+                     google_position=google_position)
+    for name, value in ddl.image_link_score_constants:
+        variables[name] = float(value)
+    for name, expression in ddl.image_link_score_terms:
+        variables[name] = float(eval(expression, variables))
+    return eval(ddl.image_link_score_expression, variables)
+
+
+def wilson_lower_bound(positive, total, z=1.96):
+    phat = positive / total
+    return (phat + z**2 / (2 * total)
+            - z * math.sqrt(phat * (1 - phat) / total
+                            + z**2 / (4 * total**2))) \
+           / (1 + z**2 / total)
+
+
+def reference_score(upvotes, downvotes, google_position):
+    prior_votes = 5
+    position = google_position if google_position is not None else 100
+    prior = 1 / (1 + math.log(max(position, 1)))
+    return wilson_lower_bound((upvotes or 0) + prior_votes * prior,
+                              (upvotes or 0) + (downvotes or 0)
+                              + prior_votes)
+
+
+@pytest.mark.parametrize('upvotes, downvotes, google_position', [
+    (0, 0, 1),
+    (0, 0, 10),
+    (None, None, None),
+    (10, 0, 50),
+    (3, 7, 2),
+    (100, 40, 1),
+])
+def test_image_link_score(upvotes, downvotes, google_position):
+    assert sql_score(upvotes, downvotes, google_position) == \
+           pytest.approx(reference_score(upvotes, downvotes,
+                                         google_position))
+
+
+def test_image_link_score_order():
+    # Without votes, by Google position.
+    assert sql_score(0, 0, 1) > sql_score(0, 0, 2) > \
+           sql_score(0, 0, None)
+    # Votes take over.
+    assert sql_score(20, 0, 30) > sql_score(0, 0, 1)
+    assert sql_score(0, 20, 1) < sql_score(0, 5, 1) < sql_score(0, 0, 1)
+    assert 0 <= sql_score(0, 1000, 100) < sql_score(1000, 0, 1) <= 1
+
+
+def test_image_link_score_function():
+    function = ddl.image_link_score_function
+    assert function.strip().startswith(
+               'CREATE FUNCTION image_link_score(')
+    assert 'RETURN {};'.format(ddl.image_link_score_expression) \
+           in function
+    for name, expression in ddl.image_link_score_terms:
+        assert '{} double precision := {};'.format(name, expression) \
+               in function
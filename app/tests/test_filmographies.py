@@ -0,0 +1,81 @@
+import threading
+from data import filmographies
+from data.read_model import Credit
+from miner import popularity_table
+
+def credit(person_id, rank, tmdb_id, popularity):
+    return Credit(person_id, rank, u'Character', u'credit{}'.format(tmdb_id),
+                  tmdb_id, 'movie', u'Movie {}'.format(tmdb_id), None,
+                  None, None, popularity)
+
+def test_get_filmographies_popularity_fallback(monkeypatch, tmpdir):
+    # Reads don't refresh the rankings.
+    monkeypatch.setattr(filmographies.known_for, 'refresh', None)
+    monkeypatch.setattr(filmographies.read_model, 'get_known_for',
+                        lambda person_ids: [credit(1, 1, 10, 5.0),
+                                            credit(1, 2, 11, None),
+                                            credit(2, 1, 12, 1.0)])
+    path = str(tmpdir.join('popularities.bin'))
+    popularity_table.write_table(path, [(11, 'movie', 7.0)])
+    table = popularity_table.PopularityTable(path)
+    monkeypatch.setattr(popularity_table, 'current_table', lambda: table)
+    result = filmographies.get_filmographies([1, 2])
+    assert [(c['id'], c['popularity']) for c in result[1]] == \
+        [(11, 7.0), (10, 5.0)]
+    assert [c['id'] for c in result[2]] == [12]
+    # Without a table, they stay unranked.
+    monkeypatch.setattr(popularity_table, 'current_table', lambda: None)
+    result = filmographies.get_filmographies([1, 2])
+    assert [(c['id'], c['popularity']) for c in result[1]] == \
+        [(10, 5.0), (11, 0.0)]
+    # The credits without popularity are ranked in, then cut off.
+    monkeypatch.setattr(filmographies.known_for, 'top_n', 1)
+    result = filmographies.get_filmographies([1, 2])
+    assert [c['id'] for c in result[1]] == [10]
+
+
+def test_refreshes_overlap_with_the_caller(monkeypatch):
+    production = {'id': 1, 'media_type': 'movie'}
+    cast = [({'id': 10, 'name': u'A', 'person_id': 100}, 'fresh'),
+            ({'id': 20, 'name': u'B', 'person_id': 200}, 'missing')]
+    monkeypatch.setattr(filmographies.search, 'resolve',
+                        lambda query: production)
+    monkeypatch.setattr(filmographies, 'get_fresh_production_id',
+                        lambda *args: 1)
+    monkeypatch.setattr(filmographies, 'get_cast', lambda *args: cast)
+    monkeypatch.setattr(filmographies, 'get_filmographies',
+                        lambda person_ids: {})
+    refreshing = threading.Event()
+    monkeypatch.setattr(filmographies, 'refresh_person',
+                        lambda role: refreshing.set())
+    _, cast_filmographies = \
+        filmographies.iter_cast_filmographies(u'query')
+    # B is refreshed before the first cast member is asked for.
+    assert refreshing.wait(1)
+    assert [entry['role']['name'] for entry in cast_filmographies] == \
+        [u'A', u'B']
+
+def test_failed_filmographies_are_incomplete(monkeypatch):
+    production = {'id': 1, 'media_type': 'movie'}
+    cast = [({'id': 10, 'name': u'A', 'person_id': 100}, 'fresh'),
+            ({'id': 20, 'name': u'B', 'person_id': 200}, 'fresh'),
+            ({'id': 30, 'name': u'C', 'person_id': 300}, 'stale')]
+    movie = {'id': 2, 'media_type': 'movie'}
+    monkeypatch.setattr(filmographies.search, 'resolve',
+                        lambda query: production)
+    monkeypatch.setattr(filmographies, 'get_fresh_production_id',
+                        lambda *args: 1)
+    monkeypatch.setattr(filmographies, 'get_cast', lambda *args: cast)
+    monkeypatch.setattr(filmographies, 'get_filmographies',
+                        lambda person_ids: {100: [movie], 300: [movie],
+                                            # Only in the searched
+                                            # production.
+                                            200: [production]})
+    monkeypatch.setattr(filmographies, 'refresh_person',
+                        lambda role: False)
+    _, cast_filmographies = \
+        filmographies.get_cast_filmographies(u'query')
+    # Only the failed refresh makes an entry incomplete.
+    assert [entry['complete'] for entry in cast_filmographies] == \
+        [True, True, False]
+    assert cast_filmographies[1]['filmography'] == []
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import json
+from miner.google_images import (parse_search_results, scan_rg_meta,
+    parse_rg_meta)
+
+metadata = [{'tu': 'https://encrypted-tbn3.gstatic.com/images?q=tbn:1',
+             'tw': 183, 'th': 275,
+             'ou': 'https://example.com/a.jpg?x=1&y=2',
+             'ow': 800, 'oh': 1200, 'ity': 'jpg',
+             'ru': 'https://example.com/a.html',
+             'isu': 'example.com',
+             'pt': u'Matt Damon in “The Martian” <3',
+             's': ''},
+            {'tu': 'https://encrypted-tbn3.gstatic.com/images?q=tbn:2',
+             'tw': 100, 'th': 100,
+             'ou': 'https://example.org/b.png',
+             'ow': 500, 'oh': 500, 'ity': 'png',
+             'ru': 'https://example.org/b.html',
+             'isu': 'example.org',
+             'pt': 'Mark Watney',
+             's': 'Description'}]
+
+def escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;')\
+               .replace('>', '&gt;')
+
+def results(metadata, div='<div class="rg_meta notranslate">'):
+    return ''.join(
+        u'<div><a href="#"><img src="x"></a>{}{}</div></div>'.format(
+            div, escape(json.dumps(m)))
+        for m in metadata)
+
+def make_page(metadata, div='<div class="rg_meta notranslate">',
+              before=u'', after=u''):
+    return (u'<html><body>{}<div id="res"><div><div>{}</div></div></div>'
+            u'{}</body></html>').format(before, results(metadata, div),
+                                       after).encode('utf-8')
+
+def test_scan_rg_meta():
+    page = make_page(metadata)
+    assert scan_rg_meta(page) == metadata
+    assert scan_rg_meta(page) == parse_rg_meta(page)
+
+def test_scan_rg_meta_only_in_results():
+    # Eg. the 'related searches' carousel.
+    page = make_page(metadata[:1], before=results(metadata[1:]),
+                     after=results(metadata[1:]))
+    assert scan_rg_meta(page) == parse_rg_meta(page) == metadata[:1]
+    assert scan_rg_meta(make_page([])) == []
+
+def test_parse_search_results():
+    results = parse_search_results(make_page(metadata))
+    assert [r['image_url'] for r in results] == \
+        ['https://example.com/a.jpg?x=1&y=2', 'https://example.org/b.png']
+    assert results[0]['title'] == metadata[0]['pt']
+
+def test_fallback():
+    # Markup the scanner doesn't recognize.
+    page = make_page(metadata, div="<div class='rg_meta'>")
+    assert scan_rg_meta(page) == []
+    assert len(parse_search_results(page)) == 2
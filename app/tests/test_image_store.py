@@ -0,0 +1,30 @@
+from data import image_store
+from data.read_model import ImageRecord
+
+def test_get_many_images(monkeypatch):
+    # Roles 1 (stale images), 2 (searched, but no images), 3 (never
+    # searched), and a credit without a stored Role.
+    role_ids = {'a': 1, 'b': 2, 'c': 3}
+    monkeypatch.setattr(image_store.read_model, 'get_role_ids',
+                        lambda credit_ids: role_ids)
+    stale = ImageRecord(*([1, 7, 1, False, 10] + [None] * 12))
+    monkeypatch.setattr(image_store.read_model, 'load_top_images',
+                        lambda ids, limit, max_age: {1: [stale]})
+    searched = []
+    def get_searched_role_ids(ids, max_age):
+        searched.extend(ids)
+        return set([2])
+    monkeypatch.setattr(image_store.read_model, 'get_searched_role_ids',
+                        get_searched_role_ids)
+    # Unknown Roles are not ingested on reads.
+    monkeypatch.setattr(image_store, 'get_role_id', None)
+    lookups = [({}, {}, {'credit_id': credit_id})
+               for credit_id in ['a', 'b', 'c', 'd']]
+    images = image_store.get_many_images(lookups, 4)
+    assert [fresh for _, fresh in images] == [False, True, False, False]
+    assert images[0][0][0]['link_id'] == 7
+    assert [metadata for metadata, _ in images[1:]] == [[], None, None]
+    # Only the Roles without images are checked for empty searches.
+    assert searched == [2, 3]
+    assert image_store.get_many_images_metadata(lookups) == \
+           [None, [], None, None]
@@ -0,0 +1,71 @@
+"""
+Tests the upserts of 'ingest' against a fake connection, that records
+the statements it is given (compiled for PostgreSQL), and returns
+preset results.
+"""
+
+from sqlalchemy.dialects import postgresql
+from data import ingest
+
+
+class FakeConnection(object):
+    def __init__(self, *results):
+        self.results = list(results)
+        self.statements = []
+
+    def execute(self, statement):
+        compiled = statement.compile(dialect=postgresql.dialect())
+        self.statements.append((str(compiled), compiled.params))
+        return self.results.pop(0) if self.results else []
+
+
+def upsert_people(connection):
+    rows = [{'tmdb_id': 2, 'name': u'B', 'also_known_as': None},
+            {'tmdb_id': 1, 'name': u'A', 'also_known_as': [u'X']},
+            {'tmdb_id': 3}]
+    return ingest.upsert(ingest.person_table, rows, ('tmdb_id',),
+                         'person', connection=connection)
+
+
+def test_upsert():
+    # Person 1 exists, 2 and 3 are new.
+    connection = FakeConnection([(7, 1)], [(8,), (9,)],
+                                [(7, 1), (8, 2), (9, 3)])
+    assert upsert_people(connection) == {(1,): 7, (2,): 8, (3,): 9}
+    (select, _), (allocate, _), (insert, params) = connection.statements
+    assert select.startswith('SELECT person.id, person.tmdb_id')
+    assert allocate.startswith('INSERT INTO image_linkable')
+    assert 'VALUES (%(linkable_type_m0)s), (%(linkable_type_m1)s)' \
+           in allocate
+    # In order of the key, with the existing and the allocated ids.
+    assert [(params['tmdb_id_m{}'.format(i)], params['id_m{}'.format(i)])
+            for i in range(3)] == [(1, 7), (2, 8), (3, 9)]
+    assert insert.startswith('INSERT INTO person')
+    assert 'ON CONFLICT (tmdb_id) DO UPDATE SET' in insert
+    assert 'also_known_as = coalesce(excluded.also_known_as, ' \
+           'person.also_known_as)' in insert
+    assert insert.endswith('RETURNING person.id, person.tmdb_id')
+
+
+def test_upsert_missing_values_are_null():
+    connection = FakeConnection([(7, 1)], [(8,), (9,)],
+                                [(7, 1), (8, 2), (9, 3)])
+    upsert_people(connection)
+    _, _, (insert, params) = connection.statements
+    # Missing values, even of JSONB columns, are SQL NULL, not JSON
+    # 'null', so that the stored values are kept.
+    assert params['also_known_as_m0'] == [u'X']
+    assert 'also_known_as_m1' not in params
+    assert 'name_m2' not in params
+    assert '%(tmdb_id_m1)s), (' in insert
+    assert insert.count('NULL') == 3
+
+
+def test_upsert_unused_ids():
+    # Another process inserted person 3 in the meantime, with id 5.
+    connection = FakeConnection([(7, 1)], [(8,), (9,)],
+                                [(7, 1), (8, 2), (5, 3)])
+    assert upsert_people(connection) == {(1,): 7, (2,): 8, (3,): 5}
+    delete, params = connection.statements[-1]
+    assert delete.startswith('DELETE FROM image_linkable')
+    assert params.values() == [9]
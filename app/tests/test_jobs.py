@@ -0,0 +1,101 @@
+"""
+Tests the job queue against a fake connection, that records the
+statements it is given (compiled for PostgreSQL).
+"""
+
+from contextlib import contextmanager
+import pytest
+from sqlalchemy.dialects import postgresql
+from miner import jobs
+
+
+class FakeJob(object):
+    def __init__(self, kind, key, payload, attempts=0):
+        self.id = 1
+        self.kind, self.key, self.payload = kind, key, payload
+        self.attempts = attempts
+
+
+class FakeResult(object):
+    def __init__(self, row):
+        self.row = row
+
+    def first(self):
+        return self.row
+
+
+class FakeEngine(object):
+    def __init__(self, job=None):
+        self.job = job
+        self.statements = []
+
+    @contextmanager
+    def begin(self):
+        yield self
+
+    def execute(self, statement):
+        compiled = statement.compile(dialect=postgresql.dialect())
+        self.statements.append((str(compiled), compiled.params))
+        return FakeResult(self.job)
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    calls = []
+
+    def handle(tmdb_id):
+        calls.append(tmdb_id)
+        if tmdb_id < 0:
+            raise ValueError(tmdb_id)
+
+    monkeypatch.setitem(jobs.handlers, 'test', handle)
+    return calls
+
+
+def test_enqueue_many(monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(jobs, 'engine', engine)
+    jobs.enqueue_many([('test', 1, {'tmdb_id': 1}, 2.0),
+                       ('test', 1, {'tmdb_id': 1}, 3.0),
+                       ('test', 2, {'tmdb_id': 2}, None)])
+    (sql, params), = engine.statements
+    assert 'ON CONFLICT (kind, key) WHERE status = ' in sql
+    assert 'DO NOTHING' in sql
+    # Duplicates are left out.
+    assert sorted(value for name, value in params.items()
+                  if name.startswith('key')) == [u'1', u'2']
+    jobs.enqueue_many([])
+    assert len(engine.statements) == 1
+
+
+def test_work_one_empty(monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(jobs, 'engine', engine)
+    assert not jobs.work_one()
+    (sql, _), = engine.statements
+    assert 'ORDER BY job.priority DESC' in sql
+    assert 'FOR UPDATE SKIP LOCKED' in sql
+
+
+def test_work_one_done(monkeypatch, handled):
+    engine = FakeEngine(FakeJob('test', u'5', {'tmdb_id': 5}))
+    monkeypatch.setattr(jobs, 'engine', engine)
+    assert jobs.work_one()
+    assert handled == [5]
+    claim, delete = engine.statements
+    assert delete[0].startswith('DELETE FROM job')
+
+
+@pytest.mark.parametrize('attempts, status', [(0, 'pending'),
+                                              (jobs.max_attempts - 1,
+                                               'failed')])
+def test_work_one_failed(monkeypatch, handled, attempts, status):
+    engine = FakeEngine(FakeJob('test', u'-1', {'tmdb_id': -1},
+                                attempts))
+    monkeypatch.setattr(jobs, 'engine', engine)
+    assert jobs.work_one()
+    claim, (sql, params) = engine.statements
+    assert sql.startswith('UPDATE job')
+    assert params['attempts'] == attempts + 1
+    assert params['status'] == status
+    assert 'ValueError' in params['last_error']
@@ -0,0 +1,32 @@
+"""
+Tests the ranking statements of 'known_for' against a fake connection,
+that records the statements it is given (compiled for PostgreSQL).
+"""
+
+from sqlalchemy.dialects import postgresql
+from data import known_for
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement):
+        compiled = statement.compile(dialect=postgresql.dialect())
+        self.statements.append((str(compiled), compiled.params))
+
+
+def test_rank_keeps_productions_without_popularity():
+    connection = FakeConnection()
+    known_for._rank(connection, [1, 2])
+    (delete, _), (insert, params) = connection.statements
+    assert delete.startswith('DELETE FROM known_for')
+    assert insert.startswith('INSERT INTO known_for')
+    # The top 'top_n' with, and the top 'top_n' without popularity.
+    assert 'PARTITION BY role.person_id, production.popularity IS NULL' \
+           in insert
+    assert 'WHERE ranked.rank_in_group <= %(rank_in_group_1)s' in insert
+    assert params['rank_in_group_1'] == known_for.top_n
+    # The stored rank puts those without popularity last.
+    assert 'ORDER BY production.popularity DESC NULLS LAST, role.id' \
+           in insert
@@ -0,0 +1,56 @@
+from miner.popularity_table import (PopularityTable, write_table,
+    reload_table, current_table)
+from miner import popularity_table
+
+def test_lookup(tmpdir):
+    path = str(tmpdir.join('popularities.bin'))
+    write_table(path, [(286217, 'movie', 8.5),
+                       (1399, 'tv', 21.0),
+                       (1399, 'movie', 1.5)])
+    table = PopularityTable(path)
+    assert len(table) == 3
+    assert list(table.lookup([1399, 1399, 286217, 5],
+                             ['tv', 'movie', 'movie', 'tv'])) == \
+        [21.0, 1.5, 8.5, 0.0]
+    assert len(table.lookup([], [])) == 0
+
+def test_empty_table(tmpdir):
+    path = str(tmpdir.join('popularities.bin'))
+    write_table(path, [])
+    assert list(PopularityTable(path).lookup([1], ['movie'])) == [0.0]
+
+def test_reload_table(tmpdir, monkeypatch):
+    path = str(tmpdir.join('popularities.bin'))
+    monkeypatch.setattr(popularity_table, '_table', None)
+    monkeypatch.setattr(popularity_table, '_table_stamp', None)
+    reload_table(path)
+    assert current_table() is None
+    write_table(path, [(1, 'movie', 2.0)])
+    reload_table(path)
+    old = current_table()
+    assert list(old.lookup([1], ['movie'])) == [2.0]
+    write_table(path, [(1, 'movie', 3.0)])
+    reload_table(path)
+    assert list(current_table().lookup([1], ['movie'])) == [3.0]
+    # The old snapshot stays usable.
+    assert list(old.lookup([1], ['movie'])) == [2.0]
+
+def test_build_table_skips_failed_pages(tmpdir, monkeypatch):
+    from miner import themoviedb
+
+    def get_api_response(path, params, priority):
+        if path == '/movie/popular' and params['page'] == 2:
+            raise IOError('themoviedb.org is down')
+        media_id = {'/movie/popular': 0, '/tv/popular': 100}[path]
+        return {'total_pages': 3,
+                'results': [{'id': media_id + params['page'],
+                             'popularity': float(params['page'])}]}
+
+    monkeypatch.setattr(themoviedb, 'get_api_response', get_api_response)
+    path = str(tmpdir.join('popularities.bin'))
+    popularity_table.build_table(path)
+    table = PopularityTable(path)
+    assert len(table) == 5
+    assert list(table.lookup([1, 2, 3, 102], ['movie', 'movie', 'movie',
+                                              'tv'])) == \
+        [1.0, 0.0, 3.0, 2.0]
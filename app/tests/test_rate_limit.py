@@ -0,0 +1,47 @@
+import pytest
+from miner.rate_limit import (TokenBucket, RateLimitExceeded,
+    INTERACTIVE, BACKGROUND)
+
+def make_bucket(tmpdir, **kwargs):
+    return TokenBucket(str(tmpdir.join('bucket.json')), rate=5, per=10,
+                       background_reserve=2,
+                       max_wait={INTERACTIVE: 0, BACKGROUND: 0},
+                       **kwargs)
+
+def test_acquire(tmpdir):
+    bucket = make_bucket(tmpdir)
+    for i in range(5):
+        assert bucket.acquire(INTERACTIVE) == 0
+    with pytest.raises(RateLimitExceeded):
+        bucket.acquire(INTERACTIVE)
+    assert bucket.stats['acquired'] == 5
+    assert bucket.stats['shed'] == 1
+
+def test_background_reserve(tmpdir):
+    bucket = make_bucket(tmpdir)
+    for i in range(3):
+        bucket.acquire(BACKGROUND)
+    # The last two tokens are reserved for interactive requests.
+    with pytest.raises(RateLimitExceeded):
+        bucket.acquire(BACKGROUND)
+    bucket.acquire(INTERACTIVE)
+    bucket.acquire(INTERACTIVE)
+
+def test_shared_between_instances(tmpdir):
+    first, second = make_bucket(tmpdir), make_bucket(tmpdir)
+    for i in range(5):
+        first.acquire()
+    with pytest.raises(RateLimitExceeded):
+        second.acquire()
+
+def test_update_from_response(tmpdir):
+    bucket = make_bucket(tmpdir)
+    bucket.update_from_response({'X-RateLimit-Remaining': '1'})
+    bucket.acquire()
+    with pytest.raises(RateLimitExceeded):
+        bucket.acquire()
+    bucket = TokenBucket(str(tmpdir.join('other.json')), rate=5,
+                         max_wait={INTERACTIVE: 0})
+    bucket.update_from_response({'Retry-After': '3'}, 429)
+    with pytest.raises(RateLimitExceeded):
+        bucket.acquire()
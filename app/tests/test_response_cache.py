@@ -0,0 +1,39 @@
+from miner.response_cache import ResponseCache, make_key
+
+def make_cache(tmpdir, **kwargs):
+    return ResponseCache(str(tmpdir.join('cache.sqlite')), **kwargs)
+
+def test_make_key():
+    assert make_key('/search/multi', {'query': 'x', 'page': 1}) == \
+           make_key('search/multi/', {'page': 1, 'query': 'x',
+                                      'api_key': 'secret'})
+    assert make_key('/configuration') == '/configuration'
+
+def test_get_and_set(tmpdir):
+    cache = make_cache(tmpdir)
+    assert cache.get('/a') is None
+    cache.set('/a', '{"b": 1}')
+    assert cache.get('/a') == '{"b": 1}'
+    # Another instance (eg. in another process) sees the same entries.
+    assert make_cache(tmpdir).get('/a') == '{"b": 1}'
+    assert cache.stats == {'hits': 1, 'misses': 1}
+
+def test_ttl(tmpdir):
+    cache = make_cache(tmpdir, ttls=[(r'/changes$', 0),
+                                     (r'^/search/', 60)],
+                       default_ttl=10)
+    assert cache.ttl_for('/movie/changes') == 0
+    assert cache.ttl_for('/search/multi') == 60
+    assert cache.ttl_for('/person/1') == 10
+    cache.set('/movie/changes', '{}', 0)
+    assert cache.get('/movie/changes') is None
+    cache.set('/expired', '{}', -1)
+    assert cache.get('/expired') is None
+
+def test_evict(tmpdir):
+    cache = make_cache(tmpdir, max_entries=3)
+    for i in range(5):
+        cache.set('/{}'.format(i), '{}')
+    cache.evict()
+    assert [cache.get('/{}'.format(i)) for i in range(5)] == \
+           [None, None, '{}', '{}', '{}']
@@ -0,0 +1,20 @@
+from sqlalchemy.dialects import postgresql
+from data import search
+
+
+def test_escape_like():
+    assert search.escape_like(u'100%_!') == u'100!%!_!!'
+    assert search.escape_like(u'the martian') == u'the martian'
+
+
+def test_production_search_uses_trigram_operator():
+    statement = search._select_productions(u'the martian')
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    # The '<%' operator can use the trigram indexes, the similarity
+    # functions can't.
+    assert '<% production.name' in sql
+    assert '<% production.original_name' in sql
+
+
+def test_autocomplete_needs_a_prefix():
+    assert search.autocomplete(u' a ') == []
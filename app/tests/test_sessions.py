@@ -0,0 +1,39 @@
+from requests import Session
+from miner import sessions
+from miner.sessions import get_session, get
+
+def test_get_session():
+    session = get_session('api.themoviedb.org')
+    assert get_session('api.themoviedb.org') is session
+    assert get_session('www.google.com') is not session
+    assert get_session('api.themoviedb.org', retry_statuses=()) \
+        is not session
+    adapter = session.get_adapter('https://api.themoviedb.org/3/')
+    assert adapter._pool_maxsize == 16
+    assert adapter.max_retries.total == sessions.retries
+    assert tuple(adapter.max_retries.status_forcelist) == \
+        sessions.retry_statuses
+    adapter = get_session('example.com').get_adapter('http://example.com')
+    assert adapter._pool_maxsize == sessions.default_pool_size
+    no_retries = get_session('example.com', retry_statuses=())
+    assert not no_retries.get_adapter('http://example.com') \
+        .max_retries.status_forcelist
+
+def test_get_session_after_fork(monkeypatch):
+    session = get_session('api.themoviedb.org')
+    # Pretend this is a forked child process.
+    monkeypatch.setattr(sessions.os, 'getpid', lambda: -1)
+    child_session = get_session('api.themoviedb.org')
+    assert child_session is not session
+    assert get_session('api.themoviedb.org') is child_session
+
+def test_get_timeout(monkeypatch):
+    calls = []
+    def fake_get(self, url, **kwargs):
+        calls.append((url, kwargs))
+    monkeypatch.setattr(Session, 'get', fake_get)
+    get('http://example.com/a')
+    get('http://example.com/b', timeout=1)
+    assert calls == [('http://example.com/a',
+                      {'timeout': sessions.timeout}),
+                     ('http://example.com/b', {'timeout': 1})]
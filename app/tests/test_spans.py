@@ -0,0 +1,67 @@
+import time
+from loggers import spans
+from miner.concurrency import map_concurrently
+
+
+def test_span_tree():
+    root = spans.start_trace('GET /')
+    with spans.span('themoviedb', path='/search/multi') as span:
+        span.set(cached=True)
+        with spans.span('postgres'):
+            pass
+    with spans.span('postgres'):
+        pass
+
+    def work(i):
+        with spans.span('google_images'):
+            time.sleep(0.01)
+
+    map_concurrently(work, range(3))
+    trace = spans.end_trace(root)
+    assert [child['name'] for child in trace['children']] == \
+           ['themoviedb', 'postgres'] + 3*['google_images']
+    assert trace['children'][0]['cached']
+    assert trace['summary']['postgres']['count'] == 2
+    assert trace['summary']['google_images']['count'] == 3
+    assert trace['summary']['google_images']['duration_ms'] >= 30
+    assert spans.current_span() is None
+
+
+def test_no_trace():
+    with spans.span('postgres') as span:
+        span.set(cached=True)
+    assert spans.current_span() is None
+
+
+def test_server_timing():
+    root = spans.start_trace('GET /')
+    with spans.span('postgres'):
+        pass
+    header = spans.server_timing(root)
+    spans.end_trace(root)
+    assert header.startswith('total;dur=')
+    assert 'postgres;dur=' in header and 'desc="1 call"' in header
+
+
+def test_iterate():
+    def chunks():
+        for i in range(3):
+            time.sleep(0.01)
+            with spans.span('postgres'):
+                pass
+            yield i
+
+    root = spans.start_trace('GET /')
+    rendered = []
+    for chunk in spans.iterate('render', chunks()):
+        rendered.append(chunk)
+        # Time between the steps doesn't count.
+        time.sleep(0.02)
+    trace = spans.end_trace(root)
+    assert rendered == [0, 1, 2]
+    render, = trace['children']
+    assert render['name'] == 'render'
+    assert 30 <= render['duration_ms'] < 60
+    assert [child['name'] for child in render['children']] == \
+           3*['postgres']
+    assert list(spans.iterate('render', [1, 2])) == [1, 2]
@@ -0,0 +1,142 @@
+"""
+Tests the change feed sync against a local fake themoviedb.org.
+"""
+
+import json
+import threading
+from datetime import datetime, timedelta
+from urlparse import urlparse, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+import pytest
+from miner import themoviedb
+from miner import sync
+from miner.sync import (get_changed_ids, get_window, next_checkpoint,
+    max_window)
+
+
+class FakeTMDB(BaseHTTPRequestHandler):
+
+    # Path to list of pages (lists of entries).
+    feeds = {
+        '/3/movie/changes': [[{'id': 1}, {'id': 2}],
+                             [{'id': 2}, {'id': 3}]],
+        '/3/person/changes': [[]],
+    }
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict((key, values[0]) for key, values
+                      in parse_qs(url.query).items())
+        self.requests.append((url.path, params))
+        pages = self.feeds.get(url.path)
+        if pages is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        page = int(params.get('page', 1))
+        body = json.dumps({'page': page,
+                           'total_pages': len(pages),
+                           'results': pages[page-1]})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_tmdb(monkeypatch):
+    server = HTTPServer(('127.0.0.1', 0), FakeTMDB)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    monkeypatch.setattr(themoviedb, 'api_url',
+                        'http://127.0.0.1:{}/3'.format(server.server_port))
+    FakeTMDB.requests = []
+    yield FakeTMDB
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_changed_ids(fake_tmdb):
+    ids = get_changed_ids('movie', datetime(2016, 6, 1),
+                          datetime(2016, 6, 2, 12))
+    assert ids == set([1, 2, 3])
+    assert [params['start_date'] for path, params in fake_tmdb.requests]\
+        == ['2016-06-01', '2016-06-01']
+    assert fake_tmdb.requests[0][1]['end_date'] == '2016-06-02'
+    assert get_changed_ids('person', datetime(2016, 6, 1),
+                           datetime(2016, 6, 2)) == set()
+
+
+def test_get_window():
+    now = datetime(2016, 6, 15)
+    assert get_window('movie', datetime(2016, 6, 14), now) == \
+        datetime(2016, 6, 14)
+    # Changes older than themoviedb.org keeps are skipped.
+    assert get_window('movie', datetime(2016, 5, 1), now) == \
+        now - max_window
+
+def test_next_checkpoint():
+    synced_until, now = datetime(2016, 6, 14), datetime(2016, 6, 15)
+    assert next_checkpoint('tv', synced_until, now, [True, True]) == now
+    assert next_checkpoint('tv', synced_until, now, []) == now
+    # Failed refreshes are retried with the next poll.
+    assert next_checkpoint('tv', synced_until, now, [True, False]) == \
+        synced_until
+
+def test_refresh_deleted(monkeypatch):
+    monkeypatch.setattr(themoviedb, 'get_api_response',
+        lambda *args, **kwargs: {'status_code': 34,
+                                 'status_message': 'Not found.'})
+    ingested = []
+    monkeypatch.setattr(sync.ingest, 'ingest_credits',
+                        lambda *args: ingested.append(args))
+    sync.refresh('movie', 1)
+    assert ingested == []
+
+class FakeSession(object):
+    """ Records the transaction boundaries and the merged objects. """
+
+    def __init__(self, events, now, checkpoint=None):
+        self.events, self.now, self.checkpoint = events, now, checkpoint
+
+    def query(self, what):
+        session = self
+        class Query(object):
+            def scalar(self):
+                return session.now
+            def get(self, feed):
+                return session.checkpoint
+        return Query()
+
+    def commit(self):
+        self.events.append('commit')
+
+    def merge(self, checkpoint):
+        self.events.append(('merge', checkpoint.feed,
+                            checkpoint.synced_until))
+
+def test_sync_feed_short_transactions(monkeypatch):
+    events = []
+    now = datetime(2016, 6, 15)
+    monkeypatch.setattr(sync, 'db_session', FakeSession(events, now))
+    monkeypatch.setattr(sync, 'get_changed_ids',
+                        lambda feed, start, end: set([1, 2]))
+    monkeypatch.setattr(sync, 'get_stale_stored_ids',
+                        lambda feed, ids: sorted(ids))
+    def refresh(feed, tmdb_id):
+        events.append(('refresh', tmdb_id))
+        if tmdb_id == 2:
+            raise IOError
+    monkeypatch.setattr(sync, 'refresh', refresh)
+    assert sync.sync_feed('movie') == 1
+    # No transaction is open during the refreshes, and the checkpoint
+    # (without one yet) stays put, to retry the failed refresh.
+    assert events[:2] == ['commit', 'commit']
+    assert sorted(events[2:4]) == [('refresh', 1), ('refresh', 2)]
+    assert events[4:] == [('merge', 'movie', now - sync.initial_window),
+                          'commit']
@@ -1,5 +1,7 @@
-from miner.themoviedb import (get_api_response, cache_popularities, 
-    get_cast_filmographies)
+import pytest
+from requests import Response, HTTPError
+from miner import themoviedb, sessions
+from miner.themoviedb import get_api_response, get_cast_filmographies
 
 def test_get_api_response():
     config = get_api_response('/configuration')
@@ -9,7 +11,6 @@ def test_get_api_response():
     assert r['page'] == 2
 
 def test_get_cast_filmographies():
-    cache_popularities(1,1)
     production, cf = get_cast_filmographies('the martian')
     assert production['title'] == 'The Martian'
     assert cf[0]['role']['character'] == 'Mark Watney'
@@ -20,3 +21,66 @@ def test_get_cast_filmographies():
     tv_shows = [production['name'] for production in \
         cf[0]['filmography'] if production['media_type'] == 'tv']
     assert 'De Wereld Draait Door' in tv_shows
+
+class StubRateLimiter(object):
+    def acquire(self, priority=None):
+        return 0
+    def update_from_response(self, headers, status_code=200):
+        pass
+
+def make_response(status_code, body):
+    r = Response()
+    r.status_code = status_code
+    r._content = body
+    return r
+
+def test_get_api_response_rate_limited(monkeypatch):
+    requests = []
+    def get(url, params, **kwargs):
+        requests.append(url)
+        return make_response(429, '{"status_code": 25}')
+    monkeypatch.setattr(themoviedb, 'get', get)
+    monkeypatch.setattr(themoviedb, 'rate_limiter', StubRateLimiter())
+    with pytest.raises(HTTPError):
+        get_api_response('/movie/popular', use_cache=False)
+    assert len(requests) == themoviedb.max_rate_limit_retries + 1
+
+def test_get_api_response_retried(monkeypatch):
+    responses = [make_response(429, '{}'), make_response(200, '{"page": 1}')]
+    monkeypatch.setattr(themoviedb, 'get',
+                        lambda url, params, **kwargs: responses.pop(0))
+    monkeypatch.setattr(themoviedb, 'rate_limiter', StubRateLimiter())
+    assert get_api_response('/movie/popular', use_cache=False) == \
+        {'page': 1}
+
+def test_get_api_response_server_error(monkeypatch):
+    responses = [make_response(503, ''), make_response(200, '{"page": 1}')]
+    def get(url, params, retry_statuses):
+        # Server errors are retried here, behind the rate limiter.
+        assert retry_statuses == ()
+        return responses.pop(0)
+    monkeypatch.setattr(themoviedb, 'get', get)
+    monkeypatch.setattr(themoviedb, 'rate_limiter', StubRateLimiter())
+    monkeypatch.setattr(sessions, 'backoff_factor', 0)
+    assert get_api_response('/movie/popular', use_cache=False) == \
+        {'page': 1}
+
+def test_get_api_response_errors(monkeypatch):
+    responses = []
+    monkeypatch.setattr(themoviedb, 'get',
+                        lambda url, params, **kwargs: responses.pop(0))
+    monkeypatch.setattr(themoviedb, 'rate_limiter', StubRateLimiter())
+    monkeypatch.setattr(sessions, 'backoff_factor', 0)
+    # Out of retries for a server error.
+    responses.extend(make_response(503, '<html>') for _ in
+                     xrange(sessions.retries + 1))
+    with pytest.raises(HTTPError):
+        get_api_response('/movie/popular', use_cache=False)
+    assert responses == []
+    responses.append(make_response(401, '{"status_code": 7}'))
+    with pytest.raises(HTTPError):
+        get_api_response('/movie/popular', use_cache=False)
+    # Callers handle missing resources themselves.
+    responses.append(make_response(404, '{"status_code": 34}'))
+    assert get_api_response('/movie/0', use_cache=False) == \
+        {'status_code': 34}
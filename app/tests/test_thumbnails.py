@@ -0,0 +1,14 @@
+import hashlib
+from miner import thumbnails
+
+
+def test_store_is_content_addressed(tmpdir, monkeypatch):
+    monkeypatch.setattr(thumbnails, 'root', str(tmpdir))
+    content = b'\xff\xd8\xff thumbnail'
+    path = thumbnails.store(content, 'image/jpeg')
+    digest = hashlib.sha1(content).hexdigest()
+    assert path == 'thumbs/{}/{}.jpg'.format(digest[:2], digest)
+    assert tmpdir.join(path).read_binary() == content
+    # Storing the same contents again gives the same path.
+    assert thumbnails.store(content, 'image/jpeg; charset=binary') == path
+    assert len(tmpdir.join('thumbs', digest[:2]).listdir()) == 1
@@ -0,0 +1,70 @@
+from sqlalchemy.exc import DataError
+from data.votes import VoteBuffer
+from webapp import webapp
+
+
+def test_votes_are_aggregated():
+    written = []
+    buffer = VoteBuffer(write=written.append, flush_interval=60,
+                        max_votes=4)
+    buffer.add(7)
+    buffer.add(3, up=False)
+    buffer.add(7)
+    assert written == []
+    # The fourth vote fills the buffer.
+    buffer.add(3)
+    assert written == [[(3, 1, 1), (7, 2, 0)]]
+    assert buffer.flush() == 0
+
+
+def test_failed_flushes_are_retried():
+    written = []
+
+    def write(counts):
+        if not written:
+            written.append(None)
+            raise IOError('database down')
+        written.append(counts)
+
+    buffer = VoteBuffer(write=write, flush_interval=60)
+    buffer.add(1)
+    assert buffer.flush() == 0
+    buffer.add(1, up=False)
+    assert buffer.flush() == 2
+    assert written == [None, [(1, 1, 1)]]
+
+
+def test_vote_route_validates_input(monkeypatch):
+    voted = []
+    monkeypatch.setattr(webapp.votes, 'vote',
+                        lambda link_id, up: voted.append((link_id, up)))
+    client = webapp.app.test_client()
+    assert client.post('/api/vote', data={'link_id': '5',
+                                          'vote': 'up'}).status_code == 202
+    assert client.post('/api/vote', data={'link_id': '5',
+                                          'vote': 'sideways'})\
+                 .status_code == 400
+    for link_id in ('0', '-3', str(2**31), '5.5'):
+        assert client.post('/api/vote', data={'link_id': link_id,
+                                              'vote': 'up'})\
+                     .status_code == 400
+    assert voted == [(5, True)]
+
+
+def test_rejected_votes_are_dropped():
+    written = []
+
+    def write(counts):
+        if any(link_id == 2 for link_id, _, _ in counts):
+            raise DataError('UPDATE image_link ...', {},
+                            ValueError('integer out of range'))
+        written.append(counts)
+
+    buffer = VoteBuffer(write=write, flush_interval=60)
+    buffer.add(1)
+    buffer.add(2)
+    buffer.add(3, up=False)
+    # The votes on 2 are dropped, and not retried.
+    assert buffer.flush() == 2
+    assert written == [[(1, 1, 0)], [(3, 0, 1)]]
+    assert buffer.flush() == 0
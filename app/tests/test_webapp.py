@@ -0,0 +1,75 @@
+from miner.response_cache import ResponseCache
+from webapp import webapp
+
+
+def test_normalize_query():
+    assert webapp.normalize_query(u'  The   Martian ') == u'the martian'
+    assert webapp.page_key('/', u'The Martian') == \
+           webapp.page_key('/', u'the  martian')
+
+
+def test_cached_page_supports_conditional_get(tmpdir, monkeypatch):
+    monkeypatch.setattr(webapp, 'page_cache_enabled', True)
+    monkeypatch.setattr(webapp, 'page_cache',
+                        ResponseCache(str(tmpdir.join('pages.sqlite'))))
+    webapp.cache_page(webapp.page_key('/', u'the martian'),
+                      u'<h1>The Martian</h1>', complete=True)
+    client = webapp.app.test_client()
+    response = client.get('/?q=The+Martian')
+    assert response.status_code == 200
+    assert response.data == b'<h1>The Martian</h1>'
+    assert 'max-age=600' in response.headers['Cache-Control']
+    assert response.headers['Server-Timing'].startswith('total;dur=')
+    etag = response.headers['ETag']
+    response = client.get('/?q=the+martian',
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_incomplete_pages_expire_sooner(tmpdir, monkeypatch):
+    monkeypatch.setattr(webapp, 'page_cache_enabled', True)
+    monkeypatch.setattr(webapp, 'page_cache',
+                        ResponseCache(str(tmpdir.join('pages.sqlite'))))
+    key = webapp.page_key('/', u'the martian')
+    assert webapp.cache_page(key, u'...', complete=False) == \
+           webapp.incomplete_page_max_age
+    assert webapp.get_cached_page(key) == \
+           (u'...', webapp.incomplete_page_max_age)
+
+
+def test_add_images_serves_stale_images(monkeypatch):
+    stale = [{'thumb_url': 'stale.jpg'}]
+    monkeypatch.setattr(webapp.image_store, 'get_many_images',
+                        lambda lookups, limit: [(stale, False),
+                                                (None, False),
+                                                ([], True)])
+    enqueued = []
+    monkeypatch.setattr(webapp.jobs, 'enqueue_many', enqueued.extend)
+    production = {'id': 1, 'media_type': 'movie', 'popularity': 3.0}
+    cast_entry = {'role': {'credit_id': 'a'},
+                  'filmography': [{'credit_id': 'b'}, {'credit_id': 'c'},
+                                  {'credit_id': 'd'}]}
+    webapp.add_images(production, cast_entry, 2, 4)
+    assert cast_entry['role']['images_metadata'] == stale
+    assert [credit['images_metadata']
+            for credit in cast_entry['filmography']] == [None, []]
+    # The stale and the missing images are searched for again.
+    assert [key for kind, key, payload, priority in enqueued] == ['a', 'b']
+
+
+def test_failed_filmographies_are_placeholders():
+    images = [{'thumb_url': 'a.jpg'}]
+    cast_entry = {'role': {'images_metadata': images},
+                  'filmography': [{'images_metadata': images}],
+                  'complete': True}
+    assert not webapp.has_placeholders(cast_entry)
+    cast_entry['complete'] = False
+    assert webapp.has_placeholders(cast_entry)
+
+
+def test_completeness_flag_is_not_served():
+    cast_entry = {'role': {'images_metadata': []},
+                  'filmography': [], 'complete': False}
+    assert webapp.pop_placeholders(cast_entry)
+    assert 'complete' not in cast_entry
@@ -1,17 +1,25 @@
-from miner.themoviedb import get_api_response
+from miner.themoviedb import get_api_response, BACKGROUND
+from miner.concurrency import map_concurrently
 from math import log10
 from numpy import logspace
 
 # '/tv/popular' or '/movie/popular'
 resource = '/tv/popular'
-total_pages = get_api_response(resource).get('total_pages')
+total_pages = get_api_response(resource,
+                               priority=BACKGROUND).get('total_pages')
 
 # Make a number of logaritmically spaced page numbers
 pages = logspace(0, log10(total_pages), num=40)
 
 # Make page numbers integer and remove duplicates.
-for page in sorted(list(set(map(int, map(round, pages))))):
-    response = get_api_response(resource, {'page': page})
+pages = sorted(list(set(map(int, map(round, pages)))))
+
+# Request the pages concurrently.
+responses = map_concurrently(
+    lambda page: get_api_response(resource, {'page': page}, BACKGROUND),
+    pages, max_workers=4)
+
+for page, response in zip(pages, responses):
     s = 'Page {:>4} - Rank {:>6}: '.format(page, 1+20*(page-1))
     # {name} for tv, {title} for movies
     s += 'id:{id:>7}, pop:{popularity:>11.6f}, title: {name}'.format(
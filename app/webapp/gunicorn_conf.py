@@ -1,10 +1,26 @@
+import os
 from multiprocessing import cpu_count
 
 bind      = '0.0.0.0:8000'
-workers   = cpu_count() * 2 + 1
+# A rule of thumb. Measure the best number for a machine with
+# 'benchmarks/load_test.py', and set it with GUNICORN_WORKERS.
+workers   = int(os.getenv('GUNICORN_WORKERS', cpu_count() * 2 + 1))
 
 # Also set:
 # access-logfile, error-logfile, access-logformat, error-logformat
 
 # All possible settings:
 # docs.gunicorn.org/en/stable/settings.html
+
+
+def post_fork(server, worker):
+    # Swap in new versions of the shared popularity table, which the
+    # miner builds (see 'miner/popularity_table.py').
+    from miner.popularity_table import start_reloader
+    start_reloader()
+
+
+def worker_exit(server, worker):
+    # Write the votes that are still buffered (see 'data/votes.py').
+    from data import votes
+    votes.buffer.flush()
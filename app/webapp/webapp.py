@@ -5,10 +5,20 @@ Lets the user search for movies, TV shows and people, and shows them
 images of roles that people played in different productions.
 """
 
-from flask import Flask, request, render_template
+import hashlib
+import json
+import os
+import tempfile
+from flask import (Flask, Response, request, g, render_template, jsonify,
+                   stream_with_context)
+from loggers import spans
 from data.db_conn import db_session
-from miner import themoviedb
-from miner import google_images
+from data import filmographies
+from data import image_store
+from data import search as name_search
+from data import votes
+from miner import jobs
+from miner.response_cache import ResponseCache, make_key
 
 
 def get_cast_filmographies_with_images(query, num_cast_members=4,
@@ -20,46 +30,200 @@ def get_cast_filmographies_with_images(query, num_cast_members=4,
     images per production to the supplied numbers. Returns two items:
     1. The name of the production best matching the given query;
     2. The cast filmographies with images, as described above.
+    The images come from the image store. Roles without stored images
+    get None as 'images_metadata', and the page shows placeholders
+    instead. For those roles, and for stale filmographies, jobs are
+    added to the queue (see 'jobs'), so that they are there for the
+    next visitors.
+    """
+    production_title, cast_filmographies = \
+        iter_cast_filmographies_with_images(query, num_cast_members,
+                                            num_productions, num_images)
+    if cast_filmographies is not None:
+        cast_filmographies = list(cast_filmographies)
+    return production_title, cast_filmographies
+
+
+def iter_cast_filmographies_with_images(query, num_cast_members=4,
+                                        num_productions=4,
+                                        num_images=4):
+    """ Like `get_cast_filmographies_with_images`, but returns an
+    iterator over the cast filmographies, which yields each cast
+    member (with images) as soon as they are ready.
     """
     if query is None:
-        production_title = None
-        cast_filmographies = None
+        return None, None
+    production, cast_filmographies = filmographies.\
+            iter_cast_filmographies(query, num_cast_members,
+                                    enqueue_stale=True)
+    # Fetch the title of the production.
+    if production['media_type'] == 'movie':
+        title_key = 'title'
     else:
-        production, cast_filmographies = themoviedb.\
-                                    get_cast_filmographies(query)
-        # Fetch the title of the production.
-        if production['media_type'] == 'movie':
-            title_key = 'title'
-        else:
-            title_key = 'name'
-        production_title = production[title_key]
-        # Limit the number of cast members.
-        cast_filmographies = cast_filmographies[:num_cast_members]
-        # Add a limited number of images for each of the cast member's
-        # roles. Also limit the number of roles per cast member.
-        for cast_entry in cast_filmographies:
-            cast_entry['filmography'] = \
-                        cast_entry['filmography'][:num_productions]
-            cast_entry['role']['images_metadata'] = google_images.\
-                                get_search_results_metadata(
-                                    production_title,
-                                    cast_entry['role']['name'],
-                                    cast_entry['role']['character']
-                                )[:num_images]
-            for credit in cast_entry['filmography']:
-                credit_title_key = 'title' \
-                        if credit['media_type'] == 'movie' else 'name'
-                credit['images_metadata'] = google_images.\
-                                    get_search_results_metadata(
-                                        credit[credit_title_key],
-                                        cast_entry['role']['name'],
-                                        credit['character']
-                                    )[:num_images]
+        title_key = 'name'
+    production_title = production[title_key]
+    cast_filmographies = (add_images(production, cast_entry,
+                                     num_productions, num_images)
+                          for cast_entry in cast_filmographies)
     return production_title, cast_filmographies
 
 
+def add_images(production, cast_entry, num_productions, num_images):
+    """ Limits the filmography of the given cast entry to
+    'num_productions' roles, and adds (at most 'num_images') stored
+    images to the main role and to each of these roles. Enqueues
+    searches for the roles without fresh images: stale images are
+    shown until the new ones are stored. Returns the cast entry.
+    """
+    cast_entry['filmography'] = \
+                cast_entry['filmography'][:num_productions]
+    role = cast_entry['role']
+    # Each lookup is a tuple of the role or credit to add the images
+    # to, and the (production, person, credit) to look up.
+    lookups = [(role, (production, role, role))]
+    for credit in cast_entry['filmography']:
+        lookups.append((credit, (credit, role, credit)))
+    images = image_store.get_many_images(
+                 [terms for _, terms in lookups], num_images)
+    # Roles in more popular productions are searched first.
+    jobs.enqueue_many(
+        [('scrape_images', credit['credit_id'],
+          {'production': search_production,
+           'person': person,
+           'credit': credit},
+          search_production.get('popularity'))
+         for (_, (search_production, person, credit)), (_, fresh)
+         in zip(lookups, images) if not fresh])
+    for (item, _), (metadata, _) in zip(lookups, images):
+        item['images_metadata'] = metadata
+    return cast_entry
+
+
+def stream_template(template_name, **context):
+    """ Like Flask's `render_template`, but returns an iterator over
+    the rendered page, which renders as far as it can with the data
+    that is ready.
+    """
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    return template.stream(context)
+
+
+def has_placeholders(cast_entry):
+    """ Tells whether some roles of the given cast entry have no images
+    (yet), or whether its filmography is missing (eg. because it could
+    not be refreshed).
+    """
+    return not cast_entry.get('complete', True) or \
+           cast_entry['role'].get('images_metadata') is None or \
+           any(credit.get('images_metadata') is None
+               for credit in cast_entry['filmography'])
+
+
+def pop_placeholders(cast_entry):
+    """ Like `has_placeholders`, but also removes the internal
+    'complete' flag from the cast entry, which is not part of the page
+    (or of the JSON).
+    """
+    placeholders = has_placeholders(cast_entry)
+    cast_entry.pop('complete', None)
+    return placeholders
+
+
+# ---------------------- Response cache -------------------------------
+
+def normalize_query(query):
+    """ Lowercases the given query and collapses its whitespace, so that
+    equivalent queries share their cached responses.
+    """
+    if query is None:
+        return None
+    return u' '.join(query.lower().split())
+
+
+def page_key(route, query):
+    """ Returns the response cache key for the given route and query.
+    """
+    query = normalize_query(query)
+    return make_key(route, {'q': query.encode('utf-8')}
+                           if query is not None else None)
+
+
+def get_cached_page(key):
+    """ Returns a cached response body and its max age in seconds, or
+    None.
+    """
+    if not page_cache_enabled:
+        return None
+    value = page_cache.get(key)
+    if value is None:
+        return None
+    entry = json.loads(value)
+    return entry['body'], entry['max_age']
+
+
+def cache_page(key, body, complete):
+    """ Stores a response body in the response cache. Pages with image
+    placeholders expire sooner, so that the images show up once they
+    are scraped.
+    """
+    max_age = page_max_age if complete else incomplete_page_max_age
+    if page_cache_enabled:
+        page_cache.set(key, json.dumps({'body': body,
+                                        'max_age': max_age}), max_age)
+    return max_age
+
+
+def cacheable_response(body, mimetype, max_age):
+    """ Returns a response with the given body, a strong ETag, and a
+    Cache-Control header that lets browsers and nginx reuse it for
+    'max_age' seconds. Answers conditional requests with a body-less
+    '304 Not Modified'.
+    """
+    response = Response(body, mimetype=mimetype)
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    response.set_etag(hashlib.sha1(body).hexdigest())
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+
+def cache_stream(key, chunks, is_complete):
+    """ Yields the given chunks of a response, and caches the whole
+    response once they are all sent. 'is_complete' is called then, to
+    tell whether the page is complete (see `cache_page`). Nothing is
+    cached when the client disconnects early.
+    """
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache_page(key, u''.join(parts), is_complete())
+
+
 # --------------------------------------------------------------------
 
+# Send the page in parts, as soon as each part is ready (see `search`).
+stream_pages = os.getenv('STREAM_PAGES', 'on') != 'off'
+
+# Rendered pages and API responses, shared by all web workers, and
+# keyed on the route and the normalized query.
+page_cache_enabled = os.getenv('PAGE_CACHE', 'on') != 'off'
+page_cache = ResponseCache(
+    os.getenv('PAGE_CACHE_FILE',
+              os.path.join(tempfile.gettempdir(),
+                           'filmograph_pages.sqlite')),
+    max_entries=10000)
+
+# Seconds that we, browsers and nginx may reuse a response, and a
+# response with image placeholders.
+page_max_age = 600
+incomplete_page_max_age = 30
+
+# Images per role.
+num_images = 4
+
 # Create the Flask WSGI application, our central webapp object.
 # The app should be run from the main directory, eg:
 # python webapp/webapp.py
@@ -73,15 +237,137 @@ def shutdown_sessions(exception=None):
     db_session.remove()
 
 
+# Time each request (see 'loggers/spans.py').
+@app.before_request
+def start_trace():
+    g.trace = spans.start_trace(u'{} {}'.format(request.method,
+                                               request.path),
+                                query=request.args.get('q'))
+
+
+@app.after_request
+def add_server_timing(response):
+    trace = g.get('trace')
+    if trace is not None:
+        # For streamed pages, this only covers the time until the
+        # first byte. The logged trace covers the whole page.
+        response.headers['Server-Timing'] = spans.server_timing(trace)
+        trace.set(status=response.status_code)
+        response.call_on_close(lambda: spans.end_trace(trace))
+    return response
+
+
 # Respond to requests at the root url.
 @app.route('/')
 def search():
     query = request.args.get('q')
+    key = page_key('/', query)
+    cached = get_cached_page(key)
+    if cached is not None:
+        body, max_age = cached
+        return cacheable_response(body, 'text/html', max_age)
+    if not stream_pages:
+        production_title, cast_filmographies = \
+            get_cast_filmographies_with_images(query,
+                                               num_images=num_images)
+        # (A list, not a generator: every entry must be stripped.)
+        complete = not any([pop_placeholders(cast_entry)
+                            for cast_entry in cast_filmographies or []])
+        with spans.span('render'):
+            page = render_template('production.html',
+                                   production_title=production_title,
+                                   cast_filmographies=cast_filmographies,
+                                   num_images=num_images)
+        return cacheable_response(page, 'text/html',
+                                  cache_page(key, page, complete))
+    # The page shell and the production title are sent right away, and
+    # each cast member as soon as their filmography and images are
+    # ready. (The search itself still happens before the first byte).
+    production_title, cast_filmographies = \
+        iter_cast_filmographies_with_images(query,
+                                            num_images=num_images)
+    incomplete = []
+
+    def watch(cast_filmographies):
+        for cast_entry in cast_filmographies:
+            if pop_placeholders(cast_entry):
+                incomplete.append(cast_entry)
+            yield cast_entry
+
+    if cast_filmographies is not None:
+        cast_filmographies = watch(cast_filmographies)
+    # (The time spent rendering includes the time spent waiting for
+    # the cast filmographies.)
+    page = spans.iterate('render',
+                         stream_template('production.html',
+                                         production_title=production_title,
+                                         cast_filmographies=cast_filmographies,
+                                         num_images=num_images))
+    # The page is cached once it is sent. Its ETag depends on the whole
+    # page, so only the cached copy has one.
+    page = cache_stream(key, page, lambda: not incomplete)
+    response = Response(stream_with_context(page))
+    response.cache_control.public = True
+    response.cache_control.max_age = incomplete_page_max_age
+    # Ask nginx not to buffer the response (see 'proxy/nginx.conf').
+    # Nginx doesn't cache unbuffered responses either, but it will
+    # cache the next, cached, response.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# The cast filmographies with images, as JSON.
+@app.route('/api/cast_filmographies')
+def api_cast_filmographies():
+    query = request.args.get('q')
+    if query is None:
+        response = jsonify(error=u"Missing the 'q' parameter.")
+        response.status_code = 400
+        return response
+    key = page_key('/api/cast_filmographies', query)
+    cached = get_cached_page(key)
+    if cached is not None:
+        body, max_age = cached
+        return cacheable_response(body, 'application/json', max_age)
     production_title, cast_filmographies = \
-        get_cast_filmographies_with_images(query)
-    return render_template('production.html',
-                           production_title=production_title,
-                           cast_filmographies=cast_filmographies)
+        get_cast_filmographies_with_images(query, num_images=num_images)
+    # (A list, not a generator: every entry must be stripped.)
+    complete = not any([pop_placeholders(cast_entry)
+                        for cast_entry in cast_filmographies])
+    # Sorted keys make equal responses byte-for-byte equal, and so
+    # give them equal ETags.
+    body = json.dumps({'production_title': production_title,
+                       'cast_filmographies': cast_filmographies},
+                      sort_keys=True)
+    return cacheable_response(body, 'application/json',
+                              cache_page(key, body, complete))
+
+
+# Vote an image up or down ('link_id' is in its metadata).
+@app.route('/api/vote', methods=['POST'])
+def vote():
+    try:
+        link_id = int(request.form['link_id'])
+        up = {'up': True, 'down': False}[request.form['vote']]
+        if not 1 <= link_id <= votes.max_link_id:
+            raise ValueError(link_id)
+    except (KeyError, ValueError):
+        response = jsonify(error=u"Expected a 'link_id' and a 'vote' "
+                                 u"('up' or 'down').")
+        response.status_code = 400
+        return response
+    # Counted in memory and written in batches (see 'votes').
+    votes.vote(link_id, up)
+    response = jsonify(accepted=True)
+    response.status_code = 202
+    return response
+
+
+# Suggest names while the user types a query.
+@app.route('/autocomplete')
+def autocomplete():
+    prefix = request.args.get('q', u'')
+    return jsonify(results=name_search.autocomplete(prefix))
 
 
 if __name__ == '__main__':